@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+analitica.py
+Analítica de ventas a partir de resúmenes diarios (migración 008).
+
+- Las escrituras en pedidos/detalle_pedidos anotan el día afectado en
+  analitica_cambios (triggers). refrescar() recalcula solo esos días, en
+  lotes de ANALITICA_LOTE_DIAS, y borra sus anotaciones en la misma
+  transacción. Un cambio que se confirma mientras tanto deja su propia
+  anotación y entra en el refresco siguiente.
+- Recalcular un día cuesta lo que sus pedidos, no lo que el historial.
+- Un advisory lock deja refrescar a un solo worker a la vez; los demás
+  siguen de largo.
+- Un hilo por worker refresca cada ANALITICA_REFRESCO_SEGUNDOS; el panel no
+  refresca nada y puede ir hasta ese tiempo por detrás de los pedidos.
+- resumen_ventas() lee solo los resúmenes (más los nombres de los productos
+  del top).
+
+Uso:
+    refrescar(conn)
+    datos = resumen_ventas(conn, desde, hasta)
+
+    python analitica.py refrescar     # lo pendiente (cron)
+    python analitica.py reconstruir   # todo desde cero (backfill)
+    python analitica.py estado
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from bd_config import db_connection, get_connection
+
+ANALITICA_REFRESCO_SEGUNDOS = int(os.getenv("ANALITICA_REFRESCO_SEGUNDOS", 60))
+ANALITICA_LOTE_DIAS = int(os.getenv("ANALITICA_LOTE_DIAS", 31))
+ANALITICA_TOP_PRODUCTOS = int(os.getenv("ANALITICA_TOP_PRODUCTOS", 10))
+
+# Clave arbitraria para pg_advisory_xact_lock (distinta de la de migraciones.py)
+_LOCK_KEY = 471100025
+
+_ESTADO_CANCELADO = "Cancelado"
+
+
+def _cop_int(value):
+    """NUMERIC de la BD -> entero COP (sin decimales)."""
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(Decimal('1')))
+
+
+def _recalcular(conn, dias):
+    """Reemplaza las filas de `dias` en los tres resúmenes (sin commit)."""
+    for tabla in ("ventas_dia_producto", "ventas_dia_estado_us", "ventas_dia_estado_pedido"):
+        conn.run(f"DELETE FROM {tabla} WHERE dia = ANY(CAST(:dias AS DATE[]));", dias=dias)
+
+    conn.run("""
+        INSERT INTO ventas_dia_producto (dia, id_producto, pedidos, unidades, ingresos)
+        SELECT d.dia, dp.id_producto, COUNT(DISTINCT p.id), SUM(dp.cantidad), SUM(dp.subtotal)
+        FROM unnest(CAST(:dias AS DATE[])) AS d(dia)
+        JOIN pedidos p ON p.fecha_pedido >= d.dia AND p.fecha_pedido < d.dia + 1
+        JOIN detalle_pedidos dp ON dp.id_pedido = p.id
+        WHERE p.estado IS DISTINCT FROM :cancelado
+        GROUP BY d.dia, dp.id_producto;
+    """, dias=dias, cancelado=_ESTADO_CANCELADO)
+
+    conn.run("""
+        INSERT INTO ventas_dia_estado_us (dia, estado_us, pedidos, unidades, ingresos)
+        SELECT d.dia, COALESCE(NULLIF(u.estado, ''), '—'), COUNT(*),
+               COALESCE(SUM(l.unidades), 0), SUM(p.total)
+        FROM unnest(CAST(:dias AS DATE[])) AS d(dia)
+        JOIN pedidos p ON p.fecha_pedido >= d.dia AND p.fecha_pedido < d.dia + 1
+        LEFT JOIN usuarios u ON u.id = p.id_usuario
+        LEFT JOIN LATERAL (
+            SELECT SUM(dp.cantidad) AS unidades FROM detalle_pedidos dp WHERE dp.id_pedido = p.id
+        ) l ON TRUE
+        WHERE p.estado IS DISTINCT FROM :cancelado
+        GROUP BY d.dia, COALESCE(NULLIF(u.estado, ''), '—');
+    """, dias=dias, cancelado=_ESTADO_CANCELADO)
+
+    conn.run("""
+        INSERT INTO ventas_dia_estado_pedido (dia, estado, pedidos, ingresos)
+        SELECT d.dia, COALESCE(p.estado, 'Pendiente'), COUNT(*), SUM(p.total)
+        FROM unnest(CAST(:dias AS DATE[])) AS d(dia)
+        JOIN pedidos p ON p.fecha_pedido >= d.dia AND p.fecha_pedido < d.dia + 1
+        GROUP BY d.dia, COALESCE(p.estado, 'Pendiente');
+    """, dias=dias)
+
+
+def refrescar(conn, lote_dias=ANALITICA_LOTE_DIAS):
+    """
+    Recalcula los días pendientes en lotes de `lote_dias` (una transacción
+    por lote). Devuelve cuántos días recalculó; 0 si otro worker está
+    refrescando o no había nada pendiente.
+    """
+    total = 0
+    while True:
+        try:
+            if not conn.run("SELECT pg_try_advisory_xact_lock(:k);", k=_LOCK_KEY)[0][0]:
+                conn.rollback()
+                break
+            dias = sorted({r[0] for r in conn.run("""
+                DELETE FROM analitica_cambios
+                WHERE dia IN (
+                    SELECT DISTINCT dia FROM analitica_cambios ORDER BY dia LIMIT :n
+                )
+                RETURNING dia;
+            """, n=lote_dias)})
+            if not dias:
+                conn.rollback()
+                break
+            _recalcular(conn, dias)
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        total += len(dias)
+    return total
+
+
+def reconstruir(conn):
+    """Borra los resúmenes y los recalcula desde todos los pedidos. Devuelve los días."""
+    try:
+        # Espera a que termine cualquier refresco en curso. DELETE y no
+        # TRUNCATE: el panel sigue leyendo los resúmenes viejos hasta el commit
+        conn.run("SELECT pg_advisory_xact_lock(:k);", k=_LOCK_KEY)
+        conn.run("DELETE FROM analitica_cambios;")
+        for tabla in ("ventas_dia_producto", "ventas_dia_estado_us", "ventas_dia_estado_pedido"):
+            conn.run(f"DELETE FROM {tabla};")
+        dias = [r[0] for r in conn.run("""
+            SELECT DISTINCT CAST(fecha_pedido AS DATE) FROM pedidos
+            WHERE fecha_pedido IS NOT NULL ORDER BY 1;
+        """)]
+        if dias:
+            _recalcular(conn, dias)
+        conn.commit()
+        return len(dias)
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+
+
+def pendientes(conn):
+    """(anotaciones, días distintos) sin refrescar."""
+    fila = conn.run("SELECT COUNT(*), COUNT(DISTINCT dia) FROM analitica_cambios;")[0]
+    conn.rollback()
+    return fila[0], fila[1]
+
+
+# ---------------------------------------------------------
+# LECTURA (solo resúmenes)
+# ---------------------------------------------------------
+def resumen_ventas(conn, desde, hasta, top=ANALITICA_TOP_PRODUCTOS):
+    """
+    Ventas entre `desde` y `hasta` (fechas, ambas incluidas):
+
+    - totales:       pedidos, unidades e ingresos (sin cancelados)
+    - por_dia:       [{dia, pedidos, ingresos}] con todos los estados de pedido
+    - por_estado:    [{estado, pedidos, ingresos}] estado del pedido
+    - por_estado_us: [{estado_us, pedidos, unidades, ingresos}]
+    - top_productos: [{id, nombre, pedidos, unidades, ingresos}]
+
+    Importes en COP enteros.
+    """
+    rango = {"desde": desde, "hasta": hasta}
+
+    por_dia = [
+        {"dia": r[0].isoformat(), "pedidos": r[1], "ingresos": _cop_int(r[2])}
+        for r in conn.run("""
+            SELECT dia, SUM(pedidos), SUM(ingresos)
+            FROM ventas_dia_estado_pedido
+            WHERE dia BETWEEN :desde AND :hasta
+            GROUP BY dia ORDER BY dia;
+        """, **rango)
+    ]
+    por_estado = [
+        {"estado": r[0], "pedidos": r[1], "ingresos": _cop_int(r[2])}
+        for r in conn.run("""
+            SELECT estado, SUM(pedidos), SUM(ingresos)
+            FROM ventas_dia_estado_pedido
+            WHERE dia BETWEEN :desde AND :hasta
+            GROUP BY estado ORDER BY 2 DESC;
+        """, **rango)
+    ]
+    por_estado_us = [
+        {"estado_us": r[0], "pedidos": r[1], "unidades": r[2], "ingresos": _cop_int(r[3])}
+        for r in conn.run("""
+            SELECT estado_us, SUM(pedidos), SUM(unidades), SUM(ingresos)
+            FROM ventas_dia_estado_us
+            WHERE dia BETWEEN :desde AND :hasta
+            GROUP BY estado_us ORDER BY 4 DESC;
+        """, **rango)
+    ]
+    top_productos = [
+        {"id": r[0], "nombre": r[1] or f"Producto #{r[0]}", "pedidos": r[2], "unidades": r[3],
+         "ingresos": _cop_int(r[4])}
+        for r in conn.run("""
+            SELECT v.id_producto, pr.nombre, v.pedidos, v.unidades, v.ingresos
+            FROM (
+                SELECT id_producto, SUM(pedidos) AS pedidos, SUM(unidades) AS unidades, SUM(ingresos) AS ingresos
+                FROM ventas_dia_producto
+                WHERE dia BETWEEN :desde AND :hasta
+                GROUP BY id_producto
+                ORDER BY 4 DESC
+                LIMIT :top
+            ) v
+            LEFT JOIN productos pr ON pr.id = v.id_producto
+            ORDER BY v.ingresos DESC;
+        """, top=top, **rango)
+    ]
+    conn.rollback()
+
+    totales = {
+        "pedidos": sum(e["pedidos"] for e in por_estado_us),
+        "unidades": sum(e["unidades"] for e in por_estado_us),
+        "ingresos": sum(e["ingresos"] for e in por_estado_us),
+    }
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "totales": totales,
+        "por_dia": por_dia,
+        "por_estado": por_estado,
+        "por_estado_us": por_estado_us,
+        "top_productos": top_productos,
+    }
+
+
+def rango_por_defecto(dias=30):
+    hasta = date.today()
+    return hasta - timedelta(days=dias - 1), hasta
+
+
+# ---------------------------------------------------------
+# REFRESCO EN SEGUNDO PLANO
+# ---------------------------------------------------------
+class Refrescador:
+    """Hilo del worker que refresca los resúmenes cada ANALITICA_REFRESCO_SEGUNDOS."""
+
+    def __init__(self, intervalo=ANALITICA_REFRESCO_SEGUNDOS):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def refrescar(self):
+        with db_connection() as conn:
+            dias = refrescar(conn)
+        if dias:
+            print(f"📊 Resúmenes de ventas: {dias} día(s) recalculados")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.refrescar()
+            except Exception as e:
+                print(f"❌ Error refrescando la analítica: {e}")
+
+    def asegurar(self):
+        """Arranca el hilo del worker (una vez por proceso, también tras un fork)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="analitica-refresco", daemon=True)
+            self._thread.start()
+
+
+_refrescador = Refrescador()
+
+
+def asegurar_refresco():
+    _refrescador.asegurar()
+
+
+def main(args):
+    orden = args[0] if args else "refrescar"
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        return 1
+    try:
+        if orden == "refrescar":
+            inicio = time.perf_counter()
+            dias = refrescar(conn)
+            print(f"✅ {dias} día(s) recalculados en {time.perf_counter() - inicio:.1f} s")
+        elif orden == "reconstruir":
+            inicio = time.perf_counter()
+            dias = reconstruir(conn)
+            print(f"✅ Resúmenes reconstruidos: {dias} día(s) en {time.perf_counter() - inicio:.1f} s")
+        elif orden == "estado":
+            anotaciones, dias = pendientes(conn)
+            print(f"Pendientes: {anotaciones} anotaciones de {dias} día(s)")
+        else:
+            print(__doc__)
+            return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
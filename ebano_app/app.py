@@ -4,8 +4,7 @@
 # ============================================================
 from datetime import datetime
 import time
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
-import jwt
+from decimal import Decimal, InvalidOperation
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
 from flask_login import (
     LoginManager, login_user, logout_user,
@@ -13,14 +12,40 @@ from flask_login import (
 )
 from dotenv import load_dotenv
 import os
-import requests
+import secrets
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField, IntegerField, SelectField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, NumberRange
-from bd_config import get_connection, db_connection
-import bcrypt
+from bd_config import get_connection, db_connection, pool_stats
+from cache_memoria import CacheTTL, cache_stats
+from tasa_cambio import rate_info, format_usd_many, annotate_usd
+from catalogo import (
+    invalidar_catalogo, CatalogoNoDisponible, pagina_tienda, ORDENES_TIENDA, ORDEN_TIENDA_DEFECTO
+)
+from pedidos_db import (
+    cargar_pedidos_usuario, crear_pedido, StockInsuficiente, PrecioCambiado, preparar_recompra,
+    pedido_por_clave, pagina_pedidos_admin
+)
+from resenas_db import (
+    resumen_resenas, pagina_resenas, invalidar_resenas, pagina_resenas_admin, insertar_resena, ResenaYaExiste,
+    SQL_RESENAS_USUARIO
+)
+from estadisticas import estadisticas_dashboard
+from analitica import resumen_ventas, rango_por_defecto, asegurar_refresco
+from productos_db import (
+    actualizar_producto, ConflictoProducto, actualizar_productos_lote, cambios_desde_csv, cambios_desde_formulario
+)
+from carrito_store import cargar_carrito, guardar_carrito, borrar_carrito, id_carrito
+from reservas import reservar_carrito, liberar_carrito
+from precios_carrito import cotizar_carrito
+from metabase_embed import url_tablero, MetabaseNoConfigurado, TableroDesconocido, TABLEROS, METABASE_SITE_URL
+from usuarios_db import (
+    registrar_usuario, CorreoYaRegistrado, pagina_clientes_admin, SQL_USUARIO_POR_ID, SQL_USUARIO_POR_CORREO
+)
+from contrasenas import hashear, verificar, verificar_y_rehash, ContrasenasOcupado, contrasenas_stats
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limites_store import LIMITES_STORAGE_URI
 
 # -----------------------
 # Cargar variables .env
@@ -35,11 +60,13 @@ app.secret_key = os.getenv("SECRET_KEY", "clave_segura_ebano_default")
 app.config['WTF_CSRF_SECRET_KEY'] = os.getenv("WTF_CSRF_SECRET_KEY", app.secret_key)
 
 # Configurar rate limiter
+# Contadores en SQLite compartido (limites_store.py): los límites valen por
+# máquina y no por worker, y sobreviven a un reinicio
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=LIMITES_STORAGE_URI
 )
 
 # 🆕 NUEVAS LÍNEAS PARA PRODUCCIÓN
@@ -51,23 +78,16 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
 
+# Caché de identidad de usuarios para Flask-Login (por worker).
+# Otros workers pueden ver un cambio de perfil con hasta USER_CACHE_TTL s de retraso.
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", 2048))
+_usuarios_cache = CacheTTL("usuarios", max_items=USER_CACHE_MAX, ttl=USER_CACHE_TTL)
+
 # ------------------------------------------------------------
-# CONFIGURACIÓN DE TASA DE CAMBIO (COP -> USD)
+# TASA DE CAMBIO (COP -> USD)
 # ------------------------------------------------------------
-EXCHANGE_TTL_SECONDS = int(os.getenv("EXCHANGE_TTL_SECONDS", 43200))  # 12 horas
-EXCHANGE_API_URL = os.getenv("EXCHANGE_API_URL", "https://api.currencyapi.com/v3/latest")
-CURRENCY_API_KEY = os.getenv("CURRENCY_API_KEY", "")
-EXCHANGE_REQUEST_TIMEOUT = int(os.getenv("EXCHANGE_REQUEST_TIMEOUT", 8))
-
-# Tasa de fallback (si la API falla): 1 COP = 0.00026 USD (~3,846 COP = 1 USD)
-FALLBACK_COP_TO_USD = Decimal("0.00026")
-
-# Caché simple en memoria
-_app_exchange_cache = {
-    "timestamp": 0.0,
-    "cop_to_usd": None,
-    "usd_to_cop": None
-}
+# La tasa se comparte entre workers y se refresca en segundo plano (tasa_cambio.py)
 
 # -------------------------
 # Helpers de precios
@@ -106,102 +126,35 @@ def format_cop(value):
     return s
 
 
-def get_cop_to_usd_rate():
-    """
-    Obtiene la tasa COP -> USD desde currencyapi.com v3.
-    Respuesta esperada:
-    {
-      "meta": {"last_updated_at": "2025-11-14T23:59:59Z"},
-      "data": {
-        "USD": {"code": "USD", "value": 0.0002662073}
-      }
-    }
-    
-    Si falla, devuelve tasa de fallback predefinida.
-    Cache: 12 horas (configurable en .env)
-    """
-    now = time.time()
-    
-    # Verificar caché
-    if (_app_exchange_cache["cop_to_usd"] is not None and 
-        (now - _app_exchange_cache["timestamp"]) < EXCHANGE_TTL_SECONDS):
-        return _app_exchange_cache["cop_to_usd"], _app_exchange_cache["usd_to_cop"]
-    
-    # Validar API key
-    if not CURRENCY_API_KEY:
-        print("⚠️ CURRENCY_API_KEY no configurada en .env, usando tasa de fallback")
-        usd_to_cop = (Decimal('1') / FALLBACK_COP_TO_USD).quantize(Decimal('0.01'))
-        return FALLBACK_COP_TO_USD, usd_to_cop
-    
-    # Preparar request a currencyapi.com v3
-    params = {
-        "apikey": CURRENCY_API_KEY,
-        "base_currency": "COP",
-        "currencies": "USD"
-    }
-    
-    try:
-        print(f"🔄 Obteniendo tasa COP->USD desde {EXCHANGE_API_URL}...")
-        resp = requests.get(EXCHANGE_API_URL, params=params, timeout=EXCHANGE_REQUEST_TIMEOUT)
-        resp.raise_for_status()
-        data = resp.json()
-        
-        # Validar estructura de respuesta de currencyapi.com
-        if "data" not in data or "USD" not in data["data"]:
-            raise ValueError("Respuesta inválida de currencyapi.com: falta 'data.USD'")
-        
-        rate_value = data["data"]["USD"]["value"]
-        cop_to_usd = Decimal(str(rate_value))
-        
-        if cop_to_usd <= 0:
-            raise ValueError("Tasa COP->USD inválida (cero o negativa)")
-        
-        usd_to_cop = (Decimal('1') / cop_to_usd).quantize(Decimal('0.01'))
-        
-        # Guardar en caché
-        _app_exchange_cache["timestamp"] = now
-        _app_exchange_cache["cop_to_usd"] = cop_to_usd
-        _app_exchange_cache["usd_to_cop"] = usd_to_cop
-        
-        print(f"✅ Tasa actualizada: 1 COP = {cop_to_usd} USD | 1 USD = {usd_to_cop} COP")
-        return cop_to_usd, usd_to_cop
-        
-    except requests.RequestException as e:
-        print(f"❌ Error HTTP al obtener tasa: {e}")
-    except (ValueError, KeyError) as e:
-        print(f"❌ Error parseando respuesta de API: {e}")
-    except Exception as e:
-        print(f"❌ Error inesperado: {e}")
-    
-    # Fallback: usar tasa fija
-    print(f"⚠️ Usando tasa de fallback: 1 COP = {FALLBACK_COP_TO_USD} USD")
-    usd_to_cop = (Decimal('1') / FALLBACK_COP_TO_USD).quantize(Decimal('0.01'))
-    return FALLBACK_COP_TO_USD, usd_to_cop
-
-
-def cop_to_usd_decimal(cop_value):
-    """
-    Convierte un valor en COP (Decimal/int/str) a Decimal USD con 2 decimales.
-    """
-    cop_dec = parse_price_db(cop_value)
-    cop_to_usd, _ = get_cop_to_usd_rate()
-    usd = (cop_dec * cop_to_usd).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    return usd
-
-
 def format_usd(value):
     """
     Para mostrar en plantillas: recibe valor en COP y devuelve "$10.95 USD"
     Si hay error, devuelve mensaje claro.
+    Para listas de precios es preferible format_usd_many / annotate_usd (un solo lote).
     """
     try:
-        usd = cop_to_usd_decimal(value)
-        return "${:,.2f} USD".format(float(usd))
+        return format_usd_many((value,))[0]
     except Exception as e:
         print(f"⚠️ format_usd error: {e}")
         return "USD no disponible"
 
 
+def carrito_para_vista(cotizacion):
+    """
+    Copia las líneas de una cotización (precios_carrito) con precios USD
+    precalculados en un solo lote. Devuelve (lineas, total_cop, total_usd).
+    """
+    lineas = [dict(item) for item in cotizacion.lineas]
+    total = cotizacion.total
+    textos = format_usd_many([item["precio"] for item in lineas] +
+                             [item["subtotal"] for item in lineas] + [total])
+    n = len(lineas)
+    for k, item in enumerate(lineas):
+        item["precio_usd"] = textos[k]
+        item["subtotal_usd"] = textos[n + k]
+    return lineas, total, textos[-1]
+
+
 # Registrar filtros Jinja
 app.jinja_env.filters['cop'] = format_cop
 app.jinja_env.filters['usd'] = format_usd
@@ -273,15 +226,10 @@ def api_rate():
     Útil para debugging.
     """
     try:
-        cop_to_usd_dec, usd_to_cop_dec = get_cop_to_usd_rate()
-        return jsonify({
-            "success": True,
-            "cop_to_usd": float(cop_to_usd_dec),
-            "usd_to_cop": float(usd_to_cop_dec),
-            "cached_at": _app_exchange_cache["timestamp"],
-            "cache_ttl_seconds": EXCHANGE_TTL_SECONDS,
-            "source": "currencyapi.com" if CURRENCY_API_KEY else "fallback"
-        })
+        info = rate_info()
+        info["cop_to_usd"] = float(info["cop_to_usd"])
+        info["usd_to_cop"] = float(info["usd_to_cop"])
+        return jsonify(dict(info, success=True))
     except Exception as err:
         return jsonify({
             "success": False,
@@ -289,6 +237,43 @@ def api_rate():
         }), 500
 
 
+# ------------------------------------------------------------
+# RUTA DE DEBUGGING: Estado del pool de conexiones (solo admin)
+# ------------------------------------------------------------
+@app.route("/api/pool")
+@login_required
+def api_pool():
+    """
+    Devuelve JSON con las estadísticas del pool de conexiones del worker
+    que atiende la petición (en uso, ociosas, esperas, latencia de préstamo).
+    """
+    if current_user.rol != "admin":
+        return jsonify({"success": False, "error": "No autorizado"}), 403
+    return jsonify({"success": True, "pool": pool_stats()})
+
+
+# ------------------------------------------------------------
+# RUTA DE DEBUGGING: Pool de bcrypt del worker (solo admin)
+# ------------------------------------------------------------
+@app.route("/api/contrasenas")
+@login_required
+def api_contrasenas():
+    if current_user.rol != "admin":
+        return jsonify({"success": False, "error": "No autorizado"}), 403
+    return jsonify({"success": True, "bcrypt": contrasenas_stats()})
+
+
+# ------------------------------------------------------------
+# RUTA DE DEBUGGING: Aciertos/fallos de las cachés en memoria (solo admin)
+# ------------------------------------------------------------
+@app.route("/api/cache")
+@login_required
+def api_cache():
+    if current_user.rol != "admin":
+        return jsonify({"success": False, "error": "No autorizado"}), 403
+    return jsonify({"success": True, "caches": cache_stats()})
+
+
 # ------------------------------------------------------------
 # MODELO DE USUARIO PARA FLASK-LOGIN
 # ------------------------------------------------------------
@@ -300,22 +285,33 @@ class Usuario(UserMixin):
         self.rol = rol
 
 
+def _usuario_desde_fila(u):
+    user = Usuario(u[0], u[1], u[2], u[3])
+    user.nombre_completo = u[4] or u[1]
+    return user
+
+
+def invalidar_usuario_cache(user_id):
+    """Olvida la identidad cacheada tras modificar el usuario en la BD."""
+    _usuarios_cache.invalidate(str(user_id))
+
+
 @login_manager.user_loader
 def load_user(user_id):
+    # Se cachea la fila (inmutable) y no el objeto: cada petición recibe su propio Usuario
+    cached = _usuarios_cache.get(str(user_id))
+    if cached is not None:
+        return _usuario_desde_fila(cached)
+
     conn = get_connection()
     if not conn:
         return None
     try:
-        q = "SELECT id, nombre_usuario, correo, rol, nombre_completo FROM usuarios WHERE id = :id;"
-        res = conn.run(q, id=user_id)
+        res = conn.run(SQL_USUARIO_POR_ID, id=user_id)
         if res:
-            u = res[0]
-            user = Usuario(u[0], u[1], u[2], u[3])
-            try:
-                user.nombre_completo = u[4] or u[1]
-            except Exception:
-                user.nombre_completo = u[1]
-            return user
+            u = tuple(res[0])
+            _usuarios_cache.set(str(user_id), u)
+            return _usuario_desde_fila(u)
     except Exception as e:
         print(f"❌ Error load_user: {e}")
     finally:
@@ -362,41 +358,42 @@ def index():
 
 @app.route("/tienda")
 def tienda():
-    conn = get_connection()
-    if not conn:
-        flash("Error de conexión con la base de datos.", "danger")
-        return redirect(url_for("index"))
+    filtros = {
+        "orden": request.args.get("orden", ORDEN_TIENDA_DEFECTO),
+        "solo_stock": request.args.get("solo_stock") == "1",
+        "precio_min": _precio_filtro(request.args.get("precio_min")),
+        "precio_max": _precio_filtro(request.args.get("precio_max")),
+    }
+    if filtros["orden"] not in ORDENES_TIENDA:
+        filtros["orden"] = ORDEN_TIENDA_DEFECTO
 
-    productos = []
+    productos, siguiente = [], None
     try:
-        q = "SELECT id, nombre, descripcion, precio, imagen_url, stock FROM productos;"
-        res = conn.run(q)
-        for r in res:
-            try:
-                precio_cop = parse_price_db(r[3]).quantize(Decimal('1'))
-                precio_cop_int = int(precio_cop)
-            except Exception:
-                precio_cop_int = 0
-            
-            productos.append({
-                "id": r[0],
-                "nombre": r[1],
-                "descripcion": r[2],
-                "precio": precio_cop_int,
-                "imagen_url": r[4],
-                "stock": r[5]
-            })
+        # Página keyset sobre la copia en memoria del catálogo (o la BD si es muy grande)
+        pagina = pagina_tienda(cursor=request.args.get("cursor"), **filtros)
+        productos, siguiente = pagina.items, pagina.siguiente
+    except CatalogoNoDisponible:
+        flash("Error de conexión con la base de datos.", "danger")
+        return redirect(url_for("index"))
     except Exception as e:
         print(f"❌ Error al cargar tienda: {e}")
         flash("Error al mostrar los productos.", "danger")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
 
     mostrar_precios = current_user.is_authenticated
-    return render_template("tienda.html", productos=productos, mostrar_precios=mostrar_precios)
+    if mostrar_precios:
+        annotate_usd(productos)
+    return render_template("tienda.html", productos=productos, mostrar_precios=mostrar_precios,
+                           filtros=filtros, siguiente=siguiente,
+                           hay_cursor=bool(request.args.get("cursor")))
+
+
+def _precio_filtro(value):
+    """Precio COP de un filtro de la URL, o None si está vacío o no es válido."""
+    try:
+        precio = Decimal(value.strip().replace(",", "")) if value else None
+    except (InvalidOperation, AttributeError):
+        return None
+    return precio if precio is not None and precio.is_finite() and precio >= 0 else None
 
 
 # ------------------------------------------------------------
@@ -419,42 +416,29 @@ def registro():
             flash("Por favor, selecciona un estado válido de EE.UU.", "warning")
             return redirect(url_for("registro"))
 
+        # El hash se calcula antes de tomar una conexión del pool: el correo
+        # repetido lo detecta el propio INSERT (sin SELECT previo ni carrera)
+        try:
+            hashed = hashear(form.contraseña.data)
+        except ContrasenasOcupado as e:
+            print(f"⚠️ Registro rechazado: {e}")
+            flash("Hay muchas solicitudes en este momento. Intenta de nuevo en unos segundos.", "warning")
+            return redirect(url_for("registro"))
+
         conn = get_connection()
         if not conn:
             flash("Error de conexión con la base de datos.", "danger")
             return redirect(url_for("registro"))
         
         try:
-            check_q = "SELECT id FROM usuarios WHERE correo = :correo;"
-            existing = conn.run(check_q, correo=correo)
-            if existing:
-                flash("Ya existe una cuenta con ese correo.", "warning")
-                conn.close()
-                return redirect(url_for("registro"))
-            
-            hashed = bcrypt.hashpw(form.contraseña.data.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-            insert_q = """
-                INSERT INTO usuarios
-                (nombre_usuario, correo, contraseña, rol, nombre_completo, telefono, estado, direccion, pais)
-                VALUES (:nombre_usuario, :correo, :contraseña, :rol, :nombre_completo, :telefono, :estado, :direccion, :pais)
-                RETURNING id;
-            """
-            nombre_usuario = correo.split("@")[0]
-            res = conn.run(insert_q,
-                           nombre_usuario=nombre_usuario,
-                           correo=correo,
-                           contraseña=hashed,
-                           rol="cliente",
-                           nombre_completo=nombre_completo,
-                           telefono=telefono,
-                           estado=estado,
-                           direccion=direccion,
-                           pais="United States")
-            conn.commit()
-            new_id = res[0][0] if res else None
+            registrar_usuario(conn, correo, hashed, nombre_completo, telefono, estado, direccion)
             conn.close()
             flash("Cuenta creada exitosamente. Ya puedes iniciar sesión.", "success")
             return redirect(url_for("login"))
+        except CorreoYaRegistrado:
+            conn.close()
+            flash("Ya existe una cuenta con ese correo.", "warning")
+            return redirect(url_for("registro"))
         except Exception as e:
             try:
                 conn.rollback()
@@ -488,12 +472,7 @@ def login():
             return redirect(url_for("login"))
         
         try:
-            query = """
-                SELECT id, nombre_usuario, correo, contraseña, rol, nombre_completo
-                FROM usuarios
-                WHERE correo = :correo;
-            """
-            result = conn.run(query, correo=correo)
+            result = conn.run(SQL_USUARIO_POR_CORREO, correo=correo)
             
             conn.close()
             
@@ -512,10 +491,17 @@ def login():
             
             pwd_input = form.contraseña.data
             
-            # Verificar contraseña
-            is_password_correct = bcrypt.checkpw(pwd_input.encode("utf-8"), stored_hash)
+            # Verificar contraseña (en el pool de bcrypt); si el hash tiene otro coste se renueva
+            is_password_correct, rehash = verificar_y_rehash(pwd_input, stored_hash)
 
             if is_password_correct:
+                if rehash:
+                    try:
+                        with db_connection() as conn:
+                            conn.run("UPDATE usuarios SET contraseña = :h WHERE id = :id;", h=rehash, id=user_data[0])
+                    except Exception as e:
+                        print(f"⚠️ No se pudo actualizar el hash del usuario {user_data[0]}: {e}")
+
                 user = Usuario(user_data[0], user_data[1], user_data[2], user_data[4])
                 try:
                     user.nombre_completo = user_data[5] or user_data[1]
@@ -538,7 +524,11 @@ def login():
             else:
                 flash("Correo o contraseña incorrectos.", "danger")
                 return redirect(url_for("login"))
-                
+        
+        except ContrasenasOcupado as e:
+            print(f"⚠️ Login rechazado: {e}")
+            flash("Hay muchos inicios de sesión en este momento. Intenta de nuevo en unos segundos.", "warning")
+            return redirect(url_for("login"))
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -565,7 +555,9 @@ def logout():
     session.pop("usuario_id", None)
     session.pop("rol", None)
     session.pop("usuario_nombre", None)
-    session.pop("carrito", None)
+    liberar_reservas()
+    borrar_carrito(session)
+    session.pop("carrito_id", None)
     session.modified = True
     
     flash("Sesión cerrada correctamente.", "info")
@@ -599,44 +591,8 @@ def pedidos():
     
     try:
         with db_connection() as conn:
-            # Consultar pedidos activos
-            query = """
-                SELECT p.id, p.fecha_pedido, p.total, p.estado
-                FROM pedidos p
-                WHERE p.id_usuario = :uid 
-                AND p.estado NOT IN ('Entregado', 'Cancelado')
-                ORDER BY p.fecha_pedido DESC;
-            """
-            res = conn.run(query, uid=current_user.id)
-            
-            for row in res:
-                pedido_id = row[0]
-            
-            # Obtener detalle de productos del pedido
-            detalle_query = """
-                SELECT dp.cantidad, dp.subtotal, pr.nombre, pr.imagen_url
-                FROM detalle_pedidos dp
-                JOIN productos pr ON pr.id = dp.id_producto
-                WHERE dp.id_pedido = :pid;
-            """
-            detalle_res = conn.run(detalle_query, pid=pedido_id)
-            
-            productos = []
-            for det in detalle_res:
-                productos.append({
-                    "nombre": det[2],
-                    "cantidad": det[0],
-                    "subtotal": int(parse_price_db(det[1]).quantize(Decimal('1'))),
-                    "imagen_url": det[3]
-                })
-            
-            pedidos_activos.append({
-                "id": pedido_id,
-                "fecha": row[1],
-                "total": int(parse_price_db(row[2]).quantize(Decimal('1'))),
-                "estado": row[3],
-                "productos": productos
-            })
+            # Pedidos activos con sus productos (consultas constantes, sin N+1)
+            pedidos_activos = cargar_pedidos_usuario(conn, current_user.id, finalizados=False)
         
         print(f"✅ Usuario {current_user.id}: {len(pedidos_activos)} pedidos activos")
         
@@ -645,11 +601,6 @@ def pedidos():
         import traceback
         traceback.print_exc()
         flash("Error al cargar tus pedidos.", "danger")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
     
     return render_template("pedidos.html", pedidos=pedidos_activos, usuario=current_user)
 
@@ -666,49 +617,12 @@ def historial():
         flash("Acceso no autorizado.", "danger")
         return redirect(url_for("index"))
     
-    conn = get_connection()
     pedidos_historial = []
     
     try:
-        # Consultar pedidos completados
-        query = """
-            SELECT p.id, p.fecha_pedido, p.total, p.estado
-            FROM pedidos p
-            WHERE p.id_usuario = :uid 
-            AND p.estado IN ('Entregado', 'Cancelado')
-            ORDER BY p.fecha_pedido DESC;
-        """
-        res = conn.run(query, uid=current_user.id)
-        
-        for row in res:
-            pedido_id = row[0]
-            
-            # Obtener detalle de productos del pedido
-            detalle_query = """
-                SELECT dp.cantidad, dp.subtotal, dp.id_producto, pr.nombre, pr.imagen_url
-                FROM detalle_pedidos dp
-                JOIN productos pr ON pr.id = dp.id_producto
-                WHERE dp.id_pedido = :pid;
-            """
-            detalle_res = conn.run(detalle_query, pid=pedido_id)
-            
-            productos = []
-            for det in detalle_res:
-                productos.append({
-                    "id_producto": det[2],
-                    "nombre": det[3],
-                    "cantidad": det[0],
-                    "subtotal": int(parse_price_db(det[1]).quantize(Decimal('1'))),
-                    "imagen_url": det[4]
-                })
-            
-            pedidos_historial.append({
-                "id": pedido_id,
-                "fecha": row[1],
-                "total": int(parse_price_db(row[2]).quantize(Decimal('1'))),
-                "estado": row[3],
-                "productos": productos
-            })
+        with db_connection() as conn:
+            # Pedidos completados con sus productos (consultas constantes, sin N+1)
+            pedidos_historial = cargar_pedidos_usuario(conn, current_user.id, finalizados=True)
         
         print(f"✅ Usuario {current_user.id}: {len(pedidos_historial)} pedidos en historial")
         
@@ -717,11 +631,6 @@ def historial():
         import traceback
         traceback.print_exc()
         flash("Error al cargar tu historial.", "danger")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
     
     return render_template("historial.html", pedidos=pedidos_historial, usuario=current_user)
 
@@ -739,116 +648,60 @@ def recomprar(pedido_id):
         flash("Acceso no autorizado.", "danger")
         return redirect(url_for("index"))
     
-    conn = get_connection()
-    
     try:
-        # Verificar que el pedido pertenece al usuario
-        check_query = "SELECT id FROM pedidos WHERE id = :pid AND id_usuario = :uid;"
-        check_res = conn.run(check_query, pid=pedido_id, uid=current_user.id)
-        
-        if not check_res:
-            flash("Pedido no encontrado.", "warning")
-            try:
-                conn.close()
-            except:
-                pass
-            return redirect(url_for("historial"))
-        
-        # Obtener productos del pedido
-        detalle_query = """
-            SELECT dp.id_producto, dp.cantidad, pr.nombre, pr.precio, pr.imagen_url, pr.stock
-            FROM detalle_pedidos dp
-            JOIN productos pr ON pr.id = dp.id_producto
-            WHERE dp.id_pedido = :pid;
-        """
-        detalle_res = conn.run(detalle_query, pid=pedido_id)
-        
-        carrito = session.get("carrito", [])
-        productos_agregados = 0
-        productos_sin_stock = []
-        
-        for det in detalle_res:
-            id_producto = det[0]
-            cantidad_pedido = det[1]
-            nombre = det[2]
-            precio_raw = det[3]
-            imagen = det[4]
-            stock = det[5]
-            
-            precio_dec = parse_price_db(precio_raw).quantize(Decimal('1'))
-            precio_int = int(precio_dec)
-            
-            # Validar stock disponible
-            if stock is not None and stock <= 0:
-                print(f"⚠️ Producto {nombre} sin stock, omitido")
-                productos_sin_stock.append(nombre)
-                continue
-            
-            cantidad_a_agregar = min(cantidad_pedido, stock) if stock else cantidad_pedido
-            
-            # Buscar si ya está en el carrito
-            found = False
-            for item in carrito:
-                if int(item.get("id")) == id_producto:
-                    item["cantidad"] = int(item.get("cantidad", 1)) + cantidad_a_agregar
-                    found = True
-                    break
-            
-            if not found:
-                carrito.append({
-                    "id": id_producto,
-                    "nombre": nombre,
-                    "precio": precio_int,
-                    "imagen_url": imagen,
-                    "cantidad": cantidad_a_agregar
-                })
-            
-            productos_agregados += 1
-        
-        session["carrito"] = carrito
-        session.modified = True
-        
-        print(f"✅ {productos_agregados} productos del pedido {pedido_id} agregados al carrito")
-        
-        # Mensajes informativos según el resultado
-        if productos_sin_stock and productos_agregados == 0:
-            # Todos los productos están sin stock
-            productos_faltantes = ", ".join(productos_sin_stock)
-            if len(productos_sin_stock) == 1:
-                flash(f"El producto '{productos_faltantes}' no está disponible actualmente.", "warning")
-            else:
-                flash(f"Los siguientes productos no están disponibles: {productos_faltantes}.", "warning")
-        
-        elif productos_agregados > 0:
-            # Se agregó al menos un producto
-            mensaje_base = f"Se agregaron {productos_agregados} producto(s) al carrito."
-            
-            if productos_sin_stock:
-                # Algunos productos se agregaron, otros no
-                productos_faltantes = ", ".join(productos_sin_stock)
-                if len(productos_sin_stock) == 1:
-                    mensaje_final = f"{mensaje_base} El producto '{productos_faltantes}' no está disponible actualmente."
-                else:
-                    mensaje_final = f"{mensaje_base} Los siguientes productos no están disponibles: {productos_faltantes}."
-                flash(mensaje_final, "warning")
-            else:
-                # Todos los productos se agregaron correctamente
-                flash(mensaje_base, "success")
-        
-        else:
-            # Caso raro: no hay productos sin stock pero tampoco se agregó nada
-            flash("No se pudo agregar ningún producto al carrito.", "danger")
-        
+        # Una sola consulta: pertenencia, precio y stock actuales, cantidades recortadas al stock
+        with db_connection() as conn:
+            recompra = preparar_recompra(conn, pedido_id, current_user.id)
     except Exception as e:
         print(f"❌ Error al recomprar pedido {pedido_id}: {e}")
         import traceback
         traceback.print_exc()
         flash("Error al agregar productos al carrito.", "danger")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
+        return redirect(url_for("carrito"))
+    
+    if not recompra.encontrado:
+        flash("Pedido no encontrado.", "warning")
+        return redirect(url_for("historial"))
+    
+    agregables = recompra.agregables
+    sin_stock = recompra.sin_stock
+    recortadas = recompra.recortadas
+    
+    if agregables:
+        carrito = cargar_carrito(session)
+        carrito.fusionar(agregables)
+        guardar_con_reservas(carrito)
+    
+    print(f"✅ {len(agregables)} productos del pedido {pedido_id} agregados al carrito")
+    
+    # Mensajes informativos según el resultado
+    if sin_stock and not agregables:
+        # Todos los productos están sin stock
+        productos_faltantes = ", ".join(sin_stock)
+        if len(sin_stock) == 1:
+            flash(f"El producto '{productos_faltantes}' no está disponible actualmente.", "warning")
+        else:
+            flash(f"Los siguientes productos no están disponibles: {productos_faltantes}.", "warning")
+    
+    elif agregables:
+        # Se agregó al menos un producto
+        mensaje = f"Se agregaron {len(agregables)} producto(s) al carrito."
+        
+        if sin_stock:
+            # Algunos productos se agregaron, otros no
+            productos_faltantes = ", ".join(sin_stock)
+            if len(sin_stock) == 1:
+                mensaje += f" El producto '{productos_faltantes}' no está disponible actualmente."
+            else:
+                mensaje += f" Los siguientes productos no están disponibles: {productos_faltantes}."
+        if recortadas:
+            mensaje += f" Se ajustó la cantidad al stock disponible de: {', '.join(recortadas)}."
+        
+        flash(mensaje, "warning" if (sin_stock or recortadas) else "success")
+    
+    else:
+        # Pedido sin líneas (p. ej. todos sus productos fueron retirados)
+        flash("No se pudo agregar ningún producto al carrito.", "danger")
     
     return redirect(url_for("carrito"))
 
@@ -870,14 +723,7 @@ def resenas():
     reseñas = []
     
     try:
-        q = """
-            SELECT r.id, r.id_producto, r.comentario, r.calificacion, r.fecha, p.nombre
-            FROM resenas r
-            JOIN productos p ON p.id = r.id_producto
-            WHERE r.id_usuario = :uid
-            ORDER BY r.fecha DESC;
-        """
-        res = conn.run(q, uid=current_user.id)
+        res = conn.run(SQL_RESENAS_USUARIO, uid=current_user.id)
         
         for row in res:
             reseñas.append({
@@ -940,47 +786,32 @@ def crear_resena(product_id):
     if form.validate_on_submit():
         conn = get_connection()
         try:
-            # Verificar si ya existe una reseña de este usuario para este producto
-            check_q = """
-                SELECT id FROM resenas 
-                WHERE id_usuario = :uid AND id_producto = :pid;
-            """
-            existing = conn.run(check_q, uid=current_user.id, pid=product_id)
-            
-            if existing:
-                flash("Ya has escrito una reseña para este producto. Puedes editarla desde 'Mis reseñas'.", "warning")
-                try:
-                    conn.close()
-                except:
-                    pass
-                return redirect(url_for("resenas"))
-            
-            insert_q = """
-                INSERT INTO resenas (id_usuario, id_producto, comentario, calificacion)
-                VALUES (:uid, :pid, :comentario, :calificacion)
-                RETURNING id;
-            """
-            res = conn.run(insert_q,
-                           uid=current_user.id,
-                           pid=product_id,
-                           comentario=form.comentario.data.strip(),
-                           calificacion=int(form.calificacion.data))
+            # Una sentencia: si ya existe una reseña de este usuario para este producto no inserta nada
+            new_id = insertar_resena(conn, current_user.id, product_id,
+                                     form.comentario.data.strip(), int(form.calificacion.data))
             conn.commit()
-            new_id = res[0][0] if res else None
+            invalidar_resenas(product_id)
             
             print(f"✅ Reseña creada: id={new_id}, producto={product_id}, usuario={current_user.id}")
             
             flash("Reseña guardada. ¡Gracias por tu opinión!", "success")
             return redirect(url_for("producto", id=product_id))
             
+        except ResenaYaExiste:
+            try:
+                conn.rollback()
+            except:
+                pass
+            flash("Ya has escrito una reseña para este producto. Puedes editarla desde 'Mis reseñas'.", "warning")
+            return redirect(url_for("resenas"))
         except Exception as e:
-            print(f"❌ Error al guardar reseña: {e}")
-            import traceback
-            traceback.print_exc()
             try:
                 conn.rollback()
             except:
                 pass
+            print(f"❌ Error al guardar reseña: {e}")
+            import traceback
+            traceback.print_exc()
             flash("No se pudo guardar la reseña.", "danger")
         finally:
             try:
@@ -1065,6 +896,7 @@ def editar_resena(id):
                      rid=id,
                      uid=current_user.id)
             conn.commit()
+            invalidar_resenas(resena_actual[1])
             
             print(f"✅ Reseña {id} actualizada por usuario {current_user.id}")
             
@@ -1106,7 +938,7 @@ def borrar_resena(id):
     
     try:
         # Verificar que la reseña pertenece al usuario
-        check_q = "SELECT id FROM resenas WHERE id = :rid AND id_usuario = :uid;"
+        check_q = "SELECT id, id_producto FROM resenas WHERE id = :rid AND id_usuario = :uid;"
         res = conn.run(check_q, rid=id, uid=current_user.id)
         
         if not res:
@@ -1121,6 +953,7 @@ def borrar_resena(id):
         delete_q = "DELETE FROM resenas WHERE id = :rid AND id_usuario = :uid;"
         conn.run(delete_q, rid=id, uid=current_user.id)
         conn.commit()
+        invalidar_resenas(res[0][1])
         
         print(f"✅ Reseña {id} eliminada por usuario {current_user.id}")
         
@@ -1244,6 +1077,7 @@ def perfil_editar_datos():
                  direccion=direccion,
                  id=current_user.id)
         conn.commit()
+        invalidar_usuario_cache(current_user.id)
         
         # Actualizar sesión
         session["usuario_nombre"] = nombre
@@ -1333,7 +1167,7 @@ def perfil_cambiar_contrasena():
             stored_hash = stored_hash_raw
         
         # Verificar contraseña actual
-        if not bcrypt.checkpw(contrasena_actual.encode("utf-8"), stored_hash):
+        if not verificar(contrasena_actual, stored_hash):
             flash("La contraseña actual es incorrecta.", "danger")
             try:
                 conn.close()
@@ -1342,12 +1176,13 @@ def perfil_cambiar_contrasena():
             return redirect(url_for("perfil"))
         
         # Hashear nueva contraseña
-        nueva_hash = bcrypt.hashpw(contrasena_nueva.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        nueva_hash = hashear(contrasena_nueva)
         
         # Actualizar en BD
         update_q = "UPDATE usuarios SET contraseña = :contraseña WHERE id = :id;"
         conn.run(update_q, contraseña=nueva_hash, id=current_user.id)
         conn.commit()
+        invalidar_usuario_cache(current_user.id)
         
         print(f"✅ Contraseña cambiada: usuario {current_user.id}")
         
@@ -1362,6 +1197,9 @@ def perfil_cambiar_contrasena():
         
         return redirect(url_for("login"))
         
+    except ContrasenasOcupado as e:
+        print(f"⚠️ Cambio de contraseña rechazado: {e}")
+        flash("Hay muchas solicitudes en este momento. Intenta de nuevo en unos segundos.", "warning")
     except Exception as e:
         print(f"❌ Error al cambiar contraseña: {e}")
         import traceback
@@ -1391,6 +1229,8 @@ def producto(id):
     conn = get_connection()
     producto = None
     reseñas = []
+    resumen = None
+    siguiente = None
     
     try:
         # Obtener producto
@@ -1410,26 +1250,11 @@ def producto(id):
                 "stock": p[5] if len(p) > 5 else None
             }
         
-        # Cargar reseñas del producto
+        # Reseñas: resumen + una página (ambos cacheados por producto)
         if producto:
-            query_resenas = """
-                SELECT r.comentario, u.nombre_completo, r.fecha, r.calificacion
-                FROM resenas r
-                JOIN usuarios u ON r.id_usuario = u.id
-                WHERE r.id_producto = :id
-                ORDER BY r.fecha DESC;
-            """
-            res_r = conn.run(query_resenas, id=id)
-            
-            for rr in res_r:
-                reseñas.append({
-                    "comentario": rr[0],
-                    "nombre_completo": rr[1],
-                    "fecha": rr[2],
-                    "calificacion": rr[3]
-                })
-            
-            print(f"✅ Producto {id}: {len(reseñas)} reseñas encontradas")
+            resumen = resumen_resenas(conn, id)
+            pagina = pagina_resenas(conn, id, cursor=request.args.get("cursor"))
+            reseñas, siguiente = pagina.items, pagina.siguiente
         
     except Exception as e:
         print(f"❌ Error al obtener producto o reseñas: {e}")
@@ -1446,7 +1271,8 @@ def producto(id):
         return redirect(url_for("tienda"))
     
     mostrar_precios = current_user.is_authenticated and current_user.rol == "cliente" or current_user.is_authenticated and current_user.rol == "admin"
-    return render_template("producto.html", producto=producto, reseñas=reseñas, mostrar_precios=mostrar_precios)
+    return render_template("producto.html", producto=producto, reseñas=reseñas, mostrar_precios=mostrar_precios,
+                           resumen=resumen, siguiente=siguiente, hay_cursor=bool(request.args.get("cursor")))
 
 
 # ------------------------------------------------------------
@@ -1459,146 +1285,117 @@ def dashboard_admin():
         flash("No tienes permisos para acceder a esta sección.", "danger")
         return redirect(url_for("index"))
     
-    conn = get_connection()
-    products = []
-    total_usuarios = 0
-    total_resenas = 0
-    
+    stats = None
     try:
-        # Contar usuarios clientes
-        res_usuarios = conn.run("SELECT COUNT(*) FROM usuarios WHERE rol = :rol;", rol="cliente")
-        total_usuarios = res_usuarios[0][0] if res_usuarios else 0
-        
-        # Contar reseñas
-        res_resenas = conn.run("SELECT COUNT(*) FROM resenas;")
-        total_resenas = res_resenas[0][0] if res_resenas else 0
-        
-        # Contar pedidos
-        res_pedidos = conn.run("SELECT COUNT(*) FROM pedidos;")
-        total_pedidos = res_pedidos[0][0] if res_pedidos else 0
-        
-        # Cargar productos
-        res = conn.run("SELECT id, nombre, precio, stock FROM productos ORDER BY id;")
-        for r in res:
-            products.append({
-                "id": r[0],
-                "nombre": r[1],
-                "precio": int(parse_price_db(r[2]).quantize(Decimal('1'))),
-                "stock": r[3]
-            })
+        # Contadores en una consulta, cacheados unos segundos (estadisticas.py)
+        stats = estadisticas_dashboard()
     except Exception as e:
         print(f"❌ Error dashboard_admin: {e}")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
     
-    stats = {
-        "total_usuarios": total_usuarios,
-        "total_productos": len(products),
-        "total_pedidos": total_pedidos,
-        "reseñas_pendientes": total_resenas
-    }
+    if stats is None:
+        stats = {
+            "total_usuarios": 0,
+            "total_productos": 0,
+            "total_pedidos": 0,
+            "reseñas_pendientes": 0
+        }
     
-    return render_template("dashboard_admin.html", stats=stats, products=products)
+    return render_template("dashboard_admin.html", stats=stats)
 
 # ============================================================
 # DASHBOARD DE ANALÍTICA (METABASE) - SOLO ADMIN
 # ============================================================
 
 @app.route("/admin/dashboard_analitica")
+@app.route("/admin/dashboard_analitica/<tablero>")
 @login_required
-def dashboard_analitica():
+def dashboard_analitica(tablero="principal"):
     """
-    Muestra el dashboard de Metabase Cloud embebido con token JWT.
+    Muestra un dashboard de Metabase embebido. El token firmado se reutiliza
+    hasta poco antes de vencer (metabase_embed.py).
     """
     if current_user.rol != "admin":
         flash("No tienes permisos para acceder a esta sección.", "danger")
         return redirect(url_for("dashboard_admin"))
-    
-    # Configuración desde .env
-    METABASE_SITE_URL = os.getenv("METABASE_PROD_URL", "").strip()
-    METABASE_SECRET_KEY = os.getenv("METABASE_PROD_SECRET_KEY", "").strip()
-    DASHBOARD_ID = os.getenv("DASHBOARD_ID", "2")  # ID por defecto
-    
-    print("=" * 60)
-    print("🔍 DEBUG: Dashboard Analítica")
-    print("=" * 60)
-    print(f"METABASE_SITE_URL: {METABASE_SITE_URL}")
-    print(f"Dashboard ID: {DASHBOARD_ID}")
-    print(f"SECRET_KEY configurada: {bool(METABASE_SECRET_KEY)}")
-    
-    # Validaciones
-    if not METABASE_SITE_URL or not METABASE_SECRET_KEY:
+
+    try:
+        metabase_url = url_tablero(tablero, usuario=current_user)
+    except TableroDesconocido:
+        flash(f"El tablero '{tablero}' no existe.", "warning")
+        return redirect(url_for("dashboard_admin"))
+    except MetabaseNoConfigurado as e:
+        print(f"❌ Metabase: {e}")
         flash("Error: Metabase no está configurado correctamente.", "danger")
         return redirect(url_for("dashboard_admin"))
-    
-    try:
-        # Convertir dashboard_id a int
-        dashboard_id_int = int(DASHBOARD_ID)
-
-        # Crear payload JWT
-        current_timestamp = int(time.time())
-        # Mitigar problemas por desfase de reloj entre servidores: marcar iat 10s en el pasado
-        iat = current_timestamp - 10
-        # Expiración: 2 horas desde ahora
-        expiration_time = current_timestamp + (60 * 120)  # 2 horas
-
-        payload = {
-            "resource": {"dashboard": dashboard_id_int},
-            "params": {},
-            "exp": expiration_time,
-            "iat": iat,
-            "nbf": iat
-        }
-        
-        # Generar token JWT
-        token = jwt.encode(payload, METABASE_SECRET_KEY, algorithm="HS256")
+    except Exception as e:
+        print(f"❌ ERROR al generar token de Metabase: {e}")
+        flash("Error al cargar el dashboard de analítica.", "danger")
+        return redirect(url_for("dashboard_admin"))
 
-        if isinstance(token, bytes):
-            token = token.decode('utf-8')
+    return render_template(
+        "dashboard_analitica.html",
+        metabase_url=metabase_url,
+        metabase_base_url=METABASE_SITE_URL,
+        tableros=TABLEROS.values(),
+        tablero_actual=tablero
+    )
 
-        # Asegurar que la URL base no tenga slash final
-        METABASE_SITE_URL = METABASE_SITE_URL.rstrip('/')
+# ------------------------------------------------------------
+# ANALÍTICA DE VENTAS (RESÚMENES DIARIOS) - SOLO ADMIN
+# ------------------------------------------------------------
+def _rango_analitica():
+    """(desde, hasta) de ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD; últimos 30 días por defecto."""
+    desde, hasta = rango_por_defecto()
+    try:
+        if request.args.get("desde"):
+            desde = datetime.strptime(request.args["desde"], "%Y-%m-%d").date()
+        if request.args.get("hasta"):
+            hasta = datetime.strptime(request.args["hasta"], "%Y-%m-%d").date()
+    except ValueError:
+        pass
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    return desde, hasta
+
+
+def _datos_analitica():
+    """
+    Lee solo los resúmenes diarios; el hilo de asegurar_refresco() los
+    mantiene al día fuera de la petición.
+    """
+    asegurar_refresco()
+    desde, hasta = _rango_analitica()
+    with db_connection() as conn:
+        return resumen_ventas(conn, desde, hasta)
 
-        # Intento de validación rápida: decodificar el token con la misma clave
-        # para detectar problemas de firma antes de enviar al navegador.
-        try:
-            # Añadimos un leeway pequeño para tolerar ligeros desfases
-            decoded = jwt.decode(token, METABASE_SECRET_KEY, algorithms=["HS256"], leeway=10)
-            print("✅ Token JWT generado correctamente y verificado localmente")
-            print(f"🔍 Payload: {decoded}")
-        except Exception as e:
-            print("❌ Error validando token JWT localmente:", e)
-            # No abortamos; igual retornamos la URL para que el iframe muestre el error de Metabase
 
-        # Construir URL del iframe (embed)
-        metabase_url = (
-            f"{METABASE_SITE_URL}/embed/dashboard/{token}"
-            f"#bordered=true&titled=true&theme=night"
-        )
+@app.route("/admin/analitica_ventas")
+@login_required
+def analitica_ventas():
+    if current_user.rol != "admin":
+        flash("No tienes permisos para acceder a esta sección.", "danger")
+        return redirect(url_for("index"))
+    try:
+        datos = _datos_analitica()
+    except Exception as e:
+        print(f"❌ Error al cargar la analítica de ventas: {e}")
+        flash("Error al cargar la analítica de ventas.", "danger")
+        return redirect(url_for("dashboard_admin"))
+    return render_template("analitica_ventas.html", datos=datos)
 
-        print(f"🔗 URL del dashboard: {metabase_url[:100]}...")
-        print("=" * 60)
 
-        return render_template(
-            "dashboard_analitica.html", 
-            metabase_url=metabase_url,
-            metabase_base_url=METABASE_SITE_URL
-        )
-        
-    except ValueError as ve:
-        print(f"❌ ERROR: DASHBOARD_ID debe ser un número: {ve}")
-        flash("Error: ID del dashboard inválido.", "danger")
-        return redirect(url_for("dashboard_admin"))
+@app.route("/api/analitica_ventas")
+@login_required
+def api_analitica_ventas():
+    if current_user.rol != "admin":
+        return jsonify({"success": False, "error": "No autorizado"}), 403
+    try:
+        return jsonify({"success": True, **_datos_analitica()})
     except Exception as e:
-        print(f"❌ ERROR al generar token: {e}")
-        import traceback
-        traceback.print_exc()
-        flash("Error al cargar el dashboard de analítica.", "danger")
-        return redirect(url_for("dashboard_admin"))
-    
+        print(f"❌ Error al cargar la analítica de ventas: {e}")
+        return jsonify({"success": False, "error": "No se pudo cargar la analítica"}), 500
+
+
 # ------------------------------------------------------------
 # GESTIONAR USUARIOS (ADMIN) - Listado de clientes
 # ------------------------------------------------------------
@@ -1614,28 +1411,13 @@ def gestionar_usuarios():
         flash("Error de conexión con la base de datos.", "danger")
         return redirect(url_for("dashboard_admin"))
     
-    usuarios = []
+    cursor = request.args.get("cursor")
+    usuarios, siguiente = [], None
     try:
-        # Obtener todos los usuarios con rol 'cliente' ordenados por fecha de registro
-        res = conn.run("""
-            SELECT id, nombre_usuario, correo, nombre_completo, telefono, direccion, fecha_registro
-            FROM usuarios
-            WHERE rol = :rol
-            ORDER BY fecha_registro DESC;
-        """, rol="cliente")
-        
-        for row in res:
-            usuarios.append({
-                "id": row[0],
-                "nombre_usuario": row[1],
-                "correo": row[2],
-                "nombre_completo": row[3] or row[1],
-                "telefono": row[4] or "No registrado",
-                "direccion": row[5] or "No registrada",
-                "fecha_registro": row[6]
-            })
-        
-        print(f"✅ Listado de usuarios: {len(usuarios)} clientes encontrados")
+        # Clientes por fecha de registro, una página por cursor (usuarios_db.py)
+        pagina = pagina_clientes_admin(conn, cursor)
+        usuarios, siguiente = pagina.items, pagina.siguiente
+        print(f"✅ Listado de usuarios: {len(usuarios)} clientes en la página")
     
     except Exception as e:
         print(f"❌ Error al obtener usuarios: {e}")
@@ -1646,7 +1428,8 @@ def gestionar_usuarios():
         except:
             pass
     
-    return render_template("gestionar_usuarios.html", usuarios=usuarios)
+    return render_template("gestionar_usuarios.html", usuarios=usuarios, stats=estadisticas_dashboard(),
+                           siguiente=siguiente, hay_cursor=bool(cursor))
 
 
 # ------------------------------------------------------------
@@ -1664,32 +1447,13 @@ def gestionar_resenas():
         flash("Error de conexión con la base de datos.", "danger")
         return redirect(url_for("dashboard_admin"))
     
-    resenas = []
+    cursor = request.args.get("cursor")
+    resenas, siguiente = [], None
     try:
-        # Obtener todas las reseñas con información de usuario y producto
-        res = conn.run("""
-            SELECT r.id, r.id_usuario, u.nombre_completo, u.correo, r.id_producto, 
-                   p.nombre as producto_nombre, r.comentario, r.calificacion, r.fecha
-            FROM resenas r
-            JOIN usuarios u ON r.id_usuario = u.id
-            JOIN productos p ON r.id_producto = p.id
-            ORDER BY r.fecha DESC;
-        """)
-        
-        for row in res:
-            resenas.append({
-                "id": row[0],
-                "id_usuario": row[1],
-                "usuario_nombre": row[2],
-                "usuario_correo": row[3],
-                "id_producto": row[4],
-                "producto_nombre": row[5],
-                "comentario": row[6],
-                "calificacion": row[7],
-                "fecha": row[8]
-            })
-        
-        print(f"✅ Listado de reseñas: {len(resenas)} reseñas encontradas")
+        # Reseñas más recientes primero, una página por cursor (resenas_db.py)
+        pagina = pagina_resenas_admin(conn, cursor)
+        resenas, siguiente = pagina.items, pagina.siguiente
+        print(f"✅ Listado de reseñas: {len(resenas)} reseñas en la página")
     
     except Exception as e:
         print(f"❌ Error al obtener reseñas: {e}")
@@ -1700,7 +1464,8 @@ def gestionar_resenas():
         except:
             pass
     
-    return render_template("gestionar_resenas.html", resenas=resenas)
+    return render_template("gestionar_resenas.html", resenas=resenas, stats=estadisticas_dashboard(),
+                           siguiente=siguiente, hay_cursor=bool(cursor))
 
 
 # ------------------------------------------------------------
@@ -1718,29 +1483,13 @@ def gestionar_pedidos():
         flash("Error de conexión con la base de datos.", "danger")
         return redirect(url_for("dashboard_admin"))
     
-    pedidos = []
+    cursor = request.args.get("cursor")
+    pedidos, siguiente = [], None
     try:
-        # Obtener todos los pedidos con información de usuario
-        res = conn.run("""
-            SELECT p.id, p.id_usuario, u.nombre_completo, u.correo, p.fecha_pedido, 
-                   p.total, p.estado
-            FROM pedidos p
-            JOIN usuarios u ON p.id_usuario = u.id
-            ORDER BY p.fecha_pedido DESC;
-        """)
-        
-        for row in res:
-            pedidos.append({
-                "id": row[0],
-                "id_usuario": row[1],
-                "usuario_nombre": row[2],
-                "usuario_correo": row[3],
-                "fecha_pedido": row[4],
-                "total": int(parse_price_db(row[5]).quantize(Decimal('1'))),
-                "estado": row[6]
-            })
-        
-        print(f"✅ Listado de pedidos: {len(pedidos)} pedidos encontrados")
+        # Pedidos más recientes primero, una página por cursor (pedidos_db.py)
+        pagina = pagina_pedidos_admin(conn, cursor)
+        pedidos, siguiente = pagina.items, pagina.siguiente
+        print(f"✅ Listado de pedidos: {len(pedidos)} pedidos en la página")
     
     except Exception as e:
         print(f"❌ Error al obtener pedidos: {e}")
@@ -1751,7 +1500,8 @@ def gestionar_pedidos():
         except:
             pass
     
-    return render_template("gestionar_pedidos.html", pedidos=pedidos)
+    return render_template("gestionar_pedidos.html", pedidos=pedidos, stats=estadisticas_dashboard(),
+                           siguiente=siguiente, hay_cursor=bool(cursor))
 
 
 # ------------------------------------------------------------
@@ -1783,30 +1533,43 @@ def gestionar_productos():
             try:
                 producto_id = int(producto_id)
                 nuevo_stock = int(nuevo_stock)
+                # Valores que mostraba el formulario (concurrencia optimista)
+                version = int(request.form.get("version", 1))
+                stock_original = request.form.get("stock_original", "").strip()
+                stock_original = int(stock_original) if stock_original else nuevo_stock
+                precio_original = request.form.get("precio_original", "").strip() or None
                 
                 if nuevo_stock < 0:
                     flash("El stock no puede ser negativo.", "warning")
                     return redirect(url_for("gestionar_productos"))
                 
-                # Actualizar stock
-                conn.run("UPDATE productos SET stock = :stock WHERE id = :id;", stock=nuevo_stock, id=producto_id)
-                
-                # Actualizar precio si se proporciona
+                nuevo_precio_dec = None
                 if nuevo_precio:
                     try:
                         nuevo_precio_dec = Decimal(nuevo_precio)
-                        if nuevo_precio_dec < 0:
-                            flash("El precio no puede ser negativo.", "warning")
-                            return redirect(url_for("gestionar_productos"))
-                        conn.run("UPDATE productos SET precio = :precio WHERE id = :id;", precio=nuevo_precio_dec, id=producto_id)
+                        precio_original = Decimal(precio_original) if precio_original else None
                     except (InvalidOperation, ValueError):
                         flash("Precio inválido.", "warning")
                         return redirect(url_for("gestionar_productos"))
+                    if nuevo_precio_dec < 0:
+                        flash("El precio no puede ser negativo.", "warning")
+                        return redirect(url_for("gestionar_productos"))
+                
+                # Stock por diferencia + precio + versión en un solo UPDATE condicional
+                actualizado = actualizar_producto(conn, producto_id, version, stock_original, nuevo_stock,
+                                                  precio_original, nuevo_precio_dec)
+                if actualizado is None:
+                    flash("No hay cambios que guardar.", "info")
+                    return redirect(url_for("gestionar_productos"))
                 
-                conn.commit()
-                flash("Producto actualizado correctamente.", "success")
+                invalidar_catalogo()
+                flash(f"Producto actualizado correctamente (stock actual: {actualizado['stock']}).", "success")
                 return redirect(url_for("gestionar_productos"))
             
+            except ConflictoProducto as e:
+                print(f"⚠️ Conflicto al editar producto {producto_id}: {e.motivo}")
+                flash(f"No se guardó el producto #{producto_id}: {e.motivo} Revisa los valores actuales.", "warning")
+                return redirect(url_for("gestionar_productos"))
             except ValueError:
                 flash("Stock y precio deben ser números válidos.", "warning")
                 return redirect(url_for("gestionar_productos"))
@@ -1822,13 +1585,14 @@ def gestionar_productos():
         # GET: cargar todos los productos para la tabla
         productos = []
         try:
-            res = conn.run("SELECT id, nombre, precio, stock FROM productos ORDER BY id;")
+            res = conn.run("SELECT id, nombre, precio, stock, version FROM productos ORDER BY id;")
             for r in res:
                 productos.append({
                     "id": r[0],
                     "nombre": r[1],
                     "precio": int(parse_price_db(r[2]).quantize(Decimal('1'))),
-                    "stock": r[3]
+                    "stock": r[3],
+                    "version": r[4]
                 })
         except Exception as e:
             print(f"❌ Error al cargar productos: {e}")
@@ -1847,41 +1611,148 @@ def gestionar_productos():
             pass
 
 
+@app.route("/admin/gestionar_productos/lote", methods=["GET", "POST"])
+@login_required
+def gestionar_productos_lote():
+    """
+    Edición masiva del inventario: la tabla completa en un solo formulario o un
+    CSV (id,stock,precio). Todo el lote se aplica en una sentencia y una
+    transacción; si alguna fila falla no se aplica ninguna y se listan los errores.
+    """
+    if current_user.rol != "admin":
+        flash("No tienes permisos para acceder a esta sección.", "danger")
+        return redirect(url_for("index"))
+    
+    errores = []
+    if request.method == "POST":
+        archivo = request.files.get("csv")
+        texto = request.form.get("csv_texto", "").strip()
+        if archivo and archivo.filename:
+            try:
+                texto = archivo.read().decode("utf-8-sig")
+            except UnicodeDecodeError:
+                flash("El CSV debe estar en UTF-8.", "warning")
+                return redirect(url_for("gestionar_productos_lote"))
+        
+        if texto:
+            cambios, errores = cambios_desde_csv(texto)
+        else:
+            cambios, errores = cambios_desde_formulario(request.form)
+        
+        if not errores and not cambios:
+            flash("No hay cambios que guardar.", "info")
+            return redirect(url_for("gestionar_productos_lote"))
+        
+        if not errores:
+            try:
+                inicio = time.perf_counter()
+                with db_connection() as conn:
+                    resultado = actualizar_productos_lote(conn, cambios)
+                errores = resultado.errores
+            except Exception as e:
+                print(f"❌ Error en la edición masiva de productos: {e}")
+                flash("Error al actualizar los productos.", "danger")
+                return redirect(url_for("gestionar_productos_lote"))
+            
+            if resultado.ok:
+                invalidar_catalogo()
+                ms = (time.perf_counter() - inicio) * 1000
+                print(f"✅ Edición masiva: {resultado.aplicados} productos en {ms:.0f} ms")
+                flash(f"{resultado.aplicados} productos actualizados.", "success")
+                return redirect(url_for("gestionar_productos_lote"))
+        
+        flash(f"No se aplicó ningún cambio: {len(errores)} fila(s) con errores.", "warning")
+    
+    productos = []
+    try:
+        with db_connection() as conn:
+            res = conn.run("SELECT id, nombre, precio, stock, version FROM productos ORDER BY id;")
+        for r in res:
+            productos.append({
+                "id": r[0],
+                "nombre": r[1],
+                "precio": int(parse_price_db(r[2]).quantize(Decimal('1'))),
+                "stock": r[3],
+                "version": r[4]
+            })
+    except Exception as e:
+        print(f"❌ Error al cargar productos: {e}")
+        flash("Error al cargar los productos.", "danger")
+    
+    return render_template("gestionar_productos_lote.html", productos=productos, errores=errores)
+
+
 # ------------------------------------------------------------
 # CARRITO DE COMPRAS
 # ------------------------------------------------------------
+def guardar_con_reservas(carrito, conn=None):
+    """
+    Reserva el stock del carrito (reservas.py), lo guarda y avisa de las líneas
+    recortadas porque otros carritos ya tienen esas unidades. Si la reserva
+    falla se guarda igual: el checkout vuelve a validar el stock.
+    """
+    recortes = []
+    try:
+        if conn is not None:
+            recortes = reservar_carrito(conn, id_carrito(session), carrito)
+        else:
+            with db_connection() as conn:
+                recortes = reservar_carrito(conn, id_carrito(session), carrito)
+    except Exception as e:
+        print(f"❌ Error al reservar stock del carrito: {e}")
+    guardar_carrito(session, carrito)
+    
+    for r in recortes:
+        if r.reservada == 0:
+            flash(f"'{r.nombre}' no tiene unidades disponibles ahora mismo (están reservadas en otros carritos).", "warning")
+        else:
+            flash(f"Sólo pudimos reservarte {r.reservada} unidades de '{r.nombre}'.", "warning")
+    return recortes
+
+
+def liberar_reservas():
+    """Devuelve las reservas del carrito de esta sesión (antes de vaciarlo)."""
+    carrito_id = session.get("carrito_id")
+    if not carrito_id:
+        return
+    try:
+        with db_connection() as conn:
+            liberar_carrito(conn, carrito_id)
+    except Exception as e:
+        # Si falla, el barrido las libera al vencer
+        print(f"⚠️ No se pudieron liberar las reservas del carrito: {e}")
+
+
 @app.route("/carrito", methods=["GET", "POST"])
 def carrito():
     if request.method == "POST":
-        carrito = session.get("carrito", [])
+        carrito = cargar_carrito(session)
         changed = False
         
-        for item in carrito:
-            key = f"qty_{item['id']}"
+        for pid, cantidad in carrito.items():
+            key = f"qty_{pid}"
             if key in request.form:
                 try:
-                    new_q = int(request.form.get(key, item.get("cantidad", 1)))
-                    if new_q <= 0:
-                        item["cantidad"] = 0
-                    else:
-                        item["cantidad"] = new_q
+                    # 0 o menos elimina la línea
+                    carrito.fijar(pid, int(request.form.get(key, cantidad)))
                     changed = True
                 except Exception:
                     pass
         
-        carrito = [i for i in carrito if int(i.get("cantidad", 1)) > 0]
-        session["carrito"] = carrito
-        session.modified = True
+        if changed:
+            guardar_con_reservas(carrito)
         
         if changed:
             flash("Carrito actualizado.", "success")
         
         return redirect(url_for("carrito"))
     
-    carrito = session.get("carrito", [])
-    total = sum(int(item["precio"]) * int(item["cantidad"]) for item in carrito)
+    # Precios y stock actuales de todas las líneas en una consulta (o memorizados)
+    cotizacion = cotizar_carrito(cargar_carrito(session))
+    lineas, total, total_usd = carrito_para_vista(cotizacion)
     
-    return render_template("carrito.html", carrito=carrito, total=total)
+    return render_template("carrito.html", carrito=lineas, total=total, total_usd=total_usd,
+                           avisos=cotizacion.avisos)
 
 
 @app.route("/agregar_carrito/<int:producto_id>", methods=["GET", "POST"])
@@ -1901,7 +1772,7 @@ def agregar_carrito(producto_id):
     
     conn = get_connection()
     try:
-        res = conn.run("SELECT id, nombre, precio, imagen_url, stock FROM productos WHERE id = :id;", id=producto_id)
+        res = conn.run("SELECT id, nombre, stock FROM productos WHERE id = :id;", id=producto_id)
         if not res:
             flash("Producto no encontrado.", "warning")
             return redirect(url_for("tienda"))
@@ -1909,12 +1780,7 @@ def agregar_carrito(producto_id):
         row = res[0]
         prod_id = row[0]
         nombre = row[1]
-        precio_raw = row[2]
-        imagen = row[3]
-        stock = row[4] if len(row) > 4 else None
-        
-        precio_dec = parse_price_db(precio_raw).quantize(Decimal('1'))
-        precio_int = int(precio_dec)
+        stock = row[2]
         
         if stock is not None:
             if stock <= 0:
@@ -1924,30 +1790,15 @@ def agregar_carrito(producto_id):
                 flash(f"Sólo hay {stock} unidades disponibles.", "warning")
                 qty = int(stock)
         
-        producto = {
-            "id": int(prod_id),
-            "nombre": nombre,
-            "precio": precio_int,
-            "imagen_url": imagen,
-            "cantidad": int(qty)
-        }
-        
-        carrito = session.get("carrito", [])
-        found = False
-        
-        for item in carrito:
-            if int(item.get("id")) == producto["id"]:
-                item["cantidad"] = int(item.get("cantidad", 1)) + producto["cantidad"]
-                found = True
-                break
-        
-        if not found:
-            carrito.append(producto)
+        carrito = cargar_carrito(session)
+        antes = carrito.cantidad(int(prod_id))
+        carrito.agregar(int(prod_id), int(qty))
+        # Reserva las unidades durante unos minutos (puede recortar la línea)
+        guardar_con_reservas(carrito, conn)
         
-        session["carrito"] = carrito
-        session.modified = True
-        
-        flash(f"{producto['cantidad']} x {producto['nombre']} agregado(s) al carrito.", "success")
+        agregadas = carrito.cantidad(int(prod_id)) - antes
+        if agregadas > 0:
+            flash(f"{agregadas} x {nombre} agregado(s) al carrito.", "success")
     except Exception as e:
         print(f"❌ Error al agregar al carrito: {e}")
         flash("No se pudo agregar el producto al carrito.", "danger")
@@ -1962,8 +1813,8 @@ def agregar_carrito(producto_id):
 
 @app.route("/vaciar_carrito")
 def vaciar_carrito():
-    session["carrito"] = []
-    session.modified = True
+    liberar_reservas()
+    borrar_carrito(session)
     return redirect(url_for("carrito"))
 
 
@@ -1977,148 +1828,99 @@ def checkout():
         flash("Debes iniciar sesión para continuar.", "warning")
         return redirect(url_for("login"))
     
-    carrito = session.get("carrito", [])
-    if not carrito:
+    # Clave de idempotencia del formulario: un reenvío del mismo formulario
+    # (doble clic, recarga tras una respuesta lenta) no crea un segundo pedido
+    clave = (request.form.get("clave_pedido") or "").strip()[:64] or None
+    
+    cotizacion = cotizar_carrito(cargar_carrito(session))
+    if not cotizacion.lineas:
+        if request.method == "POST" and clave:
+            # El primer envío ya vació el carrito: se responde igual que entonces
+            id_usuario = int(session.get("usuario_id") or current_user.get_id())
+            try:
+                with db_connection() as conn:
+                    pedido_id = pedido_por_clave(conn, id_usuario, clave)
+            except Exception as e:
+                print(f"❌ Error consultando clave de checkout: {e}")
+                pedido_id = None
+            if pedido_id is not None:
+                print(f"↩️ Checkout repetido: pedido #{pedido_id} ya registrado para usuario {id_usuario}")
+                flash("Compra realizada con éxito (simulada).", "success")
+                return redirect(url_for("checkout_success"))
         flash("Tu carrito está vacío.", "info")
         return redirect(url_for("tienda"))
     
-    total = sum(int(item["precio"]) * int(item["cantidad"]) for item in carrito)
-    
     if request.method == "POST":
+        conn = get_connection()
+        if not conn:
+            flash("Error de conexión con la base de datos.", "danger")
+            return redirect(url_for("carrito"))
+        
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
             id_usuario = int(session.get("usuario_id") or current_user.get_id())
             
-            # ← NUEVO: Validación completa de stock ANTES de procesar
-            productos_sin_stock = []
-            productos_stock_insuficiente = []
+            # Stock + pedido + detalles en una sola transacción; las reservas del carrito pasan al pedido
+            # (crear_pedido vuelve a validar stock y toma el precio con las filas bloqueadas;
+            # con la misma clave devuelve el pedido ya creado sin escribir nada)
+            # La cotización puede ir hasta CATALOGO_CHECK_SECONDS por detrás de productos:
+            # si el total a cobrar no es el que se confirmó, no se cobra y se vuelve a mostrar
+            total_mostrado = request.form.get("total_mostrado", "").strip()
+            total_mostrado = int(total_mostrado) if total_mostrado.isdigit() else cotizacion.total
+            pedido_id = crear_pedido(conn, id_usuario, cotizacion.lineas, clave=clave,
+                                     id_carrito=session.get("carrito_id"), total_esperado=total_mostrado)
             
-            for item in carrito:
-                pid = int(item["id"])
-                q_needed = int(item["cantidad"])
-                
-                # Obtener stock actual y nombre del producto
-                row = conn.run("SELECT stock, nombre FROM productos WHERE id = :id;", id=pid)
-                
-                if not row or not row[0]:
-                    productos_sin_stock.append(item["nombre"])
-                    continue
-                
-                stock_actual = row[0][0]
-                nombre_producto = row[0][1]
-                
-                # Validar si hay stock suficiente
-                if stock_actual is None:
-                    # Si stock es NULL, permitir la compra (stock ilimitado)
-                    continue
-                elif stock_actual <= 0:
-                    productos_sin_stock.append(nombre_producto)
-                elif q_needed > stock_actual:
-                    productos_stock_insuficiente.append(
-                        f"{nombre_producto} (disponible: {stock_actual}, solicitaste: {q_needed})"
-                    )
+        except PrecioCambiado as e:
+            # Descarta la copia del catálogo: la siguiente cotización lee la versión nueva
+            invalidar_catalogo()
+            print(f"⚠️ Checkout detenido: {e}")
+            flash("Los precios de algunos productos cambiaron. Revisa el nuevo total y confirma de nuevo.", "warning")
+            return redirect(url_for("checkout"))
             
-            # Si hay productos sin stock o insuficientes, rechazar la compra
-            if productos_sin_stock or productos_stock_insuficiente:
-                try:
-                    cursor.close()
-                except:
-                    pass
-                try:
-                    conn.close()
-                except:
-                    pass
-                
-                # Construir mensaje de error
-                mensaje_error = "No se pudo procesar tu pedido. "
-                
-                if productos_sin_stock:
-                    if len(productos_sin_stock) == 1:
-                        mensaje_error += f"El producto '{productos_sin_stock[0]}' ya no tiene stock disponible. "
-                    else:
-                        lista_productos = "', '".join(productos_sin_stock)
-                        mensaje_error += f"Los productos '{lista_productos}' ya no tienen stock disponible. "
-                
-                if productos_stock_insuficiente:
-                    if len(productos_stock_insuficiente) == 1:
-                        mensaje_error += f"{productos_stock_insuficiente[0]}. "
-                    else:
-                        for prod_info in productos_stock_insuficiente:
-                            mensaje_error += f"{prod_info}. "
-                
-                mensaje_error += "Por favor actualiza tu carrito."
-                
-                flash(mensaje_error, "danger")
-                print(f"❌ Compra rechazada: {mensaje_error}")
-                return redirect(url_for("carrito"))
-            
-            # ← Si llegamos aquí, todos los productos tienen stock suficiente
-            # Proceder con la compra
+        except StockInsuficiente as e:
+            # Construir mensaje de error
+            mensaje_error = "No se pudo procesar tu pedido. "
             
-            # Insertar pedido
-            insert_pedido = """
-                INSERT INTO pedidos (id_usuario, fecha_pedido, total, estado)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id;
-            """
-            cursor.execute(insert_pedido, (id_usuario, datetime.now(), total, "Pendiente"))
-            pedido_id = cursor.fetchone()[0]
-            
-            # Insertar detalle y actualizar stock
-            insert_detalle = """
-                INSERT INTO detalle_pedidos (id_pedido, id_producto, cantidad, subtotal)
-                VALUES (%s, %s, %s, %s);
-            """
-            update_stock = "UPDATE productos SET stock = stock - %s WHERE id = %s;"
-            
-            for item in carrito:
-                pid = int(item["id"])
-                qty = int(item["cantidad"])
-                unit_price = int(item["precio"])
-                subtotal = unit_price * qty
-                cursor.execute(insert_detalle, (pedido_id, pid, qty, subtotal))
-                cursor.execute(update_stock, (qty, pid))
-            
-            conn.commit()
+            if e.sin_stock:
+                if len(e.sin_stock) == 1:
+                    mensaje_error += f"El producto '{e.sin_stock[0]}' ya no tiene stock disponible. "
+                else:
+                    lista_productos = "', '".join(e.sin_stock)
+                    mensaje_error += f"Los productos '{lista_productos}' ya no tienen stock disponible. "
             
-            try:
-                cursor.close()
-            except:
-                pass
-            try:
-                conn.close()
-            except:
-                pass
+            for prod_info in e.insuficiente:
+                mensaje_error += f"{prod_info}. "
             
-            # Vaciar carrito
-            session["carrito"] = []
-            session.modified = True
+            mensaje_error += "Por favor actualiza tu carrito."
             
-            print(f"✅ Pedido #{pedido_id} procesado correctamente para usuario {id_usuario}")
-            flash("Compra realizada con éxito (simulada).", "success")
-            return redirect(url_for("checkout_success"))
+            flash(mensaje_error, "danger")
+            print(f"❌ Compra rechazada: {mensaje_error}")
+            return redirect(url_for("carrito"))
             
         except Exception as e:
             print(f"❌ Error en checkout: {e}")
             import traceback
             traceback.print_exc()
-            try:
-                conn.rollback()
-            except:
-                pass
-            try:
-                cursor.close()
-            except:
-                pass
+            flash("Error procesando el pedido. Por favor intenta de nuevo.", "danger")
+            return redirect(url_for("carrito"))
+        finally:
             try:
                 conn.close()
             except:
                 pass
-            flash("Error procesando el pedido. Por favor intenta de nuevo.", "danger")
-            return redirect(url_for("carrito"))
+        
+        invalidar_catalogo()
+        
+        # Vaciar carrito
+        borrar_carrito(session)
+        
+        print(f"✅ Pedido #{pedido_id} procesado correctamente para usuario {id_usuario}")
+        flash("Compra realizada con éxito (simulada).", "success")
+        return redirect(url_for("checkout_success"))
     
-    return render_template("checkout.html", carrito=carrito, total=total)
+    lineas, total, total_usd = carrito_para_vista(cotizacion)
+    return render_template("checkout.html", carrito=lineas, total=total, total_usd=total_usd,
+                           avisos=cotizacion.avisos, clave_pedido=secrets.token_urlsafe(24),
+                           total_mostrado=cotizacion.total)
 
 @app.route("/checkout_success")
 def checkout_success():
@@ -1,6 +1,8 @@
 import pg8000
 import os
 import ssl
+import threading
+import time
 from contextlib import contextmanager
 from dotenv import load_dotenv
 
@@ -9,54 +11,349 @@ from dotenv import load_dotenv
 # ---------------------------------------------------------
 load_dotenv()
 
+# ---------------------------------------------------------
+# CONFIGURACIÓN DEL POOL DE CONEXIONES
+# ---------------------------------------------------------
+# Cada worker de gunicorn tiene su propio pool (se reinicia tras un fork).
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))             # espera máxima para obtener conexión (s)
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))  # reciclar conexiones tras 30 min
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))          # cerrar conexiones ociosas sobre el mínimo
+DB_POOL_HEALTHCHECK = float(os.getenv("DB_POOL_HEALTHCHECK", 30))     # hacer SELECT 1 si estuvo ociosa más de N s
+
+
+# ---------------------------------------------------------
+# FUNCIÓN DE CONEXIÓN (conexión física)
+# ---------------------------------------------------------
+def _new_connection():
+    """
+    Abre una conexión física nueva con PostgreSQL
+    usando las variables de entorno definidas en el archivo .env.
+
+    - DESARROLLO (localhost): SIN SSL
+    - PRODUCCIÓN (Render): CON SSL
+
+    Lanza la excepción de pg8000 si falla.
+    """
+    # Obtener configuración de la BD
+    db_host = os.getenv("DB_HOST")
+    db_name = os.getenv("DB_NAME")
+    db_user = os.getenv("DB_USER")
+    db_pass = os.getenv("DB_PASS")
+    db_port = int(os.getenv("DB_PORT", 5432))
+
+    # Determinar si es localhost o remoto
+    is_localhost = db_host in ["localhost", "127.0.0.1"]
+
+    # Configurar SSL según ambiente
+    ssl_context = None
+    if not is_localhost:
+        # PRODUCCIÓN (Render o servidor remoto): SSL OBLIGATORIO
+        print(f"🔒 Conectando a BD remota ({db_host}) CON SSL...")
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    else:
+        # DESARROLLO (localhost): SIN SSL
+        print(f"💻 Conectando a BD local ({db_host}) SIN SSL...")
+
+    # Realizar conexión
+    connection = pg8000.connect(
+        database=db_name,
+        user=db_user,
+        password=db_pass,
+        host=db_host,
+        port=db_port,
+        ssl_context=ssl_context  # None para local, ssl_context para remoto
+    )
+    print("✅ Conexión a la base de datos establecida correctamente.")
+    return connection
+
+
+def _close_quietly(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+# ---------------------------------------------------------
+# POOL DE CONEXIONES
+# ---------------------------------------------------------
+class PoolTimeout(Exception):
+    """No se obtuvo una conexión libre dentro de DB_POOL_TIMEOUT."""
+
+
+class _PoolEntry:
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+
+class PooledConnection:
+    """
+    Envoltorio de una conexión pg8000 prestada por el pool.
+
+    Se usa igual que la conexión original (run, cursor, commit, rollback...).
+    close() no cierra el socket: deshace cualquier transacción abierta y
+    devuelve la conexión al pool. Llamar close() varias veces es seguro.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get("_entry")
+        if entry is None:
+            raise pg8000.InterfaceError("La conexión ya fue devuelta al pool")
+        return getattr(entry.raw, name)
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def discard(self):
+        """Devuelve la conexión marcándola como inservible (se cierra)."""
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry, broken=True)
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones por proceso con tamaño mínimo/máximo,
+    verificación de salud, reciclaje por antigüedad y timeout de préstamo.
+    """
+
+    def __init__(self, connect=_new_connection, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, max_lifetime=DB_POOL_MAX_LIFETIME,
+                 max_idle=DB_POOL_MAX_IDLE, healthcheck_after=DB_POOL_HEALTHCHECK):
+        self._connect = connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.healthcheck_after = healthcheck_after
+        self._cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = []          # pila LIFO: la conexión más reciente está más "caliente"
+        self._size = 0           # conexiones físicas abiertas (ociosas + prestadas)
+        self._in_use = 0
+        self._stats = {
+            "borrows": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "failed_healthchecks": 0,
+            "borrow_time_total": 0.0,
+            "borrow_time_max": 0.0,
+        }
+
+    def _check_fork(self):
+        # Tras un fork (gunicorn --preload) el hijo no debe reutilizar los
+        # sockets del padre: se olvidan sin cerrarlos.
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _expired(self, entry, now):
+        return self.max_lifetime and (now - entry.created_at) >= self.max_lifetime
+
+    def _healthy(self, entry, now):
+        if not self.healthcheck_after or (now - entry.last_used) < self.healthcheck_after:
+            return True
+        try:
+            entry.raw.run("SELECT 1;")
+            return True
+        except Exception:
+            self._stats["failed_healthchecks"] += 1
+            return False
+
+    def _drop(self, entry):
+        """Cierra una conexión física. Llamar con el lock tomado."""
+        self._size -= 1
+        self._stats["discarded"] += 1
+        _close_quietly(entry.raw)
+
+    def acquire(self, timeout=None):
+        """
+        Presta una conexión. Reutiliza una ociosa si existe, abre una nueva
+        si no se alcanzó max_size, o espera hasta `timeout` segundos.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            entry = None
+            with self._cond:
+                self._check_fork()
+                while True:
+                    now = time.monotonic()
+                    if self._idle:
+                        entry = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    if self._size < self.max_size:
+                        # Reservar el hueco y conectar fuera del lock
+                        self._size += 1
+                        break
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"Pool agotado: {self._in_use}/{self.max_size} conexiones en uso tras {timeout}s"
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                break
+
+            # La verificación de salud hace I/O: se ejecuta fuera del lock
+            if not self._expired(entry, now) and self._healthy(entry, now):
+                with self._cond:
+                    return self._lend(entry, started, waited)
+            with self._cond:
+                self._in_use -= 1
+                self._drop(entry)
+                self._cond.notify()
+
+        try:
+            raw = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use += 1
+            self._stats["created"] += 1
+            return self._lend(_PoolEntry(raw), started, waited)
+
+    def _lend(self, entry, started, waited):
+        """Registra el préstamo. Llamar con el lock tomado."""
+        elapsed = time.monotonic() - started
+        self._stats["borrows"] += 1
+        self._stats["borrow_time_total"] += elapsed
+        if elapsed > self._stats["borrow_time_max"]:
+            self._stats["borrow_time_max"] = elapsed
+        return PooledConnection(self, entry)
+
+    def _release(self, entry, broken=False):
+        # Nunca devolver al pool una conexión con una transacción a medias
+        if not broken:
+            try:
+                entry.raw.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._in_use -= 1
+            now = time.monotonic()
+            if broken or self._expired(entry, now):
+                self._drop(entry)
+            else:
+                entry.last_used = now
+                self._idle.append(entry)
+                self._prune_idle(now)
+            self._cond.notify()
+
+    def _prune_idle(self, now):
+        """Cierra conexiones ociosas por encima del mínimo. Llamar con el lock tomado."""
+        if not self.max_idle:
+            return
+        # Las más antiguas están al fondo de la pila
+        while self._idle and self._size > self.min_size and now - self._idle[0].last_used >= self.max_idle:
+            self._drop(self._idle.pop(0))
+
+    def warmup(self):
+        """Abre conexiones hasta alcanzar min_size (útil al arrancar un worker)."""
+        conns = []
+        try:
+            with self._cond:
+                self._check_fork()
+                missing = self.min_size - self._size
+            for _ in range(max(0, missing)):
+                conns.append(self.acquire())
+        finally:
+            for c in conns:
+                c.close()
+
+    def close_all(self):
+        """Cierra las conexiones ociosas (las prestadas se cierran al devolverse)."""
+        with self._cond:
+            self._check_fork()
+            while self._idle:
+                self._drop(self._idle.pop())
+            self._cond.notify_all()
+
+    def stats(self):
+        """Estado actual del pool para dimensionar workers de gunicorn."""
+        with self._cond:
+            self._check_fork()
+            s = dict(self._stats)
+            borrows = s.pop("borrows")
+            total = s.pop("borrow_time_total")
+            s["borrow_time_max_ms"] = round(s.pop("borrow_time_max") * 1000, 3)
+            s.update({
+                "pid": self._pid,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "borrows": borrows,
+                "borrow_time_avg_ms": round(total / borrows * 1000, 3) if borrows else 0.0,
+            })
+            return s
+
+
+_pool = ConnectionPool()
+
+
+def get_pool():
+    return _pool
+
+
+def pool_stats():
+    return _pool.stats()
+
+
 # ---------------------------------------------------------
 # FUNCIÓN DE CONEXIÓN
 # ---------------------------------------------------------
 def get_connection():
     """
-    Establece una conexión con la base de datos PostgreSQL
+    Obtiene una conexión del pool del worker (la abre si hace falta)
     usando las variables de entorno definidas en el archivo .env.
-    
+
     - DESARROLLO (localhost): SIN SSL
     - PRODUCCIÓN (Render): CON SSL
-    
-    Devuelve el objeto de conexión si es exitosa, o None si falla.
+
+    Devuelve la conexión si es exitosa, o None si falla.
+    conn.close() la devuelve al pool en lugar de cerrar el socket.
     """
     try:
-        # Obtener configuración de la BD
-        db_host = os.getenv("DB_HOST")
-        db_name = os.getenv("DB_NAME")
-        db_user = os.getenv("DB_USER")
-        db_pass = os.getenv("DB_PASS")
-        db_port = int(os.getenv("DB_PORT", 5432))
-        
-        # Determinar si es localhost o remoto
-        is_localhost = db_host in ["localhost", "127.0.0.1"]
-        
-        # Configurar SSL según ambiente
-        ssl_context = None
-        if not is_localhost:
-            # PRODUCCIÓN (Render o servidor remoto): SSL OBLIGATORIO
-            print(f"🔒 Conectando a BD remota ({db_host}) CON SSL...")
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-        else:
-            # DESARROLLO (localhost): SIN SSL
-            print(f"💻 Conectando a BD local ({db_host}) SIN SSL...")
-        
-        # Realizar conexión
-        connection = pg8000.connect(
-            database=db_name,
-            user=db_user,
-            password=db_pass,
-            host=db_host,
-            port=db_port,
-            ssl_context=ssl_context  # None para local, ssl_context para remoto
-        )
-        print("✅ Conexión a la base de datos establecida correctamente.")
-        return connection
-        
+        return _pool.acquire()
     except Exception as e:
         print("❌ Error al conectar a la base de datos:", e)
         import traceback
@@ -64,6 +361,17 @@ def get_connection():
         return None
 
 
+def get_direct_connection():
+    """
+    Abre una conexión propia, fuera del pool (misma configuración y SSL).
+    Para tareas que cambian el estado de la sesión (autocommit, locks
+    de sesión), como las migraciones. El llamador debe cerrarla.
+
+    Lanza la excepción de pg8000 si falla.
+    """
+    return _new_connection()
+
+
 # ---------------------------------------------------------
 # PRUEBA DIRECTA DE CONEXIÓN (solo si se ejecuta este archivo)
 # ---------------------------------------------------------
@@ -78,6 +386,7 @@ if __name__ == "__main__":
             cursor.close()
             conn.close()
             print("✅ Prueba de conexión exitosa")
+            print("📊 Pool:", pool_stats())
         except Exception as e:
             print("❌ Error en la prueba:", e)
     else:
@@ -88,7 +397,8 @@ if __name__ == "__main__":
 def db_connection():
     """
     Context manager para manejar conexiones de BD automáticamente.
-    
+    La conexión sale del pool y vuelve a él al terminar.
+
     Uso:
         with db_connection() as conn:
             result = conn.run("SELECT * FROM usuarios;")
@@ -96,7 +406,7 @@ def db_connection():
     conn = get_connection()
     if not conn:
         raise Exception("No se pudo establecer conexión con la BD")
-    
+
     try:
         yield conn
         conn.commit()
@@ -110,4 +420,4 @@ def db_connection():
         try:
             conn.close()
         except:
-            pass
\ No newline at end of file
+            pass
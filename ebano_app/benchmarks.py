@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+benchmarks.py
+Mide el rendimiento de las rutas calientes contra una BD de pruebas.
+
+Crea sus propios datos (usuario "bench_*") y los borra al terminar.
+Por seguridad se niega a ejecutarse contra una BD remota.
+
+Uso:
+    python benchmarks.py                 # todos los benchmarks
+    python benchmarks.py pedidos         # solo uno
+    python benchmarks.py --permitir-remoto pedidos   (NUNCA contra producción)
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+from bd_config import get_connection
+from carrito_store import Carrito
+from pedidos_db import cargar_pedidos_usuario, preparar_recompra
+
+
+# ---------------------------------------------------------
+# UTILIDADES
+# ---------------------------------------------------------
+class ContadorConsultas:
+    """Envuelve una conexión y cuenta cuántas consultas se envían."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.consultas = 0
+
+    def run(self, sql, **params):
+        self.consultas += 1
+        return self._conn.run(sql, **params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def exigir_bd_local():
+    db_host = os.getenv("DB_HOST")
+    if db_host not in ("localhost", "127.0.0.1") and "--permitir-remoto" not in sys.argv:
+        print(f"❌ DB_HOST={db_host} no es local. Los benchmarks escriben datos de prueba.")
+        print("   Apunta DB_HOST a una BD local o usa --permitir-remoto bajo tu responsabilidad.")
+        sys.exit(1)
+
+
+def crear_usuario_bench(conn, rol="cliente"):
+    sufijo = uuid.uuid4().hex[:10]
+    res = conn.run("""
+        INSERT INTO usuarios (nombre_usuario, correo, contraseña, rol, nombre_completo, estado)
+        VALUES (:nu, :correo, 'x', :rol, 'Usuario Benchmark', 'CA')
+        RETURNING id;
+    """, nu=f"bench_{sufijo}", correo=f"bench_{sufijo}@bench.local", rol=rol)
+    conn.commit()
+    return res[0][0]
+
+
+def borrar_usuario_bench(conn, id_usuario):
+    # ON DELETE CASCADE elimina sus pedidos, detalles y reseñas
+    conn.run("DELETE FROM usuarios WHERE id = :id;", id=id_usuario)
+    conn.commit()
+
+
+def crear_productos_bench(conn, n=1, stock=5, precio=1000):
+    """Inserta `n` productos "bench_*" con ese stock y precio; devuelve sus ids."""
+    ids = [r[0] for r in conn.run("""
+        INSERT INTO productos (nombre, descripcion, precio, imagen_url, stock)
+        SELECT 'bench_' || :s || '_' || g, 'Producto benchmark', CAST(:precio AS NUMERIC), '', CAST(:stock AS INT)
+        FROM generate_series(1, CAST(:n AS INT)) g
+        RETURNING id;
+    """, s=uuid.uuid4().hex[:10], n=n, stock=stock, precio=precio)]
+    conn.commit()
+    return ids
+
+
+def borrar_productos_bench(conn, ids):
+    # ON DELETE CASCADE elimina sus líneas de pedido, reseñas y reservas
+    conn.run("DELETE FROM productos WHERE id = ANY(:ids);", ids=ids)
+    conn.commit()
+
+
+def medir(fn, repeticiones=5):
+    """Devuelve la mediana en milisegundos de `repeticiones` ejecuciones."""
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2]
+
+
+def print_section(title):
+    print("\n" + "=" * 70)
+    print(f" {title}")
+    print("=" * 70)
+
+
+# ---------------------------------------------------------
+# BENCHMARK: historial de pedidos (N+1 vs cargador por lotes)
+# ---------------------------------------------------------
+def _historial_n_mas_1(conn, id_usuario):
+    """Réplica del patrón anterior: una consulta de detalle por pedido."""
+    res = conn.run("""
+        SELECT p.id, p.fecha_pedido, p.total, p.estado
+        FROM pedidos p
+        WHERE p.id_usuario = :uid
+        AND p.estado IN ('Entregado', 'Cancelado')
+        ORDER BY p.fecha_pedido DESC;
+    """, uid=id_usuario)
+    pedidos = []
+    for row in res:
+        detalle = conn.run("""
+            SELECT dp.cantidad, dp.subtotal, dp.id_producto, pr.nombre, pr.imagen_url
+            FROM detalle_pedidos dp
+            JOIN productos pr ON pr.id = dp.id_producto
+            WHERE dp.id_pedido = :pid;
+        """, pid=row[0])
+        pedidos.append((row, detalle))
+    return pedidos
+
+
+def _sembrar_pedidos(conn, id_usuario, n_pedidos, lineas=3):
+    conn.run("""
+        INSERT INTO pedidos (id_usuario, fecha_pedido, total, estado)
+        SELECT :uid, NOW() - (g || ' hours')::interval, 100000, 'Entregado'
+        FROM generate_series(1, CAST(:n AS INT)) g;
+    """, uid=id_usuario, n=n_pedidos)
+    conn.run("""
+        INSERT INTO detalle_pedidos (id_pedido, id_producto, cantidad, subtotal)
+        SELECT p.id, pr.id, 1, pr.precio
+        FROM pedidos p
+        CROSS JOIN LATERAL (SELECT id, precio FROM productos ORDER BY id LIMIT CAST(:l AS INT)) pr
+        WHERE p.id_usuario = :uid;
+    """, uid=id_usuario, l=lineas)
+    conn.commit()
+
+
+def bench_pedidos():
+    print_section("HISTORIAL DE PEDIDOS: N+1 vs cargar_pedidos_usuario()")
+    conn = get_connection()
+    print(f"{'pedidos':>8} | {'consultas N+1':>13} | {'ms N+1':>8} | {'consultas lote':>14} | {'ms lote':>8}")
+    print("-" * 65)
+    for n in (10, 50, 200, 1000):
+        uid = crear_usuario_bench(conn)
+        try:
+            _sembrar_pedidos(conn, uid, n)
+
+            viejo = ContadorConsultas(conn)
+            _historial_n_mas_1(viejo, uid)
+            ms_viejo = medir(lambda: _historial_n_mas_1(conn, uid))
+
+            nuevo = ContadorConsultas(conn)
+            cargar_pedidos_usuario(nuevo, uid, finalizados=True)
+            ms_nuevo = medir(lambda: cargar_pedidos_usuario(conn, uid, finalizados=True))
+
+            print(f"{n:>8} | {viejo.consultas:>13} | {ms_viejo:>8.1f} | {nuevo.consultas:>14} | {ms_nuevo:>8.1f}")
+        finally:
+            borrar_usuario_bench(conn, uid)
+    conn.close()
+
+
+# ---------------------------------------------------------
+# BENCHMARK: conversión COP -> USD (filtro por ítem vs lote)
+# ---------------------------------------------------------
+def bench_precios():
+    from decimal import Decimal, ROUND_HALF_UP
+    from tasa_cambio import get_cop_to_usd_rate, format_usd_many, limpiar_cache
+
+    print_section("CONVERSIÓN DE 10.000 PRECIOS: filtro |usd por ítem vs format_usd_many()")
+
+    def usd_por_item(value):
+        # Réplica del filtro anterior: parseo + lectura de tasa + quantize + formato por ítem
+        cop_dec = Decimal(str(value))
+        cop_to_usd, _ = get_cop_to_usd_rate()
+        usd = (cop_dec * cop_to_usd).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        return "${:,.2f} USD".format(float(usd))
+
+    # Catálogo realista: pocos precios distintos repetidos (productos, subtotales)
+    repetidos = [25000 * (1 + i % 40) for i in range(10000)]
+    # Peor caso: todos distintos
+    distintos = [10000 + i for i in range(10000)]
+
+    for nombre, lote in (("precios repetidos", repetidos), ("precios distintos", distintos)):
+        assert format_usd_many(lote) == [usd_por_item(p) for p in lote]
+        ms_item = medir(lambda: [usd_por_item(p) for p in lote])
+        limpiar_cache()
+        t0 = time.perf_counter()
+        format_usd_many(lote)
+        ms_frio = (time.perf_counter() - t0) * 1000
+        ms_lote = medir(lambda: format_usd_many(lote))
+        print(f"{nombre:>18} | por ítem {ms_item:7.2f} ms | lote en frío {ms_frio:7.2f} ms "
+              f"| lote en caliente {ms_lote:7.2f} ms")
+
+
+# ---------------------------------------------------------
+# BENCHMARK: volver a comprar (consultas por pasos vs preparar_recompra)
+# ---------------------------------------------------------
+def _recomprar_por_pasos(conn, id_pedido, id_usuario, carrito):
+    """Réplica de la ruta anterior: pertenencia, detalle y fusión línea a línea en la lista."""
+    if not conn.run("SELECT id FROM pedidos WHERE id = :pid AND id_usuario = :uid;",
+                    pid=id_pedido, uid=id_usuario):
+        return carrito
+    detalle = conn.run("""
+        SELECT dp.id_producto, dp.cantidad, pr.nombre, pr.stock
+        FROM detalle_pedidos dp
+        JOIN productos pr ON pr.id = dp.id_producto
+        WHERE dp.id_pedido = :pid;
+    """, pid=id_pedido)
+    for id_producto, cantidad, _nombre, stock in detalle:
+        if stock is not None and stock <= 0:
+            continue
+        cantidad = min(cantidad, stock) if stock else cantidad
+        for k, (pid, actual) in enumerate(carrito):
+            if pid == id_producto:
+                carrito[k] = (pid, actual + cantidad)
+                break
+        else:
+            carrito.append((id_producto, cantidad))
+    return carrito
+
+
+def _sembrar_pedido_grande(conn, id_usuario, lineas):
+    """Un pedido de `lineas` productos nuevos (bench_*); devuelve (id_pedido, ids de productos)."""
+    ids = [r[0] for r in conn.run("""
+        INSERT INTO productos (nombre, descripcion, precio, imagen_url, stock)
+        SELECT 'bench_' || g, 'Producto benchmark', 1000 + g, '', CASE WHEN g % 10 = 0 THEN 0 ELSE 5 END
+        FROM generate_series(1, CAST(:n AS INT)) g
+        RETURNING id;
+    """, n=lineas)]
+    id_pedido = conn.run("""
+        INSERT INTO pedidos (id_usuario, fecha_pedido, total, estado)
+        VALUES (:uid, NOW(), 0, 'Entregado') RETURNING id;
+    """, uid=id_usuario)[0][0]
+    conn.run("""
+        INSERT INTO detalle_pedidos (id_pedido, id_producto, cantidad, subtotal)
+        SELECT :pid, i, 3, 0 FROM unnest(CAST(:ids AS INT[])) i;
+    """, pid=id_pedido, ids=ids)
+    conn.commit()
+    return id_pedido, ids
+
+
+def bench_recomprar():
+    print_section("VOLVER A COMPRAR: consultas por pasos vs preparar_recompra()")
+    conn = get_connection()
+    print(f"{'líneas':>7} | {'consultas antes':>15} | {'ms antes':>9} | {'consultas ahora':>15} | {'ms ahora':>9}")
+    print("-" * 67)
+    for n in (10, 100, 500, 2000):
+        uid = crear_usuario_bench(conn)
+        ids = []
+        try:
+            id_pedido, ids = _sembrar_pedido_grande(conn, uid, n)
+            # Carrito que ya tiene la mitad de los productos: el peor caso para fusionar
+            previo = [(pid, 1) for pid in ids[::2]]
+
+            def antes(c=conn):
+                return _recomprar_por_pasos(c, id_pedido, uid, list(previo))
+
+            def ahora(c=conn):
+                carrito = Carrito(previo)
+                carrito.fusionar(preparar_recompra(c, id_pedido, uid).agregables)
+                return carrito.items()
+
+            viejo = ContadorConsultas(conn)
+            esperado = antes(viejo)
+            nuevo = ContadorConsultas(conn)
+            assert ahora(nuevo) == esperado
+            ms_antes = medir(antes)
+            ms_ahora = medir(ahora)
+            print(f"{n:>7} | {viejo.consultas:>15} | {ms_antes:>9.1f} | {nuevo.consultas:>15} | {ms_ahora:>9.1f}")
+        finally:
+            borrar_usuario_bench(conn, uid)
+            if ids:
+                conn.run("DELETE FROM productos WHERE id = ANY(:ids);", ids=ids)
+                conn.commit()
+    conn.close()
+
+
+def _rafaga(login, hilos, logins, tarea_ligera):
+    """
+    `hilos` hilos hacen `logins` logins en total mientras otro hilo repite
+    `tarea_ligera` (una petición a /tienda). Devuelve (logins/s, p50 ms, p95 ms, rechazados).
+    """
+    from contrasenas import ContrasenasOcupado
+    rechazados = []
+    latencias = []
+    fin = threading.Event()
+
+    def tienda():
+        while not fin.is_set():
+            inicio = time.perf_counter()
+            tarea_ligera()
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            time.sleep(0.002)
+
+    def trabajador(n):
+        for _ in range(n):
+            try:
+                login()
+            except ContrasenasOcupado:
+                rechazados.append(1)
+
+    hilo_tienda = threading.Thread(target=tienda)
+    hilo_tienda.start()
+    inicio = time.perf_counter()
+    trabajadores = [threading.Thread(target=trabajador, args=(logins // hilos,)) for _ in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    segundos = time.perf_counter() - inicio
+    fin.set()
+    hilo_tienda.join()
+    latencias.sort()
+    p = lambda q: latencias[min(len(latencias) - 1, int(len(latencias) * q))] if latencias else 0.0
+    return (logins - len(rechazados)) / segundos, p(0.5), p(0.95), len(rechazados)
+
+
+def bench_login():
+    import bcrypt
+    import contrasenas
+
+    print_section(f"LOGIN BAJO CARGA: bcrypt en el hilo vs pool acotado (coste {contrasenas.BCRYPT_COSTE})")
+    hash_guardado = contrasenas.hashear("clave-benchmark")
+    clave = "clave-benchmark".encode("utf-8")
+
+    def tarea_ligera():
+        # Render de una página de catálogo: trabajo corto en Python (con GIL)
+        sum(i * i for i in range(20000))
+
+    def inline():
+        bcrypt.checkpw(clave, hash_guardado.encode("utf-8"))
+
+    def en_pool():
+        contrasenas.verificar("clave-benchmark", hash_guardado)
+
+    print(f"{'modo':>22} | {'hilos':>5} | {'logins/s':>8} | {'/tienda p50':>11} | {'/tienda p95':>11} | {'rechazados':>10}")
+    print("-" * 84)
+    for hilos in (4, 16, 64):
+        logins = hilos * 2
+        for nombre, fn in (("en el hilo", inline), (f"pool ({contrasenas.BCRYPT_HILOS} hilos)", en_pool)):
+            por_s, p50, p95, rechazados = _rafaga(fn, hilos, logins, tarea_ligera)
+            print(f"{nombre:>22} | {hilos:>5} | {por_s:>8.1f} | {p50:>9.1f}ms | {p95:>9.1f}ms | {rechazados:>10}")
+    print(f"\nCola máxima por worker: {contrasenas.BCRYPT_COLA_MAX}; "
+          "los logins por encima se rechazan al instante en vez de esperar.")
+
+
+def _golpes_limitador(storage_uri, peticiones, ips, q=None):
+    """
+    `peticiones` hits de "5 per minute" repartidos entre `ips` claves.
+    Devuelve (latencias en µs, hits permitidos); si se pasa `q` los pone ahí.
+    """
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter
+    import limites_store  # noqa: F401  (registra sqlite://)
+
+    limitador = FixedWindowRateLimiter(storage_from_string(storage_uri))
+    limite = parse("5 per minute")
+    latencias, permitidos = [], 0
+    for i in range(peticiones):
+        inicio = time.perf_counter()
+        permitidos += limitador.hit(limite, "bench", f"10.0.{i % ips // 256}.{i % ips % 256}")
+        latencias.append((time.perf_counter() - inicio) * 1e6)
+    if q is not None:
+        q.put((latencias, permitidos))
+    return latencias, permitidos
+
+
+def bench_limitador():
+    import multiprocessing
+    import tempfile
+
+    print_section("RATE LIMITER: coste por petición (memory:// vs SQLite compartido)")
+    carpeta = tempfile.mkdtemp(prefix="bench_limites_")
+    peticiones, ips = 5000, 500
+    ctx = multiprocessing.get_context("fork")
+
+    print(f"{'backend':>14} | {'workers':>7} | {'p50':>8} | {'p99':>8} | {'permitidos':>10} | {'esperados':>9}")
+    print("-" * 72)
+    for workers in (1, 4):
+        # Archivo nuevo en cada ronda para empezar con los cupos llenos
+        backends = (("memory://", "memory://"),
+                    ("sqlite (WAL)", f"sqlite://{os.path.join(carpeta, f'limites_{workers}.sqlite3')}"))
+        for nombre, uri in backends:
+            q = ctx.Queue()
+            procesos = [ctx.Process(target=_golpes_limitador, args=(uri, peticiones, ips, q)) for _ in range(workers)]
+            for p in procesos:
+                p.start()
+            resultados = [q.get() for _ in procesos]
+            for p in procesos:
+                p.join()
+            latencias = sorted(l for lat, _ in resultados for l in lat)
+            permitidos = sum(n for _, n in resultados)
+            p50 = latencias[len(latencias) // 2]
+            p99 = latencias[int(len(latencias) * 0.99)]
+            # 5 por IP y minuto para toda la máquina, no por worker
+            print(f"{nombre:>14} | {workers:>7} | {p50:>6.0f}µs | {p99:>6.0f}µs | {permitidos:>10} | {ips * 5:>9}")
+    print("\nCon memory:// cada worker concede su propio cupo; con SQLite el cupo es de la máquina.")
+
+
+# ---------------------------------------------------------
+# BENCHMARK: analítica de ventas (agregar pedidos vs resúmenes diarios)
+# ---------------------------------------------------------
+def _analitica_directa(conn, desde, hasta):
+    """Lo que calculaba cada tarjeta de Metabase: agregados sobre pedidos/detalle_pedidos."""
+    rango = {"desde": desde, "hasta": hasta + timedelta(days=1)}
+    conn.run("""
+        SELECT estado, COUNT(*), SUM(total) FROM pedidos
+        WHERE fecha_pedido >= :desde AND fecha_pedido < :hasta GROUP BY estado;
+    """, **rango)
+    conn.run("""
+        SELECT u.estado, COUNT(*), SUM(p.total) FROM pedidos p JOIN usuarios u ON u.id = p.id_usuario
+        WHERE p.fecha_pedido >= :desde AND p.fecha_pedido < :hasta AND p.estado <> 'Cancelado'
+        GROUP BY u.estado;
+    """, **rango)
+    conn.run("""
+        SELECT dp.id_producto, SUM(dp.cantidad), SUM(dp.subtotal)
+        FROM pedidos p JOIN detalle_pedidos dp ON dp.id_pedido = p.id
+        WHERE p.fecha_pedido >= :desde AND p.fecha_pedido < :hasta AND p.estado <> 'Cancelado'
+        GROUP BY dp.id_producto ORDER BY 3 DESC LIMIT 10;
+    """, **rango)
+    conn.rollback()
+
+
+def bench_analitica():
+    from analitica import refrescar, resumen_ventas
+
+    print_section("ANALÍTICA DE VENTAS DE UN AÑO: agregar pedidos vs resúmenes diarios")
+    conn = get_connection()
+    hasta = date.today()
+    desde = hasta - timedelta(days=364)
+    refrescar(conn)
+    print(f"{'pedidos':>8} | {'ms directo':>10} | {'ms resúmenes':>12} | {'ms refresco':>11}")
+    print("-" * 52)
+    for n in (1000, 10000, 50000):
+        uid = crear_usuario_bench(conn)
+        try:
+            conn.run("""
+                INSERT INTO pedidos (id_usuario, fecha_pedido, total, estado)
+                SELECT :uid, NOW() - ((g % 365) || ' days')::interval, 100000,
+                       CASE WHEN g % 10 = 0 THEN 'Cancelado' ELSE 'Entregado' END
+                FROM generate_series(1, CAST(:n AS INT)) g;
+            """, uid=uid, n=n)
+            conn.run("""
+                INSERT INTO detalle_pedidos (id_pedido, id_producto, cantidad, subtotal)
+                SELECT p.id, pr.id, 1, pr.precio
+                FROM pedidos p
+                CROSS JOIN LATERAL (SELECT id, precio FROM productos ORDER BY id LIMIT 3) pr
+                WHERE p.id_usuario = :uid;
+            """, uid=uid)
+            conn.commit()
+            inicio = time.perf_counter()
+            refrescar(conn)
+            ms_refresco = (time.perf_counter() - inicio) * 1000
+            ms_directo = medir(lambda: _analitica_directa(conn, desde, hasta))
+            ms_resumen = medir(lambda: resumen_ventas(conn, desde, hasta))
+            print(f"{n:>8} | {ms_directo:>10.1f} | {ms_resumen:>12.1f} | {ms_refresco:>11.0f}")
+        finally:
+            borrar_usuario_bench(conn, uid)
+            refrescar(conn)
+    print("\nEl refresco solo recalcula los días tocados; en producción son los del día.")
+    conn.close()
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+BENCHMARKS = {
+    "pedidos": bench_pedidos,
+    "precios": bench_precios,
+    "recomprar": bench_recomprar,
+    "login": bench_login,
+    "limitador": bench_limitador,
+    "analitica": bench_analitica,
+}
+
+if __name__ == "__main__":
+    exigir_bd_local()
+    elegidos = [a for a in sys.argv[1:] if not a.startswith("--")] or list(BENCHMARKS)
+    for nombre in elegidos:
+        if nombre not in BENCHMARKS:
+            print(f"❌ Benchmark desconocido: {nombre}. Opciones: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[nombre]()
@@ -0,0 +1,103 @@
+"""
+cache_memoria.py
+Caché en memoria (por worker) con TTL y expulsión LRU.
+
+Uso:
+    from cache_memoria import CacheTTL
+
+    usuarios_cache = CacheTTL("usuarios", max_items=2048, ttl=60)
+    valor = usuarios_cache.get(clave)          # None si no está o expiró
+    usuarios_cache.set(clave, valor)
+    usuarios_cache.invalidate(clave)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Registro de todas las cachés creadas (para /api/cache)
+_REGISTRY = {}
+
+_MISSING = object()
+
+
+class CacheTTL:
+    """
+    Diccionario acotado: como máximo `max_items` entradas, cada una válida
+    durante `ttl` segundos. Al llenarse expulsa la menos usada recientemente.
+    Es seguro entre hilos y cuenta aciertos/fallos.
+    """
+
+    def __init__(self, name, max_items=1024, ttl=60):
+        self.name = name
+        self.max_items = max(1, int(max_items))
+        self.ttl = float(ttl)
+        self._data = OrderedDict()   # clave -> (expira_en, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        _REGISTRY[name] = self
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._data),
+                "max_items": self.max_items,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def register(name, cache):
+    """Registra otra caché (cualquier objeto con .stats()) para /api/cache."""
+    _REGISTRY[name] = cache
+
+
+def cache_stats():
+    """Estadísticas de todas las cachés registradas en este worker."""
+    return {name: cache.stats() for name, cache in _REGISTRY.items()}
@@ -0,0 +1,254 @@
+"""
+carrito_store.py
+Carritos guardados en el servidor. La cookie de sesión solo lleva el id del
+carrito (session["carrito_id"]), así que su tamaño no crece con los productos
+y no se vuelve a firmar en cada cambio del carrito.
+
+Cada carrito es una lista compacta de (id_producto, cantidad); nombre, precio
+e imagen se leen de productos al mostrarlo. En memoria se maneja como un
+Carrito (id_producto -> cantidad) para que agregar y fusionar sean O(1) por línea.
+
+Backends (CARRITO_STORE):
+- "sqlite"  (por defecto): archivo local en modo WAL, compartido por todos
+  los workers de gunicorn de la máquina.
+- "memoria": diccionario del proceso; solo para desarrollo con un worker.
+
+Los carritos sin cambios durante CARRITO_TTL_DIAS se descartan.
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+
+CARRITO_STORE = os.getenv("CARRITO_STORE", "sqlite")
+CARRITO_SQLITE_PATH = os.getenv(
+    "CARRITO_SQLITE_PATH",
+    os.path.join(tempfile.gettempdir(), "ebano_carritos.sqlite3")
+)
+CARRITO_TTL_DIAS = float(os.getenv("CARRITO_TTL_DIAS", 30))
+
+# Cada cuántas escrituras se borran los carritos caducados
+_PURGA_CADA = 500
+
+
+class Carrito:
+    """
+    Líneas del carrito indexadas por id de producto, en el orden en que se
+    agregaron (un producto que ya estaba conserva su posición).
+
+        c = Carrito([(3, 1)])
+        c.agregar(5, 2)
+        c.fusionar([(3, 2), (7, 1)])   # un pedido anterior completo, en O(líneas)
+        list(c)                        # [(3, 3), (5, 2), (7, 1)]
+    """
+
+    def __init__(self, items=()):
+        self._lineas = {}
+        self.fusionar(items)
+
+    def agregar(self, id_producto, cantidad):
+        """Suma `cantidad` a la línea (la crea al final si no existe)."""
+        if cantidad <= 0:
+            return
+        self._lineas[id_producto] = self._lineas.get(id_producto, 0) + cantidad
+
+    def fusionar(self, items):
+        """Agrega varias líneas (id_producto, cantidad) de una vez."""
+        lineas = self._lineas
+        for id_producto, cantidad in items:
+            if cantidad > 0:
+                lineas[id_producto] = lineas.get(id_producto, 0) + cantidad
+
+    def fijar(self, id_producto, cantidad):
+        """Cambia la cantidad de una línea existente; 0 o menos la elimina."""
+        if id_producto not in self._lineas:
+            return
+        if cantidad <= 0:
+            del self._lineas[id_producto]
+        else:
+            self._lineas[id_producto] = cantidad
+
+    def quitar(self, id_producto):
+        self._lineas.pop(id_producto, None)
+
+    def cantidad(self, id_producto):
+        return self._lineas.get(id_producto, 0)
+
+    def items(self):
+        """Lista de (id_producto, cantidad) en orden de visualización."""
+        return list(self._lineas.items())
+
+    def __iter__(self):
+        return iter(self._lineas.items())
+
+    def __len__(self):
+        return len(self._lineas)
+
+    def __contains__(self, id_producto):
+        return id_producto in self._lineas
+
+    def __eq__(self, other):
+        return isinstance(other, Carrito) and self.items() == other.items()
+
+    def __repr__(self):
+        return f"Carrito({self.items()!r})"
+
+
+def _serializar(items):
+    return json.dumps([[int(pid), int(qty)] for pid, qty in items], separators=(",", ":"))
+
+
+def _deserializar(raw):
+    try:
+        return [(int(pid), int(qty)) for pid, qty in json.loads(raw)]
+    except (ValueError, TypeError):
+        return []
+
+
+class MemoriaCarritoStore:
+    """Carritos en un diccionario del proceso (se pierden al reiniciar)."""
+
+    def __init__(self, ttl_seconds=CARRITO_TTL_DIAS * 86400):
+        self.ttl = ttl_seconds
+        self._data = {}   # id -> (actualizado_en, items)
+        self._lock = threading.Lock()
+
+    def get(self, carrito_id):
+        with self._lock:
+            item = self._data.get(carrito_id)
+            if item is None:
+                return []
+            if time.time() - item[0] > self.ttl:
+                del self._data[carrito_id]
+                return []
+            return list(item[1])
+
+    def set(self, carrito_id, items):
+        with self._lock:
+            self._data[carrito_id] = (time.time(), list(items))
+
+    def delete(self, carrito_id):
+        with self._lock:
+            self._data.pop(carrito_id, None)
+
+    def stats(self):
+        return {"backend": "memoria", "carritos": len(self._data)}
+
+
+class SQLiteCarritoStore:
+    """
+    Carritos en un archivo SQLite (modo WAL: lectores y escritor no se bloquean).
+    Una conexión por hilo; se reabre tras un fork de gunicorn.
+    """
+
+    def __init__(self, path=CARRITO_SQLITE_PATH, ttl_seconds=CARRITO_TTL_DIAS * 86400):
+        self.path = path
+        self.ttl = ttl_seconds
+        self._local = threading.local()
+        self._escrituras = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS carritos (
+                id TEXT PRIMARY KEY,
+                items TEXT NOT NULL,
+                actualizado_en REAL NOT NULL
+            );
+        """)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, carrito_id):
+        row = self._conn().execute(
+            "SELECT items, actualizado_en FROM carritos WHERE id = ?;", (carrito_id,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return []
+        return _deserializar(row[0])
+
+    def set(self, carrito_id, items):
+        conn = self._conn()
+        conn.execute("""
+            INSERT INTO carritos (id, items, actualizado_en) VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET items = excluded.items, actualizado_en = excluded.actualizado_en;
+        """, (carrito_id, _serializar(items), time.time()))
+        self._escrituras += 1
+        if self._escrituras % _PURGA_CADA == 0:
+            conn.execute("DELETE FROM carritos WHERE actualizado_en < ?;", (time.time() - self.ttl,))
+
+    def delete(self, carrito_id):
+        self._conn().execute("DELETE FROM carritos WHERE id = ?;", (carrito_id,))
+
+    def stats(self):
+        n = self._conn().execute("SELECT COUNT(*) FROM carritos;").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "carritos": n}
+
+
+def crear_store(tipo=CARRITO_STORE):
+    if tipo == "memoria":
+        return MemoriaCarritoStore()
+    if tipo == "sqlite":
+        return SQLiteCarritoStore()
+    raise ValueError(f"CARRITO_STORE desconocido: {tipo}")
+
+
+store = crear_store()
+
+
+# ---------------------------------------------------------
+# ACCESO DESDE LAS RUTAS (sesión de Flask)
+# ---------------------------------------------------------
+def cargar_carrito(session):
+    """Carrito de esta sesión (vacío si no tiene)."""
+    if "carrito" in session:
+        # Sesiones anteriores guardaban el carrito completo en la cookie: se migra una vez
+        carrito = Carrito()
+        for item in session.pop("carrito") or []:
+            try:
+                carrito.agregar(int(item["id"]), int(item.get("cantidad", 1)))
+            except (KeyError, TypeError, ValueError):
+                continue
+        guardar_carrito(session, carrito)
+        return carrito
+    carrito_id = session.get("carrito_id")
+    if not carrito_id:
+        return Carrito()
+    return Carrito(store.get(carrito_id))
+
+
+def id_carrito(session):
+    """Id del carrito de esta sesión; lo asigna la primera vez (las reservas de stock lo usan)."""
+    carrito_id = session.get("carrito_id")
+    if not carrito_id:
+        carrito_id = secrets.token_urlsafe(16)
+        session["carrito_id"] = carrito_id
+    return carrito_id
+
+
+def guardar_carrito(session, carrito):
+    """Guarda el carrito; la sesión solo cambia la primera vez (al asignar el id)."""
+    items = [(pid, qty) for pid, qty in carrito if qty > 0]
+    carrito_id = session.get("carrito_id")
+    if not items:
+        if carrito_id:
+            store.delete(carrito_id)
+        return
+    store.set(id_carrito(session), items)
+
+
+def borrar_carrito(session):
+    carrito_id = session.get("carrito_id")
+    if carrito_id:
+        store.delete(carrito_id)
+    session.pop("carrito", None)
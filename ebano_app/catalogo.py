@@ -0,0 +1,259 @@
+"""
+catalogo.py
+Copia en memoria (por worker) del catálogo de productos para /tienda.
+
+- Mientras la copia es reciente (CATALOGO_CHECK_SECONDS) se sirve sin tocar la BD.
+- Pasado ese intervalo se lee catalogo_version_seq (una consulta trivial) y solo
+  se recarga el catálogo si la versión cambió (ver migrations/001_catalogo_version.sql).
+- CATALOGO_MAX_AGE fuerza una recarga completa aunque la versión no cambie.
+- invalidar() descarta la copia local tras una escritura hecha por este worker.
+- Si el catálogo supera CATALOGO_MAX_ITEMS no se copia entero: pagina_tienda()
+  pagina entonces directamente en la BD (keyset, ver paginacion.py).
+
+El stock mostrado puede ir hasta CATALOGO_CHECK_SECONDS por detrás de la BD.
+"""
+
+import os
+import threading
+import time
+from decimal import Decimal
+
+from bd_config import get_connection
+from cache_memoria import register
+from paginacion import ListaOrdenada, OrdenKeyset, paginar, paginar_lista
+
+CATALOGO_CHECK_SECONDS = float(os.getenv("CATALOGO_CHECK_SECONDS", 5))
+CATALOGO_MAX_AGE = float(os.getenv("CATALOGO_MAX_AGE", 300))
+CATALOGO_MAX_ITEMS = int(os.getenv("CATALOGO_MAX_ITEMS", 2000))
+TIENDA_PAGE_SIZE = int(os.getenv("TIENDA_PAGE_SIZE", 12))
+
+_SELECT_PRODUCTOS = "SELECT p.id, p.nombre, p.descripcion, p.precio, p.imagen_url, p.stock FROM productos p"
+
+
+class CatalogoNoDisponible(Exception):
+    """No hay conexión con la BD y tampoco una copia previa del catálogo."""
+
+
+def _precio_int(value):
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(Decimal('1')))
+
+
+def _fila_a_producto(r):
+    try:
+        precio_cop_int = _precio_int(r[3])
+    except Exception:
+        precio_cop_int = 0
+    return {
+        "id": r[0],
+        "nombre": r[1],
+        "descripcion": r[2],
+        "precio": precio_cop_int,
+        "imagen_url": r[4],
+        "stock": r[5]
+    }
+
+
+class CatalogoCache:
+
+    def __init__(self, check_seconds=CATALOGO_CHECK_SECONDS, max_age=CATALOGO_MAX_AGE,
+                 max_items=CATALOGO_MAX_ITEMS):
+        self.check_seconds = check_seconds
+        self.max_age = max_age
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        # (productos, por_id, version, cargado_en, verificado_en, completo, ordenados)
+        self._snapshot = None
+        self._sin_version = False
+        self.hits = 0
+        self.version_checks = 0
+        self.reloads = 0
+        self.invalidations = 0
+
+    def _fresh(self, snap, now):
+        return (snap is not None
+                and now - snap[4] < self.check_seconds
+                and now - snap[3] < self.max_age)
+
+    def _leer_version(self, conn):
+        if self._sin_version:
+            return None
+        try:
+            # last_value vale 1 antes del primer nextval(): is_called distingue ese caso
+            return conn.run(
+                "SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM catalogo_version_seq;"
+            )[0][0]
+        except Exception as e:
+            # Migración 001 sin aplicar: funcionar solo con el intervalo de verificación
+            print(f"⚠️ catalogo_version_seq no disponible ({e}); el catálogo se recargará por tiempo")
+            self._sin_version = True
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            return None
+
+    def _cargar(self, conn):
+        """Devuelve (productos, completo). Con más de max_items no se guarda nada."""
+        res = conn.run(_SELECT_PRODUCTOS + " ORDER BY p.id LIMIT :lim;", lim=self.max_items + 1)
+        if len(res) > self.max_items:
+            return [], False
+        return [_fila_a_producto(r) for r in res], True
+
+    def _snapshot_actual(self):
+        now = time.monotonic()
+        snap = self._snapshot
+        if self._fresh(snap, now):
+            self.hits += 1
+            return snap
+
+        with self._lock:
+            # Otro hilo pudo haberla refrescado mientras esperábamos
+            snap = self._snapshot
+            now = time.monotonic()
+            if self._fresh(snap, now):
+                self.hits += 1
+                return snap
+
+            conn = get_connection()
+            if not conn:
+                if snap is not None:
+                    return snap  # mejor un catálogo algo viejo que ninguno
+                raise CatalogoNoDisponible("Sin conexión con la base de datos")
+            try:
+                self.version_checks += 1
+                version = self._leer_version(conn)
+                if (snap is not None and version is not None and version == snap[2]
+                        and now - snap[3] < self.max_age):
+                    snap = (snap[0], snap[1], snap[2], snap[3], now, snap[5], snap[6])
+                else:
+                    productos, completo = self._cargar(conn)
+                    self.reloads += 1
+                    snap = (productos, {p["id"]: p for p in productos}, version, now, now, completo, {})
+                self._snapshot = snap
+                return snap
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    def productos(self):
+        """
+        Lista de productos (copias: el llamador puede modificarlas), o None si
+        el catálogo es demasiado grande para tenerlo en memoria.
+        """
+        snap = self._snapshot_actual()
+        if not snap[5]:
+            return None
+        return [dict(p) for p in snap[0]]
+
+    def ordenados(self, orden):
+        """
+        ListaOrdenada de la copia actual según `orden` (sin copiar los dicts:
+        no modificarlos), o None si el catálogo no cabe en memoria. Se ordena
+        una vez por copia del catálogo y criterio.
+        """
+        snap = self._snapshot_actual()
+        if not snap[5]:
+            return None
+        lista = snap[6].get(orden)
+        if lista is None:
+            lista = ListaOrdenada(snap[0], orden)
+            snap[6][orden] = lista
+        return lista
+
+    def producto(self, producto_id):
+        """Un producto por id (copia) o None."""
+        p = self._snapshot_actual()[1].get(producto_id)
+        return dict(p) if p is not None else None
+
+    def version(self):
+        """Versión actual del catálogo (catalogo_version_seq) o None si no hay migración 001."""
+        return self._snapshot_actual()[2]
+
+    def invalidar(self):
+        self._snapshot = None
+        self.invalidations += 1
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "items": len(snap[0]) if snap else 0,
+            "max_items": self.max_items,
+            "en_memoria": bool(snap[5]) if snap else None,
+            "version": snap[2] if snap else None,
+            "age_seconds": round(time.monotonic() - snap[3], 1) if snap else None,
+            "check_seconds": self.check_seconds,
+            "max_age_seconds": self.max_age,
+            "hits": self.hits,
+            "version_checks": self.version_checks,
+            "reloads": self.reloads,
+            "invalidations": self.invalidations,
+        }
+
+
+catalogo = CatalogoCache()
+register("catalogo", catalogo)
+
+
+def invalidar_catalogo():
+    catalogo.invalidar()
+
+
+# ---------------------------------------------------------
+# LISTADO PAGINADO DE LA TIENDA
+# ---------------------------------------------------------
+# El nombre se ordena con COLLATE "C" para que el orden (y los cursores) sean
+# idénticos en la BD y en la copia en memoria, independientemente del locale.
+ORDENES_TIENDA = {
+    "nombre": OrdenKeyset([('p.nombre COLLATE "C"', "nombre", "TEXT"), ("p.id", "id", "INT")]),
+    "precio_asc": OrdenKeyset([("p.precio", "precio", "NUMERIC"), ("p.id", "id", "INT")]),
+    "precio_desc": OrdenKeyset([("p.precio", "precio", "NUMERIC"), ("p.id", "id", "INT")], descendente=True),
+    # Los id son SERIAL: id DESC equivale a "más recientes" y usa la clave primaria
+    "nuevos": OrdenKeyset([("p.id", "id", "INT")], descendente=True),
+}
+ORDEN_TIENDA_DEFECTO = "nombre"
+
+
+def pagina_tienda(orden=ORDEN_TIENDA_DEFECTO, solo_stock=False, precio_min=None, precio_max=None,
+                  cursor=None, limite=TIENDA_PAGE_SIZE):
+    """
+    Una página del catálogo con filtros. Usa la copia en memoria si existe;
+    si el catálogo es demasiado grande, pagina en la BD con los mismos cursores.
+    """
+    criterio = ORDENES_TIENDA.get(orden, ORDENES_TIENDA[ORDEN_TIENDA_DEFECTO])
+
+    lista = catalogo.ordenados(criterio)
+    if lista is not None:
+        def cumple(p):
+            if solo_stock and p["stock"] is not None and p["stock"] <= 0:
+                return False
+            if precio_min is not None and p["precio"] < precio_min:
+                return False
+            if precio_max is not None and p["precio"] > precio_max:
+                return False
+            return True
+        return paginar_lista(lista, cumple, limite, cursor, copiar=dict)
+
+    filtros, params = [], {}
+    if solo_stock:
+        filtros.append("p.stock IS NULL OR p.stock > 0")
+    if precio_min is not None:
+        filtros.append("p.precio >= :precio_min")
+        params["precio_min"] = precio_min
+    if precio_max is not None:
+        filtros.append("p.precio <= :precio_max")
+        params["precio_max"] = precio_max
+
+    conn = get_connection()
+    if not conn:
+        raise CatalogoNoDisponible("Sin conexión con la base de datos")
+    try:
+        return paginar(conn, _SELECT_PRODUCTOS, filtros, params, criterio, limite, cursor,
+                       fila_a_dict=_fila_a_producto)
+    finally:
+        conn.close()
@@ -0,0 +1,39 @@
+"""
+comprobaciones.py
+Utilidades comunes de los scripts de prueba test_*.py.
+
+Los scripts se ejecutan a mano (`python test_checkout.py`), no con pytest:
+necesitan una BD local y datos propios. Por eso sus casos se llaman
+probar_* (pytest no los recoge) y cada comprobación fallida se cuenta aquí
+en lugar de cortar el script: al final terminar() resume y sale con
+código 1 si algo falló.
+
+Los que usan la BD crean sus propios datos "bench_*"
+(benchmarks.crear_usuario_bench / crear_productos_bench), los borran al
+terminar y se niegan a ejecutarse contra una BD remota salvo con
+--permitir-remoto (NUNCA contra producción).
+"""
+
+import sys
+
+from benchmarks import print_section
+
+fallos = 0
+
+
+def comprobar(nombre, condicion, detalle=""):
+    global fallos
+    if condicion:
+        print(f"✅ {nombre}")
+    else:
+        fallos += 1
+        print(f"❌ {nombre} {detalle}")
+
+
+def terminar(exito, pista=""):
+    """Imprime el resultado; sale con código 1 si alguna comprobación falló."""
+    print_section("RESULTADO")
+    if fallos:
+        print(f"❌ {fallos} comprobación(es) fallida(s).{' ' + pista if pista else ''}")
+        sys.exit(1)
+    print(f"✅ {exito}")
@@ -0,0 +1,210 @@
+"""
+contrasenas.py
+Hash y verificación de contraseñas (bcrypt) fuera del hilo de la petición.
+
+- bcrypt corre en un pool acotado de BCRYPT_HILOS hilos por worker. bcrypt
+  suelta el GIL mientras calcula, así que con workers gthread los demás
+  hilos siguen atendiendo /tienda durante una ráfaga de logins.
+- Como mucho BCRYPT_COLA_MAX operaciones esperando o en curso por worker.
+  Si la cola está llena, o la espera supera BCRYPT_ESPERA_MAX segundos, se
+  lanza ContrasenasOcupado en vez de acumular peticiones colgadas.
+- Coste (log2 de rondas): BCRYPT_COSTE si está definido; si no se calibra al
+  arrancar para que un hash tarde ~BCRYPT_OBJETIVO_MS, nunca por debajo de
+  BCRYPT_COSTE_MIN (12, el coste por defecto de bcrypt con el que están los
+  hashes existentes). La calibración se guarda en un archivo compartido por
+  los workers de la máquina (un día).
+- verificar_y_rehash(): si la contraseña es correcta y el hash guardado
+  tiene un coste menor que el configurado devuelve el hash nuevo para
+  guardarlo. Nunca baja el coste de un hash, así dos máquinas calibradas
+  distinto no se rehashean los usuarios una a otra.
+
+Uso:
+    hash_nuevo = hashear(contrasena)
+    ok, rehash = verificar_y_rehash(contrasena, hash_guardado)
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+import bcrypt
+
+BCRYPT_HILOS = int(os.getenv("BCRYPT_HILOS", 2))
+BCRYPT_COLA_MAX = int(os.getenv("BCRYPT_COLA_MAX", 16))
+BCRYPT_ESPERA_MAX = float(os.getenv("BCRYPT_ESPERA_MAX", 5))
+BCRYPT_OBJETIVO_MS = float(os.getenv("BCRYPT_OBJETIVO_MS", 250))
+BCRYPT_COSTE_MIN = int(os.getenv("BCRYPT_COSTE_MIN", 12))
+BCRYPT_COSTE_MAX = int(os.getenv("BCRYPT_COSTE_MAX", 14))
+BCRYPT_CALIBRACION_FILE = os.getenv(
+    "BCRYPT_CALIBRACION_FILE",
+    os.path.join(tempfile.gettempdir(), "ebano_bcrypt_coste.json")
+)
+_CALIBRACION_TTL = 86400
+
+
+class ContrasenasOcupado(Exception):
+    """Demasiadas operaciones de contraseña en cola en este worker."""
+
+
+def coste_de(hash_guardado):
+    """Coste de un hash bcrypt ($2b$12$...) o None si no se reconoce."""
+    if isinstance(hash_guardado, bytes):
+        hash_guardado = hash_guardado.decode("utf-8", "replace")
+    partes = (hash_guardado or "").split("$")
+    try:
+        return int(partes[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------
+# CALIBRACIÓN DEL COSTE
+# ---------------------------------------------------------
+def _medir_ms(coste):
+    inicio = time.perf_counter()
+    bcrypt.hashpw(b"calibracion-ebano", bcrypt.gensalt(rounds=coste))
+    return (time.perf_counter() - inicio) * 1000
+
+
+def calibrar(objetivo_ms=BCRYPT_OBJETIVO_MS):
+    """Mayor coste cuyo hash tarda como mucho ~objetivo_ms en esta máquina."""
+    base = BCRYPT_COSTE_MIN
+    ms = min(_medir_ms(base) for _ in range(2))
+    coste = base
+    # Cada +1 de coste duplica el tiempo
+    while coste < BCRYPT_COSTE_MAX and ms * 2 <= objetivo_ms:
+        coste += 1
+        ms *= 2
+    return coste
+
+
+def _coste_compartido():
+    try:
+        with open(BCRYPT_CALIBRACION_FILE, "r", encoding="utf-8") as f:
+            datos = json.load(f)
+        if time.time() - datos["calibrado_en"] < _CALIBRACION_TTL \
+                and datos["objetivo_ms"] == BCRYPT_OBJETIVO_MS:
+            return int(datos["coste"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    coste = calibrar()
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(BCRYPT_CALIBRACION_FILE) or ".", prefix=".bcrypt_")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"coste": coste, "objetivo_ms": BCRYPT_OBJETIVO_MS, "calibrado_en": time.time()}, f)
+        os.replace(tmp, BCRYPT_CALIBRACION_FILE)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar la calibración de bcrypt: {e}")
+    return coste
+
+
+def _coste_configurado():
+    if os.getenv("BCRYPT_COSTE"):
+        return int(os.getenv("BCRYPT_COSTE"))
+    # max(): una calibración guardada con un mínimo anterior más bajo
+    coste = max(BCRYPT_COSTE_MIN, _coste_compartido())
+    print(f"🔐 Coste bcrypt {coste} (objetivo {BCRYPT_OBJETIVO_MS:.0f} ms por hash)")
+    return coste
+
+
+# ---------------------------------------------------------
+# POOL ACOTADO
+# ---------------------------------------------------------
+class PoolContrasenas:
+    """Ejecuta bcrypt en hilos propios del worker, con cola acotada."""
+
+    def __init__(self, hilos=BCRYPT_HILOS, cola_max=BCRYPT_COLA_MAX, espera_max=BCRYPT_ESPERA_MAX):
+        self.hilos = max(1, hilos)
+        self.cola_max = max(self.hilos, cola_max)
+        self.espera_max = espera_max
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pendientes = 0
+        self.rechazadas = 0
+        self.completadas = 0
+
+    def _pool(self):
+        # Tras un fork de gunicorn el executor del padre no tiene hilos
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="bcrypt")
+            self._pid = os.getpid()
+            self._pendientes = 0
+        return self._executor
+
+    def ejecutar(self, fn, *args):
+        with self._lock:
+            pool = self._pool()
+            if self._pendientes >= self.cola_max:
+                self.rechazadas += 1
+                raise ContrasenasOcupado(f"{self._pendientes} operaciones de contraseña en cola")
+            self._pendientes += 1
+            futuro = pool.submit(fn, *args)
+        futuro.add_done_callback(self._terminada)
+        try:
+            return futuro.result(timeout=self.espera_max)
+        except FuturesTimeout:
+            futuro.cancel()
+            with self._lock:
+                self.rechazadas += 1
+            raise ContrasenasOcupado(f"Más de {self.espera_max}s esperando a bcrypt")
+
+    def _terminada(self, _futuro):
+        with self._lock:
+            self._pendientes -= 1
+            self.completadas += 1
+
+    def stats(self):
+        return {
+            "hilos": self.hilos,
+            "cola_max": self.cola_max,
+            "pendientes": self._pendientes,
+            "completadas": self.completadas,
+            "rechazadas": self.rechazadas,
+            "coste": BCRYPT_COSTE,
+        }
+
+
+BCRYPT_COSTE = _coste_configurado()
+_pool = PoolContrasenas()
+
+
+def hashear(contrasena, coste=None):
+    """Hash bcrypt (str) de `contrasena` con el coste configurado."""
+    salt = bcrypt.gensalt(rounds=coste or BCRYPT_COSTE)
+    return _pool.ejecutar(bcrypt.hashpw, contrasena.encode("utf-8"), salt).decode("utf-8")
+
+
+def verificar(contrasena, hash_guardado):
+    if isinstance(hash_guardado, str):
+        hash_guardado = hash_guardado.encode("utf-8")
+    try:
+        return _pool.ejecutar(bcrypt.checkpw, contrasena.encode("utf-8"), hash_guardado)
+    except ValueError:
+        # Hash guardado que no es bcrypt
+        return False
+
+
+def verificar_y_rehash(contrasena, hash_guardado):
+    """
+    (correcta, hash_nuevo). hash_nuevo es None salvo que la contraseña sea
+    correcta y el hash guardado tenga un coste menor que el configurado.
+    """
+    if not verificar(contrasena, hash_guardado):
+        return False, None
+    coste = coste_de(hash_guardado)
+    if coste is not None and coste >= BCRYPT_COSTE:
+        return True, None
+    try:
+        return True, hashear(contrasena)
+    except ContrasenasOcupado:
+        # El login ya es válido; se rehashea en el próximo
+        return True, None
+
+
+def contrasenas_stats():
+    return _pool.stats()
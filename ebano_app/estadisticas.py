@@ -0,0 +1,62 @@
+"""
+estadisticas.py
+Contadores del panel de administración (usuarios, productos, pedidos, reseñas).
+
+- Se cuentan las tablas en una sola consulta y el resultado se cachea
+  ADMIN_STATS_TTL segundos por worker: como mucho una consulta por worker
+  y periodo, sin añadir trabajo a los checkouts, registros ni reseñas.
+- No se mantienen contadores con triggers: una fila compartida actualizada
+  en cada alta quedaría bloqueada hasta el commit y serializaría las
+  transacciones concurrentes.
+"""
+
+import os
+
+from bd_config import get_connection
+from cache_memoria import CacheTTL
+
+ADMIN_STATS_TTL = int(os.getenv("ADMIN_STATS_TTL", 30))
+
+_CLAVES = ("clientes", "productos", "pedidos", "resenas")
+
+_stats_cache = CacheTTL("dashboard_admin", max_items=1, ttl=ADMIN_STATS_TTL)
+
+
+def _contar_tablas(conn):
+    fila = conn.run("""
+        SELECT (SELECT COUNT(*) FROM usuarios WHERE rol = 'cliente'),
+               (SELECT COUNT(*) FROM productos),
+               (SELECT COUNT(*) FROM pedidos),
+               (SELECT COUNT(*) FROM resenas);
+    """)[0]
+    return dict(zip(_CLAVES, fila))
+
+
+def estadisticas_dashboard():
+    """Dict con los contadores del dashboard (una consulta como máximo), o None sin BD."""
+    stats = _stats_cache.get("dashboard")
+    if stats is not None:
+        return stats
+
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        valores = _contar_tablas(conn)
+    except Exception as e:
+        print(f"❌ Error al contar las tablas del dashboard: {e}")
+        return None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    stats = {
+        "total_usuarios": valores["clientes"],
+        "total_productos": valores["productos"],
+        "total_pedidos": valores["pedidos"],
+        "reseñas_pendientes": valores["resenas"],
+    }
+    _stats_cache.set("dashboard", stats)
+    return stats
@@ -2,6 +2,9 @@
 -- PROYECTO ÉBANO - FASE 1
 -- Estructura base de datos PostgreSQL
 -- Autor: Diego A. Villota
+--
+-- Crea la BD desde cero. Después ejecutar las migraciones:
+--     python migraciones.py
 -- ---------------------------------------------------------
 
 -- Si existe una versión anterior, se eliminan las tablas en orden correcto
@@ -10,6 +13,14 @@ DROP TABLE IF EXISTS resenas CASCADE;
 DROP TABLE IF EXISTS pedidos CASCADE;
 DROP TABLE IF EXISTS productos CASCADE;
 DROP TABLE IF EXISTS usuarios CASCADE;
+-- Registro de migraciones y objetos creados por ellas (se recrean al migrar)
+DROP TABLE IF EXISTS reservas_stock CASCADE;
+DROP TABLE IF EXISTS ventas_dia_producto CASCADE;
+DROP TABLE IF EXISTS ventas_dia_estado_us CASCADE;
+DROP TABLE IF EXISTS ventas_dia_estado_pedido CASCADE;
+DROP TABLE IF EXISTS analitica_cambios CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
+DROP SEQUENCE IF EXISTS catalogo_version_seq;
 
 -- ---------------------------------------------------------
 -- TABLA: usuarios
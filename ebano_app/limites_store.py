@@ -0,0 +1,184 @@
+"""
+limites_store.py
+Contadores de Flask-Limiter compartidos por todos los workers de la máquina.
+
+Con storage_uri="memory://" cada worker de gunicorn lleva sus propios
+contadores: el "5 per minute" del login se multiplica por el número de
+workers y todo se pierde al reiniciar. Este módulo registra en `limits` el
+esquema "sqlite://<ruta>": un archivo SQLite en modo WAL, como el de
+carrito_store.py.
+
+- Ventana deslizante aproximada con dos contadores por clave: el de la
+  ventana actual y el de la anterior. El conteo es
+      anterior * (parte de la ventana anterior que aún cae en el último
+                  periodo) + actual
+  Una fila pequeña por clave, en vez de un registro por petición.
+- Cada incremento es un único UPSERT ... RETURNING (atómico entre procesos).
+- Cada LIMITES_PURGA_CADA escrituras se borran, en lotes de
+  LIMITES_PURGA_LOTE, las claves sin actividad en las dos últimas ventanas.
+
+Se usa con la estrategia por defecto de Flask-Limiter ("fixed-window"): la
+estrategia solo compara lo que devuelven incr()/get() con el límite, y aquí
+ya es el conteo deslizante. elastic_expiry no se admite (se ignora).
+
+Uso:
+    import limites_store   # registra el esquema
+    Limiter(..., storage_uri=limites_store.LIMITES_STORAGE_URI)
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from limits.storage import Storage
+
+LIMITES_SQLITE_PATH = os.getenv(
+    "LIMITES_SQLITE_PATH",
+    os.path.join(tempfile.gettempdir(), "ebano_limites.sqlite3")
+)
+LIMITES_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", f"sqlite://{LIMITES_SQLITE_PATH}")
+LIMITES_PURGA_CADA = int(os.getenv("LIMITES_PURGA_CADA", 1000))
+LIMITES_PURGA_LOTE = int(os.getenv("LIMITES_PURGA_LOTE", 2000))
+
+
+def _ventana(ahora, expiry):
+    """Inicio (alineado) de la ventana de `expiry` segundos que contiene `ahora`."""
+    return int(ahora // expiry) * expiry
+
+
+def conteo_deslizante(actual, anterior, inicio, expiry, ahora):
+    """
+    Peticiones en los últimos `expiry` segundos, estimadas a partir de los
+    contadores de una fila cuya ventana empieza en `inicio`.
+    """
+    ventana = _ventana(ahora, expiry)
+    if inicio == ventana - expiry:
+        # Nadie ha escrito en la ventana actual todavía
+        actual, anterior = 0, actual
+    elif inicio != ventana:
+        return 0
+    peso = 1 - (ahora - ventana) / expiry
+    return actual + int(anterior * peso)
+
+
+class SQLiteLimitesStorage(Storage):
+    """
+    Storage de `limits` sobre un archivo SQLite local (modo WAL).
+    Una conexión por hilo; se reabre tras un fork de gunicorn.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, **options):
+        super().__init__(uri, **options)
+        self.path = (uri.split("://", 1)[-1] if uri else "") or LIMITES_SQLITE_PATH
+        self._local = threading.local()
+        self._escrituras = 0
+        self.purgadas = 0
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS limites (
+                clave TEXT PRIMARY KEY,
+                expiry INTEGER NOT NULL,
+                inicio INTEGER NOT NULL,
+                actual INTEGER NOT NULL,
+                anterior INTEGER NOT NULL,
+                caduca INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_limites_caduca ON limites (caduca);")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        expiry = max(1, int(expiry))
+        ahora = time.time()
+        inicio = _ventana(ahora, expiry)
+        conn = self._conn()
+        # En el UPDATE, limites.* son los valores previos de la fila
+        actual, anterior = conn.execute("""
+            INSERT INTO limites (clave, expiry, inicio, actual, anterior, caduca)
+            VALUES (:clave, :expiry, :inicio, :n, 0, :caduca)
+            ON CONFLICT(clave) DO UPDATE SET
+                anterior = CASE
+                    WHEN limites.inicio = excluded.inicio THEN limites.anterior
+                    WHEN limites.inicio = excluded.inicio - excluded.expiry THEN limites.actual
+                    ELSE 0 END,
+                actual = CASE
+                    WHEN limites.inicio = excluded.inicio THEN limites.actual + excluded.actual
+                    ELSE excluded.actual END,
+                expiry = excluded.expiry,
+                inicio = excluded.inicio,
+                caduca = excluded.caduca
+            RETURNING actual, anterior;
+        """, {"clave": key, "expiry": expiry, "inicio": inicio, "n": amount,
+              "caduca": inicio + 2 * expiry}).fetchone()
+
+        self._escrituras += 1
+        if self._escrituras % LIMITES_PURGA_CADA == 0:
+            self.purgar()
+        return conteo_deslizante(actual, anterior, inicio, expiry, ahora)
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT actual, anterior, inicio, expiry FROM limites WHERE clave = ?;", (key,)
+        ).fetchone()
+        if row is None:
+            return 0
+        actual, anterior, inicio, expiry = row
+        return conteo_deslizante(actual, anterior, inicio, expiry, time.time())
+
+    def get_expiry(self, key):
+        row = self._conn().execute(
+            "SELECT inicio, expiry FROM limites WHERE clave = ?;", (key,)
+        ).fetchone()
+        if row is None:
+            return time.time()
+        return row[0] + row[1]
+
+    def purgar(self, lote=LIMITES_PURGA_LOTE):
+        """Borra las claves caducadas en lotes cortos (no bloquea a los demás workers)."""
+        conn = self._conn()
+        total = 0
+        while True:
+            borradas = conn.execute("""
+                DELETE FROM limites WHERE clave IN (
+                    SELECT clave FROM limites WHERE caduca < ? LIMIT ?
+                );
+            """, (time.time(), lote)).rowcount
+            total += borradas
+            if borradas < lote:
+                break
+        self.purgadas += total
+        return total
+
+    def check(self):
+        try:
+            self._conn().execute("SELECT 1;").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._conn().execute("DELETE FROM limites;").rowcount
+
+    def clear(self, key):
+        self._conn().execute("DELETE FROM limites WHERE clave = ?;", (key,))
+
+    def stats(self):
+        n = self._conn().execute("SELECT COUNT(*) FROM limites;").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "claves": n, "purgadas": self.purgadas}
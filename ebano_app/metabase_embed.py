@@ -0,0 +1,137 @@
+"""
+metabase_embed.py
+URLs firmadas para embeber dashboards de Metabase (embedding estático, JWT HS256).
+
+- TABLEROS: registro de dashboards por nombre, con sus filtros fijos y los
+  que se toman del usuario (para dashboards por cliente).
+- Cada token vale METABASE_TOKEN_TTL segundos y se guarda en caché por
+  (tablero, filtros) hasta METABASE_TOKEN_MARGEN segundos antes de vencer:
+  las visitas siguientes no firman nada. La caché es por worker.
+- La firma no se verifica en cada visita (misma clave, mismo proceso); la
+  comprobación de configuración está en test_metabase.py.
+
+Configuración (.env):
+    METABASE_PROD_URL, METABASE_PROD_SECRET_KEY
+    DASHBOARD_ID            id del tablero "principal"
+    METABASE_TABLEROS       tableros extra: "ventas=3,clientes=4"; las
+                            entradas mal formadas se avisan y se ignoran
+
+Uso:
+    url = url_tablero("principal")
+    registrar_tablero("mis_compras", 7, "Mis compras", params_usuario={"cliente": "id"})
+    url = url_tablero("mis_compras", usuario=current_user)
+"""
+
+import os
+import time
+
+import jwt
+from dotenv import load_dotenv
+
+from cache_memoria import CacheTTL
+
+load_dotenv()
+
+METABASE_SITE_URL = os.getenv("METABASE_PROD_URL", "").strip().rstrip("/")
+METABASE_SECRET_KEY = os.getenv("METABASE_PROD_SECRET_KEY", "").strip()
+METABASE_TOKEN_TTL = int(os.getenv("METABASE_TOKEN_TTL", 7200))       # 2 horas
+METABASE_TOKEN_MARGEN = int(os.getenv("METABASE_TOKEN_MARGEN", 600))  # renovar 10 min antes
+METABASE_TOKENS_MAX = int(os.getenv("METABASE_TOKENS_MAX", 1024))
+# Apariencia del iframe (fragmento de la URL, no forma parte del token)
+METABASE_EMBED_OPCIONES = "#bordered=true&titled=true&theme=night"
+
+
+class MetabaseNoConfigurado(Exception):
+    """Falta la URL o la clave de Metabase, o el usuario que pide el tablero."""
+
+
+class TableroDesconocido(Exception):
+    """No hay ningún tablero registrado con ese nombre."""
+
+
+class Tablero:
+    """
+    Un dashboard embebible.
+
+    - params:         filtros bloqueados con valor fijo
+    - params_usuario: filtro bloqueado -> atributo del usuario (p. ej.
+                      {"cliente": "id"}); Metabase solo muestra sus datos
+    """
+
+    def __init__(self, nombre, dashboard_id, titulo, params=None, params_usuario=None):
+        self.nombre = nombre
+        self.dashboard_id = int(dashboard_id)
+        self.titulo = titulo
+        self.params = dict(params or {})
+        self.params_usuario = dict(params_usuario or {})
+
+
+TABLEROS = {}
+
+
+def registrar_tablero(nombre, dashboard_id, titulo, params=None, params_usuario=None):
+    TABLEROS[nombre] = Tablero(nombre, dashboard_id, titulo, params, params_usuario)
+    return TABLEROS[nombre]
+
+
+def _registrar_desde_env(nombre, dashboard_id, titulo):
+    """Registra un tablero leído del entorno; si está mal formado avisa y lo ignora."""
+    try:
+        if not nombre:
+            raise ValueError("falta el nombre")
+        registrar_tablero(nombre, dashboard_id, titulo)
+    except ValueError:
+        print(f"⚠️ Metabase: tablero mal configurado ignorado: {nombre!r}={dashboard_id!r}")
+
+
+_registrar_desde_env("principal", os.getenv("DASHBOARD_ID", "2").strip(), "Dashboard Ejecutivo")
+for _par in filter(None, os.getenv("METABASE_TABLEROS", "").split(",")):
+    _nombre, _, _id = (x.strip() for x in _par.partition("="))
+    _registrar_desde_env(_nombre, _id, _nombre.replace("_", " ").capitalize())
+
+_tokens_cache = CacheTTL("metabase_tokens", max_items=METABASE_TOKENS_MAX,
+                         ttl=max(1, METABASE_TOKEN_TTL - METABASE_TOKEN_MARGEN))
+
+
+def _firmar(tablero, params):
+    ahora = int(time.time())
+    # iat/nbf 10 s en el pasado: tolera desfase de reloj con Metabase
+    payload = {
+        "resource": {"dashboard": tablero.dashboard_id},
+        "params": params,
+        "exp": ahora + METABASE_TOKEN_TTL,
+        "iat": ahora - 10,
+        "nbf": ahora - 10,
+    }
+    token = jwt.encode(payload, METABASE_SECRET_KEY, algorithm="HS256")
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
+    return token
+
+
+def url_tablero(nombre="principal", usuario=None, **filtros):
+    """
+    URL del iframe para el tablero `nombre`. `filtros` se suman a los fijos
+    del tablero; los de params_usuario salen de `usuario` (obligatorio si el
+    tablero los tiene). Lanza TableroDesconocido si `nombre` no está
+    registrado y MetabaseNoConfigurado si no se puede firmar.
+    """
+    if not METABASE_SITE_URL or not METABASE_SECRET_KEY:
+        raise MetabaseNoConfigurado("Faltan METABASE_PROD_URL o METABASE_PROD_SECRET_KEY")
+    tablero = TABLEROS.get(nombre)
+    if tablero is None:
+        raise TableroDesconocido(nombre)
+
+    params = {**tablero.params, **filtros}
+    if tablero.params_usuario:
+        if usuario is None:
+            raise MetabaseNoConfigurado(f"El tablero {nombre} necesita un usuario")
+        for param, atributo in tablero.params_usuario.items():
+            params[param] = getattr(usuario, atributo)
+
+    clave = (nombre, tuple(sorted((k, str(v)) for k, v in params.items())))
+    url = _tokens_cache.get(clave)
+    if url is None:
+        url = f"{METABASE_SITE_URL}/embed/dashboard/{_firmar(tablero, params)}{METABASE_EMBED_OPCIONES}"
+        _tokens_cache.set(clave, url)
+    return url
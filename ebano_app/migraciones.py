@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+migraciones.py
+Aplica las migraciones numeradas de migrations/ y registra cuáles se aplicaron.
+
+- Archivos: migrations/NNN_descripcion.sql, aplicados en orden numérico.
+- La tabla schema_migrations guarda versión, nombre, checksum y fecha.
+- Cada migración se ejecuta en UNA transacción junto con su registro en
+  schema_migrations: o se aplica entera o no se aplica.
+- Las migraciones que empiezan con la línea
+
+      -- migracion: sin-transaccion
+
+  se ejecutan sentencia a sentencia en autocommit. Es lo que exige
+  CREATE INDEX CONCURRENTLY (que no bloquea escrituras en producción).
+  Deben ser idempotentes (IF NOT EXISTS): si fallan a mitad se vuelven
+  a ejecutar enteras. Un índice CONCURRENTLY fallido queda INVALID; el
+  runner lo detecta y avisa.
+- Un advisory lock evita que dos despliegues migren a la vez.
+
+Uso:
+    python migraciones.py                 # = aplicar
+    python migraciones.py aplicar         # aplica las pendientes
+    python migraciones.py aplicar --hasta 3
+    python migraciones.py estado          # aplicadas / pendientes / modificadas
+    python migraciones.py marcar 1 2 3    # registra sin ejecutar (BD migrada a mano)
+
+Base de datos nueva: ejecutar init_db.sql y después `python migraciones.py`.
+En el despliegue lo ejecuta la fase `release` del Procfile.
+"""
+
+import hashlib
+import os
+import re
+import sys
+
+from bd_config import get_direct_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Clave arbitraria para pg_advisory_lock (una por aplicación)
+_LOCK_KEY = 471100012
+
+_PATRON_ARCHIVO = re.compile(r"^(\d+)_([\w\-]+)\.sql$")
+_MARCA_SIN_TRANSACCION = "-- migracion: sin-transaccion"
+
+
+class ErrorMigracion(Exception):
+    pass
+
+
+class Migracion:
+    def __init__(self, version, nombre, path):
+        self.version = version
+        self.nombre = nombre
+        self.path = path
+        with open(path, "r", encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        primera = self.sql.lstrip().splitlines()[0].strip().lower() if self.sql.strip() else ""
+        self.transaccional = primera != _MARCA_SIN_TRANSACCION
+
+    def __repr__(self):
+        return f"{self.version:03d}_{self.nombre}"
+
+
+# ---------------------------------------------------------
+# LECTURA DE ARCHIVOS
+# ---------------------------------------------------------
+def descubrir(directorio=MIGRATIONS_DIR):
+    """Migraciones del directorio ordenadas por versión."""
+    migraciones = {}
+    for archivo in sorted(os.listdir(directorio)):
+        m = _PATRON_ARCHIVO.match(archivo)
+        if not m:
+            continue
+        version = int(m.group(1))
+        if version in migraciones:
+            raise ErrorMigracion(f"Versión duplicada {version}: {migraciones[version].path} y {archivo}")
+        migraciones[version] = Migracion(version, m.group(2), os.path.join(directorio, archivo))
+    return [migraciones[v] for v in sorted(migraciones)]
+
+
+def dividir_sentencias(sql):
+    """
+    Separa un script en sentencias por ';', respetando comentarios,
+    cadenas '...', identificadores "..." y bloques $$...$$ / $tag$...$tag$.
+    """
+    sentencias, actual = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if sql.startswith("--", i):
+            fin = sql.find("\n", i)
+            fin = n if fin == -1 else fin
+            i = fin  # el comentario no forma parte de la sentencia
+            continue
+        if sql.startswith("/*", i):
+            fin = sql.find("*/", i + 2)
+            i = n if fin == -1 else fin + 2
+            continue
+        if c in ("'", '"'):
+            fin = i + 1
+            while fin < n:
+                if sql[fin] == c:
+                    if fin + 1 < n and sql[fin + 1] == c:  # comilla escapada ('')
+                        fin += 2
+                        continue
+                    break
+                fin += 1
+            actual.append(sql[i:fin + 1])
+            i = fin + 1
+            continue
+        if c == "$":
+            m = re.match(r"\$[A-Za-z_]*\$", sql[i:])
+            if m:
+                etiqueta = m.group(0)
+                fin = sql.find(etiqueta, i + len(etiqueta))
+                fin = n if fin == -1 else fin + len(etiqueta)
+                actual.append(sql[i:fin])
+                i = fin
+                continue
+        if c == ";":
+            sentencia = "".join(actual).strip()
+            if sentencia:
+                sentencias.append(sentencia)
+            actual = []
+            i += 1
+            continue
+        actual.append(c)
+        i += 1
+    sentencia = "".join(actual).strip()
+    if sentencia:
+        sentencias.append(sentencia)
+    return sentencias
+
+
+# ---------------------------------------------------------
+# BASE DE DATOS
+# ---------------------------------------------------------
+def _conectar():
+    conn = get_direct_connection()
+    # Transacciones explícitas: BEGIN/COMMIT los decide el runner
+    conn.autocommit = True
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            nombre VARCHAR(200) NOT NULL,
+            checksum VARCHAR(64) NOT NULL,
+            aplicada_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    return conn
+
+
+def aplicadas(conn):
+    """{version: (nombre, checksum)} de schema_migrations."""
+    return {r[0]: (r[1], r[2]) for r in conn.run("SELECT version, nombre, checksum FROM schema_migrations;")}
+
+
+def _registrar(conn, migracion):
+    conn.run("""
+        INSERT INTO schema_migrations (version, nombre, checksum)
+        VALUES (:v, :n, :c)
+        ON CONFLICT (version) DO UPDATE
+        SET nombre = EXCLUDED.nombre, checksum = EXCLUDED.checksum, aplicada_en = CURRENT_TIMESTAMP;
+    """, v=migracion.version, n=migracion.nombre, c=migracion.checksum)
+
+
+def _indices_invalidos(conn):
+    return [r[0] for r in conn.run("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace ns ON ns.oid = c.relnamespace
+        WHERE NOT i.indisvalid AND ns.nspname = current_schema();
+    """)]
+
+
+def aplicar_una(conn, migracion):
+    if migracion.transaccional:
+        conn.execute_simple("BEGIN;")
+        try:
+            # Protocolo simple: el archivo entero (varias sentencias, bloques DO $$) de una vez
+            conn.execute_simple(migracion.sql)
+            _registrar(conn, migracion)
+            conn.execute_simple("COMMIT;")
+        except Exception:
+            try:
+                conn.execute_simple("ROLLBACK;")
+            except Exception:
+                pass
+            raise
+        return
+
+    # Sin transacción: cada sentencia por separado, en autocommit
+    for sentencia in dividir_sentencias(migracion.sql):
+        conn.execute_simple(sentencia)
+    invalidos = _indices_invalidos(conn)
+    if invalidos:
+        raise ErrorMigracion(
+            f"Índices INVALID tras {migracion}: {', '.join(invalidos)}. "
+            "Bórralos con DROP INDEX CONCURRENTLY y vuelve a ejecutar la migración."
+        )
+    _registrar(conn, migracion)
+
+
+def aplicar(hasta=None, directorio=MIGRATIONS_DIR):
+    """Aplica las migraciones pendientes (hasta la versión `hasta`). Devuelve las aplicadas."""
+    migraciones = descubrir(directorio)
+    conn = _conectar()
+    hechas = []
+    try:
+        conn.run("SELECT pg_advisory_lock(:k);", k=_LOCK_KEY)
+        try:
+            ya = aplicadas(conn)
+            for m in migraciones:
+                if hasta is not None and m.version > hasta:
+                    break
+                if m.version in ya:
+                    if ya[m.version][1] != m.checksum:
+                        print(f"⚠️ {m} cambió después de aplicarse (no se vuelve a ejecutar)")
+                    continue
+                modo = "transacción" if m.transaccional else "sin transacción"
+                print(f"🔄 Aplicando {m} ({modo})...")
+                try:
+                    aplicar_una(conn, m)
+                except Exception as e:
+                    raise ErrorMigracion(f"{m} falló: {e}") from e
+                print(f"✅ {m} aplicada")
+                hechas.append(m)
+        finally:
+            conn.run("SELECT pg_advisory_unlock(:k);", k=_LOCK_KEY)
+    finally:
+        conn.close()
+    if not hechas:
+        print("✅ No hay migraciones pendientes")
+    return hechas
+
+
+def estado(directorio=MIGRATIONS_DIR):
+    migraciones = descubrir(directorio)
+    conn = _conectar()
+    try:
+        ya = aplicadas(conn)
+    finally:
+        conn.close()
+    pendientes = 0
+    for m in migraciones:
+        if m.version not in ya:
+            pendientes += 1
+            print(f"⏳ {m} pendiente")
+        elif ya[m.version][1] != m.checksum:
+            print(f"⚠️ {m} aplicada, pero el archivo cambió desde entonces")
+        else:
+            print(f"✅ {m} aplicada")
+    for version in sorted(set(ya) - {m.version for m in migraciones}):
+        print(f"❓ {version:03d}_{ya[version][0]} aplicada pero sin archivo")
+    return pendientes
+
+
+def marcar(versiones, directorio=MIGRATIONS_DIR):
+    """Registra migraciones como aplicadas sin ejecutarlas."""
+    por_version = {m.version: m for m in descubrir(directorio)}
+    conn = _conectar()
+    try:
+        for v in versiones:
+            if v not in por_version:
+                raise ErrorMigracion(f"No existe la migración {v}")
+            _registrar(conn, por_version[v])
+            print(f"✅ {por_version[v]} marcada como aplicada")
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+def main(argv):
+    comando = argv[0] if argv else "aplicar"
+    try:
+        if comando == "aplicar":
+            hasta = None
+            if "--hasta" in argv:
+                hasta = int(argv[argv.index("--hasta") + 1])
+            aplicar(hasta)
+        elif comando == "estado":
+            estado()
+        elif comando == "marcar":
+            marcar([int(v) for v in argv[1:]])
+        else:
+            print(f"❌ Comando desconocido: {comando}. Opciones: aplicar, estado, marcar")
+            return 2
+    except (ErrorMigracion, ValueError, IndexError) as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
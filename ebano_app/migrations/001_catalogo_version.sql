@@ -0,0 +1,22 @@
+-- ---------------------------------------------------------
+-- MIGRACIÓN 001: Versión del catálogo
+-- Cada sentencia que modifica `productos` (checkout, admin, scripts)
+-- incrementa catalogo_version_seq. Los workers comparan ese número con
+-- el de su copia en memoria del catálogo para saber si deben recargarla.
+-- Se usa una secuencia (no una tabla) para no serializar los checkouts
+-- concurrentes sobre una misma fila.
+-- ---------------------------------------------------------
+
+CREATE SEQUENCE IF NOT EXISTS catalogo_version_seq;
+
+CREATE OR REPLACE FUNCTION fn_catalogo_version() RETURNS trigger AS $$
+BEGIN
+    PERFORM nextval('catalogo_version_seq');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_catalogo_version ON productos;
+CREATE TRIGGER trg_catalogo_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON productos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_catalogo_version();
@@ -0,0 +1,22 @@
+-- migracion: sin-transaccion
+-- ---------------------------------------------------------
+-- MIGRACIÓN 002: Índices para la paginación keyset
+-- Se crean CONCURRENTLY (sin bloquear escrituras), fuera de transacción.
+-- Cada orden de /tienda tiene un índice con la misma clave que usa el
+-- cursor (ver catalogo.ORDENES_TIENDA y paginacion.py), de modo que
+-- cualquier página es un recorrido de índice desde el cursor y cuesta
+-- lo mismo que la primera.
+--   nombre       -> idx_productos_nombre_id   (COLLATE "C", igual que la consulta)
+--   precio asc/desc -> idx_productos_precio_id (se recorre en ambos sentidos)
+--   nuevos (id DESC) -> clave primaria
+-- El índice de pedidos sirve a los listados de admin ordenados por fecha.
+-- ---------------------------------------------------------
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_nombre_id
+    ON productos ((nombre COLLATE "C"), id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_productos_precio_id
+    ON productos (precio, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pedidos_fecha_id
+    ON pedidos (fecha_pedido DESC, id DESC);
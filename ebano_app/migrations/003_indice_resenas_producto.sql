@@ -0,0 +1,12 @@
+-- migracion: sin-transaccion
+-- ---------------------------------------------------------
+-- MIGRACIÓN 003: Índice para las reseñas de un producto
+-- La página de detalle lista las reseñas de un producto por
+-- (fecha DESC, id DESC) con paginación por cursor (resenas_db.py).
+-- Se crea CONCURRENTLY (sin bloquear escrituras), fuera de transacción.
+-- Con este índice cada página lee solo sus filas, aunque el
+-- producto tenga miles de reseñas.
+-- ---------------------------------------------------------
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resenas_producto_fecha
+    ON resenas (id_producto, fecha DESC, id DESC);
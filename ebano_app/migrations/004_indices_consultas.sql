@@ -0,0 +1,50 @@
+-- migracion: sin-transaccion
+-- ---------------------------------------------------------
+-- MIGRACIÓN 004: Índices de las consultas calientes + reseña única
+-- Cada índice corresponde a una consulta de app.py / *_db.py
+-- (test_indices.py comprueba con EXPLAIN que se usan):
+--   pedidos         (id_usuario, fecha_pedido DESC)  -> /pedidos, /historial, /detalle_pedido
+--   detalle_pedidos (id_pedido, id)                  -> líneas de los pedidos (y ON DELETE CASCADE)
+--   detalle_pedidos (id_producto)                    -> ON DELETE CASCADE al borrar productos
+--   resenas         (id_usuario, fecha DESC)         -> "Mis reseñas"
+--   resenas UNIQUE  (id_usuario, id_producto)        -> una reseña por producto y usuario
+-- Las reseñas por producto ya tienen índice (migración 003).
+-- Se crean CONCURRENTLY (sin bloquear escrituras), fuera de transacción.
+-- La restricción única se añade sobre su índice ya construido
+-- (ADD CONSTRAINT ... USING INDEX), así resenas solo queda bloqueada
+-- el instante de registrarla.
+-- ---------------------------------------------------------
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pedidos_usuario_fecha
+    ON pedidos (id_usuario, fecha_pedido DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_detalle_pedidos_pedido
+    ON detalle_pedidos (id_pedido, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_detalle_pedidos_producto
+    ON detalle_pedidos (id_producto);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resenas_usuario_fecha
+    ON resenas (id_usuario, fecha DESC);
+
+-- Sin restricción dos envíos simultáneos podían crear dos reseñas del
+-- mismo producto. Se conserva la más reciente.
+DELETE FROM resenas r
+USING resenas r2
+WHERE r.id_usuario = r2.id_usuario
+AND r.id_producto = r2.id_producto
+AND r.id < r2.id;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_resenas_usuario_producto
+    ON resenas (id_usuario, id_producto);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'uq_resenas_usuario_producto'
+    ) THEN
+        ALTER TABLE resenas
+            ADD CONSTRAINT uq_resenas_usuario_producto UNIQUE USING INDEX uq_resenas_usuario_producto;
+    END IF;
+END$$;
@@ -0,0 +1,21 @@
+-- ---------------------------------------------------------
+-- MIGRACIÓN 005: Clave de idempotencia del checkout
+-- El formulario de checkout lleva una clave aleatoria que se guarda con el
+-- pedido. Si el usuario lo reenvía (doble clic, respuesta lenta, botón atrás)
+-- la restricción impide un segundo pedido con la misma clave y
+-- crear_pedido() devuelve el pedido original sin volver a escribir nada.
+-- Los pedidos anteriores quedan con NULL, que no cuenta para la restricción.
+-- ---------------------------------------------------------
+
+ALTER TABLE pedidos ADD COLUMN IF NOT EXISTS clave_idempotencia VARCHAR(64);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'uq_pedidos_usuario_clave'
+    ) THEN
+        ALTER TABLE pedidos
+            ADD CONSTRAINT uq_pedidos_usuario_clave UNIQUE (id_usuario, clave_idempotencia);
+    END IF;
+END$$;
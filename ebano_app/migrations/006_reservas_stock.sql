@@ -0,0 +1,35 @@
+-- ---------------------------------------------------------
+-- MIGRACIÓN 006: Reservas temporales de stock
+-- Al agregar al carrito se reservan las unidades durante unos minutos
+-- (reservas.py). productos.reservado suma las reservas vivas de cada
+-- producto, así que lo disponible para otros carritos es
+-- stock - reservado sin tener que sumar reservas_stock en cada consulta.
+-- El checkout convierte las reservas del carrito en el pedido y el barrido
+-- devuelve las vencidas en lotes.
+-- ---------------------------------------------------------
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS reservado INT NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS reservas_stock (
+    id_carrito VARCHAR(64) NOT NULL,
+    id_producto INT NOT NULL REFERENCES productos(id) ON DELETE CASCADE,
+    cantidad INT NOT NULL CHECK (cantidad > 0),
+    expira_en TIMESTAMP NOT NULL,
+    PRIMARY KEY (id_carrito, id_producto)
+);
+
+-- Barrido de reservas vencidas (las más antiguas primero)
+CREATE INDEX IF NOT EXISTS idx_reservas_stock_expira
+    ON reservas_stock (expira_en);
+
+-- ON DELETE CASCADE al borrar productos
+CREATE INDEX IF NOT EXISTS idx_reservas_stock_producto
+    ON reservas_stock (id_producto);
+
+-- Reservar solo cambia productos.reservado: no es un cambio del catálogo
+-- y no debe invalidar las copias en memoria de los workers (migración 001).
+DROP TRIGGER IF EXISTS trg_catalogo_version ON productos;
+CREATE TRIGGER trg_catalogo_version
+AFTER INSERT OR DELETE OR TRUNCATE OR UPDATE OF nombre, descripcion, precio, stock, imagen_url
+ON productos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_catalogo_version();
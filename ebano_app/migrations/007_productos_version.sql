@@ -0,0 +1,9 @@
+-- ---------------------------------------------------------
+-- MIGRACIÓN 007: Versión de cada producto (concurrencia optimista)
+-- productos_db.actualizar_producto() solo aplica la edición del admin si
+-- la versión no cambió desde que se mostró el formulario, y la incrementa.
+-- Los checkouts y las reservas no la tocan: descuentan stock por
+-- diferencia y no compiten con las ediciones del admin.
+-- ---------------------------------------------------------
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
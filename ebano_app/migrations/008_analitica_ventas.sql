@@ -0,0 +1,135 @@
+-- ---------------------------------------------------------
+-- MIGRACIÓN 008: Resúmenes diarios de ventas (analitica.py)
+-- Tres tablas con una fila por día y dimensión, que es lo único que lee
+-- el panel de analítica:
+--   ventas_dia_producto       (dia, id_producto)  sin pedidos cancelados
+--   ventas_dia_estado_us      (dia, estado_us)    estado del cliente, sin cancelados
+--   ventas_dia_estado_pedido  (dia, estado)       todos los pedidos
+-- Triggers por sentencia anotan en analitica_cambios los días afectados
+-- por cada alta, cambio o baja de pedidos y líneas (y por cambios de
+-- estado de un cliente). Es una tabla de solo inserción: el checkout no
+-- espera a nadie. analitica.refrescar() recalcula esos días y borra sus
+-- anotaciones; `python analitica.py reconstruir` lo recalcula todo.
+-- Recalcular un día lee sus pedidos por rango de fecha con
+-- idx_pedidos_fecha_id (migración 002), que sirve en cualquier sentido.
+-- Al aplicarse anota todos los días con pedidos: el primer refresco
+-- rellena los resúmenes.
+-- ---------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS ventas_dia_producto (
+    dia DATE NOT NULL,
+    id_producto INT NOT NULL,
+    pedidos INT NOT NULL,
+    unidades BIGINT NOT NULL,
+    ingresos NUMERIC(14,2) NOT NULL,
+    PRIMARY KEY (dia, id_producto)
+);
+
+CREATE TABLE IF NOT EXISTS ventas_dia_estado_us (
+    dia DATE NOT NULL,
+    estado_us VARCHAR(50) NOT NULL,
+    pedidos INT NOT NULL,
+    unidades BIGINT NOT NULL,
+    ingresos NUMERIC(14,2) NOT NULL,
+    PRIMARY KEY (dia, estado_us)
+);
+
+CREATE TABLE IF NOT EXISTS ventas_dia_estado_pedido (
+    dia DATE NOT NULL,
+    estado VARCHAR(20) NOT NULL,
+    pedidos INT NOT NULL,
+    ingresos NUMERIC(14,2) NOT NULL,
+    PRIMARY KEY (dia, estado)
+);
+
+CREATE TABLE IF NOT EXISTS analitica_cambios (
+    id BIGSERIAL PRIMARY KEY,
+    dia DATE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_analitica_cambios_dia
+    ON analitica_cambios (dia);
+
+-- pedidos: días de las filas nuevas y/o viejas
+CREATE OR REPLACE FUNCTION fn_analitica_pedidos() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO analitica_cambios (dia)
+        SELECT DISTINCT CAST(fecha_pedido AS DATE) FROM filas_nuevas WHERE fecha_pedido IS NOT NULL;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO analitica_cambios (dia)
+        SELECT DISTINCT CAST(fecha_pedido AS DATE) FROM filas_viejas WHERE fecha_pedido IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- detalle_pedidos: día del pedido de cada línea (si el pedido se borró,
+-- ya lo anotó el trigger de pedidos)
+CREATE OR REPLACE FUNCTION fn_analitica_detalle() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO analitica_cambios (dia)
+        SELECT DISTINCT CAST(p.fecha_pedido AS DATE)
+        FROM filas_nuevas f JOIN pedidos p ON p.id = f.id_pedido
+        WHERE p.fecha_pedido IS NOT NULL;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO analitica_cambios (dia)
+        SELECT DISTINCT CAST(p.fecha_pedido AS DATE)
+        FROM filas_viejas f JOIN pedidos p ON p.id = f.id_pedido
+        WHERE p.fecha_pedido IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- usuarios: un cliente que cambia de estado mueve sus pedidos de región
+CREATE OR REPLACE FUNCTION fn_analitica_usuarios() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO analitica_cambios (dia)
+    SELECT DISTINCT CAST(p.fecha_pedido AS DATE)
+    FROM filas_nuevas n
+    JOIN filas_viejas v ON v.id = n.id
+    JOIN pedidos p ON p.id_usuario = n.id
+    WHERE n.estado IS DISTINCT FROM v.estado
+    AND p.fecha_pedido IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_analitica_pedidos_ins ON pedidos;
+CREATE TRIGGER trg_analitica_pedidos_ins AFTER INSERT ON pedidos
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_analitica_pedidos();
+DROP TRIGGER IF EXISTS trg_analitica_pedidos_upd ON pedidos;
+CREATE TRIGGER trg_analitica_pedidos_upd AFTER UPDATE ON pedidos
+    REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_analitica_pedidos();
+DROP TRIGGER IF EXISTS trg_analitica_pedidos_del ON pedidos;
+CREATE TRIGGER trg_analitica_pedidos_del AFTER DELETE ON pedidos
+    REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_analitica_pedidos();
+
+DROP TRIGGER IF EXISTS trg_analitica_detalle_ins ON detalle_pedidos;
+CREATE TRIGGER trg_analitica_detalle_ins AFTER INSERT ON detalle_pedidos
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_analitica_detalle();
+DROP TRIGGER IF EXISTS trg_analitica_detalle_upd ON detalle_pedidos;
+CREATE TRIGGER trg_analitica_detalle_upd AFTER UPDATE ON detalle_pedidos
+    REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_analitica_detalle();
+DROP TRIGGER IF EXISTS trg_analitica_detalle_del ON detalle_pedidos;
+CREATE TRIGGER trg_analitica_detalle_del AFTER DELETE ON detalle_pedidos
+    REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_analitica_detalle();
+
+DROP TRIGGER IF EXISTS trg_analitica_usuarios_upd ON usuarios;
+CREATE TRIGGER trg_analitica_usuarios_upd AFTER UPDATE ON usuarios
+    REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_analitica_usuarios();
+
+-- Relleno inicial: todos los días con pedidos quedan pendientes
+INSERT INTO analitica_cambios (dia)
+SELECT DISTINCT CAST(fecha_pedido AS DATE) FROM pedidos WHERE fecha_pedido IS NOT NULL;
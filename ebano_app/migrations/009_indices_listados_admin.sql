@@ -0,0 +1,18 @@
+-- migracion: sin-transaccion
+-- ---------------------------------------------------------
+-- MIGRACIÓN 009: Índices de los listados paginados de admin
+-- gestionar_pedidos, gestionar_usuarios y gestionar_resenas paginan por
+-- cursor (fecha DESC, id DESC), ver pedidos_db / usuarios_db / resenas_db.
+-- Cada orden necesita un índice con la misma clave que el cursor para
+-- que cualquier página sea un recorrido desde el cursor:
+--   pedidos  -> idx_pedidos_fecha_id (migración 002)
+--   usuarios -> idx_usuarios_rol_fecha_id
+--   resenas  -> idx_resenas_fecha_id
+-- Se crean CONCURRENTLY (sin bloquear escrituras), fuera de transacción.
+-- ---------------------------------------------------------
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_rol_fecha_id
+    ON usuarios (rol, fecha_registro DESC, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resenas_fecha_id
+    ON resenas (fecha DESC, id DESC);
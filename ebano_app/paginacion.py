@@ -0,0 +1,190 @@
+"""
+paginacion.py
+Paginación por cursor (keyset) reutilizable por la tienda y los listados de admin.
+
+En lugar de OFFSET (que obliga a la BD a recorrer y descartar todas las filas
+anteriores) cada página continúa desde la clave de orden de la última fila:
+
+    WHERE <filtros> AND (precio, id) > (:c0, :c1)
+    ORDER BY precio, id
+    LIMIT :limite + 1
+
+Con un índice sobre las columnas de orden, la página N cuesta lo mismo que la 1.
+El último elemento de la clave debe ser único (normalmente el id).
+
+Uso:
+    orden = OrdenKeyset([("p.precio", "precio", "NUMERIC"), ("p.id", "id", "INT")])
+    pagina = paginar(conn, "SELECT p.id, p.precio, ... FROM productos p",
+                     ["p.stock > 0"], {}, orden, limite=12, cursor=request.args.get("cursor"),
+                     fila_a_dict=lambda r: {...})
+    pagina.items, pagina.siguiente   # siguiente = cursor de la próxima página o None
+"""
+
+import base64
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+# Filas por página de los listados de admin (pedidos, clientes, reseñas)
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 200))
+
+
+class OrdenKeyset:
+    """
+    Criterio de orden para keyset.
+
+    columnas: lista de (expresión SQL, clave en el dict de la fila, tipo SQL).
+    Todas las columnas van en el mismo sentido (asc o desc) para poder usar
+    la comparación de tuplas de PostgreSQL, que aprovecha índices compuestos.
+    """
+
+    def __init__(self, columnas, descendente=False):
+        self.columnas = columnas
+        self.descendente = descendente
+
+    def order_by(self):
+        sentido = "DESC" if self.descendente else "ASC"
+        return ", ".join(f"{expr} {sentido}" for expr, _, _ in self.columnas)
+
+    def condicion(self):
+        """Condición 'después del cursor' con parámetros :_c0, :_c1..."""
+        izquierda = ", ".join(expr for expr, _, _ in self.columnas)
+        derecha = ", ".join(f"CAST(:_c{i} AS {tipo})" for i, (_, _, tipo) in enumerate(self.columnas))
+        operador = "<" if self.descendente else ">"
+        return f"({izquierda}) {operador} ({derecha})"
+
+    def clave(self, fila):
+        """Valores de orden de un dict de fila (para el cursor y el orden en memoria)."""
+        return tuple(_normalizar(fila[k]) for _, k, _ in self.columnas)
+
+
+class Pagina:
+    def __init__(self, items, siguiente):
+        self.items = items
+        self.siguiente = siguiente
+
+    @property
+    def hay_mas(self):
+        return self.siguiente is not None
+
+
+def _normalizar(value):
+    # Decimal y float se comparan como Decimal; así coinciden la ruta SQL y la de memoria
+    if isinstance(value, float):
+        return Decimal(str(value))
+    return value
+
+
+def _serializar(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def codificar_cursor(valores):
+    raw = json.dumps([_serializar(v) for v in valores], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor, orden):
+    """Devuelve la tupla de valores del cursor, o None si falta o es inválido."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valores = json.loads(raw.decode("utf-8"))
+        if not isinstance(valores, list) or len(valores) != len(orden.columnas):
+            return None
+        resultado = []
+        for v, (_, _, tipo) in zip(valores, orden.columnas):
+            if tipo == "NUMERIC":
+                v = Decimal(str(v))
+            elif tipo in ("INT", "BIGINT"):
+                v = int(v)
+            elif tipo == "TIMESTAMP":
+                v = datetime.fromisoformat(v)
+            elif not isinstance(v, str):
+                return None
+            resultado.append(v)
+        return tuple(resultado)
+    except (ValueError, TypeError, InvalidOperation, UnicodeDecodeError):
+        return None
+
+
+def paginar(conn, select_sql, filtros, params, orden, limite, cursor=None, fila_a_dict=None):
+    """
+    Ejecuta una página keyset en la BD.
+
+    - select_sql: "SELECT ... FROM ... [JOIN ...]" sin WHERE / ORDER BY / LIMIT
+    - filtros: lista de condiciones SQL (se unen con AND)
+    - params: parámetros con nombre de los filtros
+    - fila_a_dict: convierte cada fila en dict (debe incluir las claves del orden)
+    """
+    condiciones = list(filtros)
+    params = dict(params)
+    valores = decodificar_cursor(cursor, orden)
+    if valores is not None:
+        condiciones.append(orden.condicion())
+        params.update({f"_c{i}": v for i, v in enumerate(valores)})
+
+    sql = select_sql
+    if condiciones:
+        sql += "\nWHERE " + " AND ".join(f"({c})" for c in condiciones)
+    sql += f"\nORDER BY {orden.order_by()}\nLIMIT :_limite;"
+    params["_limite"] = limite + 1
+
+    filas = conn.run(sql, **params)
+    items = [fila_a_dict(r) if fila_a_dict else r for r in filas[:limite]]
+    siguiente = codificar_cursor(orden.clave(items[-1])) if len(filas) > limite and items else None
+    return Pagina(items, siguiente)
+
+
+class ListaOrdenada:
+    """
+    Lista en memoria ordenada una sola vez por un OrdenKeyset (siempre en
+    ascendente; las órdenes descendentes la recorren al revés), con las
+    claves precalculadas para buscar el cursor con bisect.
+    """
+
+    def __init__(self, items, orden):
+        self.orden = orden
+        self.items = sorted(items, key=orden.clave)
+        self.claves = [orden.clave(i) for i in self.items]
+
+
+def paginar_lista(lista, predicado, limite, cursor=None, copiar=None):
+    """
+    Misma paginación keyset sobre una ListaOrdenada (p. ej. el catálogo cacheado).
+    Los cursores son intercambiables con los de paginar().
+
+    Salta al cursor con bisect y solo recorre hasta reunir limite + 1 elementos
+    que cumplan `predicado`: la página N cuesta lo mismo que la 1. `copiar`
+    (p. ej. dict) se aplica solo a los elementos devueltos.
+    """
+    orden = lista.orden
+    valores = decodificar_cursor(cursor, orden)
+    if orden.descendente:
+        fin = len(lista.items) if valores is None else bisect_left(lista.claves, valores)
+        indices = range(fin - 1, -1, -1)
+    else:
+        inicio = 0 if valores is None else bisect_right(lista.claves, valores)
+        indices = range(inicio, len(lista.items))
+
+    pagina, hay_mas = [], False
+    for i in indices:
+        item = lista.items[i]
+        if not predicado(item):
+            continue
+        if len(pagina) == limite:
+            hay_mas = True
+            break
+        pagina.append(item)
+
+    if copiar is not None:
+        pagina = [copiar(i) for i in pagina]
+    siguiente = codificar_cursor(orden.clave(pagina[-1])) if hay_mas and pagina else None
+    return Pagina(pagina, siguiente)
@@ -0,0 +1,392 @@
+"""
+pedidos_db.py
+Consultas de pedidos compartidas por las vistas (pedidos, historial, exportaciones).
+"""
+
+from datetime import datetime
+from decimal import Decimal
+
+from paginacion import ADMIN_PAGE_SIZE, OrdenKeyset, paginar
+from reservas import bloquear_carrito
+
+# Estados que cierran un pedido (van al historial)
+ESTADOS_FINALES = ("Entregado", "Cancelado")
+
+
+def _cop_int(value):
+    """NUMERIC de la BD -> entero COP (sin decimales)."""
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(Decimal('1')))
+
+
+def cargar_pedidos_usuario(conn, id_usuario, finalizados=False):
+    """
+    Devuelve los pedidos de un usuario con sus productos, más recientes primero.
+
+    - finalizados=False: pedidos activos (todo lo que no es Entregado/Cancelado)
+    - finalizados=True:  historial (Entregado, Cancelado)
+
+    Usa siempre 2 consultas (pedidos + todas sus líneas), sin importar
+    cuántos pedidos tenga el usuario, y agrupa las líneas en Python.
+    """
+    filtro = "p.estado = ANY(:estados)" if finalizados else "NOT (p.estado = ANY(:estados))"
+    res = conn.run(f"""
+        SELECT p.id, p.fecha_pedido, p.total, p.estado
+        FROM pedidos p
+        WHERE p.id_usuario = :uid
+        AND {filtro}
+        ORDER BY p.fecha_pedido DESC;
+    """, uid=id_usuario, estados=list(ESTADOS_FINALES))
+
+    pedidos = []
+    por_id = {}
+    for row in res:
+        pedido = {
+            "id": row[0],
+            "fecha": row[1],
+            "total": _cop_int(row[2]),
+            "estado": row[3],
+            "productos": []
+        }
+        pedidos.append(pedido)
+        por_id[row[0]] = pedido
+
+    if not pedidos:
+        return pedidos
+
+    detalle_res = conn.run("""
+        SELECT dp.id_pedido, dp.cantidad, dp.subtotal, dp.id_producto, pr.nombre, pr.imagen_url
+        FROM detalle_pedidos dp
+        JOIN productos pr ON pr.id = dp.id_producto
+        WHERE dp.id_pedido = ANY(:ids)
+        ORDER BY dp.id_pedido, dp.id;
+    """, ids=list(por_id))
+
+    for det in detalle_res:
+        por_id[det[0]]["productos"].append({
+            "id_producto": det[3],
+            "nombre": det[4],
+            "cantidad": det[1],
+            "subtotal": _cop_int(det[2]),
+            "imagen_url": det[5]
+        })
+
+    return pedidos
+
+
+# ---------------------------------------------------------
+# VOLVER A COMPRAR
+# ---------------------------------------------------------
+class Recompra:
+    """
+    Resultado de preparar_recompra().
+
+    - encontrado: False si el pedido no existe o no es del usuario
+    - lineas:     dicts id, nombre, precio (COP actual), stock, pedida y
+                  cantidad (la pedida recortada al stock actual; 0 si está agotado)
+    """
+
+    def __init__(self, encontrado, lineas):
+        self.encontrado = encontrado
+        self.lineas = lineas
+
+    @property
+    def agregables(self):
+        """[(id_producto, cantidad)] listas para Carrito.fusionar()."""
+        return [(l["id"], l["cantidad"]) for l in self.lineas if l["cantidad"] > 0]
+
+    @property
+    def sin_stock(self):
+        return [l["nombre"] for l in self.lineas if l["cantidad"] <= 0]
+
+    @property
+    def recortadas(self):
+        """Nombres de los productos que se agregan con menos unidades que en el pedido."""
+        return [l["nombre"] for l in self.lineas if 0 < l["cantidad"] < l["pedida"]]
+
+    @property
+    def total(self):
+        """Valor en COP, a precios actuales, de lo que se agrega."""
+        return sum(l["precio"] * l["cantidad"] for l in self.lineas)
+
+
+def preparar_recompra(conn, id_pedido, id_usuario):
+    """
+    Líneas de un pedido anterior listas para volver al carrito, en UNA consulta
+    sin importar cuántas líneas tenga: comprueba que el pedido es del usuario,
+    lee precio y stock actuales y limita cada cantidad al stock en SQL.
+    Las líneas repetidas de un mismo producto se agrupan (en el orden del pedido).
+    """
+    res = conn.run("""
+        SELECT pr.id, pr.nombre, pr.precio, pr.stock,
+               SUM(dp.cantidad) AS pedida,
+               CASE WHEN pr.stock IS NULL THEN SUM(dp.cantidad)
+                    ELSE LEAST(SUM(dp.cantidad), GREATEST(pr.stock, 0))
+               END AS cantidad
+        FROM pedidos p
+        LEFT JOIN detalle_pedidos dp ON dp.id_pedido = p.id
+        LEFT JOIN productos pr ON pr.id = dp.id_producto
+        WHERE p.id = :pid AND p.id_usuario = :uid
+        GROUP BY pr.id
+        ORDER BY MIN(dp.id);
+    """, pid=id_pedido, uid=id_usuario)
+
+    if not res:
+        return Recompra(False, [])
+
+    lineas = []
+    for r in res:
+        if r[0] is None:
+            # Pedido sin líneas: la fila solo confirma que existe y es del usuario
+            continue
+        lineas.append({
+            "id": r[0],
+            "nombre": r[1],
+            "precio": _cop_int(r[2]),
+            "stock": r[3],
+            "pedida": int(r[4]),
+            "cantidad": int(r[5]),
+        })
+    return Recompra(True, lineas)
+
+
+# ---------------------------------------------------------
+# CHECKOUT
+# ---------------------------------------------------------
+class StockInsuficiente(Exception):
+    """
+    Alguna línea del carrito no se puede servir. La transacción ya se deshizo.
+
+    - sin_stock:    nombres de productos agotados o inexistentes
+    - insuficiente: "Nombre (disponible: X, solicitaste: Y)"
+    """
+
+    def __init__(self, sin_stock, insuficiente):
+        super().__init__("Stock insuficiente")
+        self.sin_stock = sin_stock
+        self.insuficiente = insuficiente
+
+
+def pedido_por_clave(conn, id_usuario, clave):
+    """Id del pedido del usuario creado con esa clave de idempotencia, o None."""
+    if not clave:
+        return None
+    res = conn.run("""
+        SELECT id FROM pedidos
+        WHERE id_usuario = :uid AND clave_idempotencia = :clave;
+    """, uid=id_usuario, clave=clave)
+    return res[0][0] if res else None
+
+
+def _viola_unica(e, restriccion):
+    """
+    True si `e` es la violación de unicidad (SQLSTATE 23505) de `restriccion`.
+    Se leen los campos del error del servidor (pg8000 los deja como dict en
+    e.args[0]), no el mensaje, que depende de la versión y del idioma.
+    """
+    campos = e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+    return campos.get("C") == "23505" and campos.get("n") == restriccion
+
+
+class PrecioCambiado(Exception):
+    """
+    El total con los precios vigentes no es el que se mostró al cliente.
+    La transacción ya se deshizo; `total` es el total actual (COP).
+    """
+
+    def __init__(self, total, total_esperado):
+        super().__init__(f"El total cambió de {total_esperado} a {total}")
+        self.total = total
+        self.total_esperado = total_esperado
+
+
+def crear_pedido(conn, id_usuario, carrito, estado="Pendiente", clave=None, id_carrito=None,
+                 total_esperado=None):
+    """
+    Registra un pedido y descuenta stock de forma atómica.
+
+    `carrito` es una lista de dicts con id, nombre y cantidad. El precio se toma
+    de productos en el mismo SELECT ... FOR UPDATE, así que el pedido se cobra
+    al precio vigente aunque haya cambiado desde que se mostró el carrito.
+    Siempre son 3 viajes a la BD, sin importar el número de líneas:
+      1. bloquear las filas de productos (en orden de id, sin deadlocks) y leer stock
+      2. una sola sentencia que descuenta stock e inserta pedido y detalles
+      3. commit
+    Si alguna línea no tiene stock suficiente hace rollback y lanza StockInsuficiente.
+    Devuelve el id del pedido creado.
+
+    `clave` (migración 005) hace el checkout idempotente: si ya existe un pedido
+    del usuario con esa clave se devuelve su id sin escribir nada. La búsqueda
+    se hace con las filas de productos ya bloqueadas, así que un reenvío
+    simultáneo espera al primero y encuentra su pedido (un viaje más a la BD).
+    La restricción uq_pedidos_usuario_clave cubre el caso de carritos distintos.
+
+    `id_carrito` (migración 006) convierte las reservas de ese carrito en el
+    pedido: antes de bloquear productos se bloquean el carrito y sus reservas
+    (mismo orden que reservas.py), lo reservado por el carrito cuenta como
+    disponible, lo reservado por otros carritos no, y las reservas se borran
+    en la misma sentencia que descuenta el stock (dos viajes más a la BD).
+
+    `total_esperado` es el total (COP) que vio el cliente al confirmar. Si con
+    los precios bloqueados el total es otro, hace rollback y lanza
+    PrecioCambiado en lugar de cobrar un importe que no se mostró.
+    """
+    # Agrupar líneas repetidas del mismo producto
+    lineas = {}
+    for item in carrito:
+        pid = int(item["id"])
+        linea = lineas.setdefault(pid, {"nombre": item.get("nombre", ""), "cantidad": 0})
+        linea["cantidad"] += int(item["cantidad"])
+
+    ids = sorted(lineas)
+    try:
+        mias = {}
+        if id_carrito:
+            bloquear_carrito(conn, id_carrito)
+            mias = dict(conn.run("""
+                SELECT id_producto, cantidad
+                FROM reservas_stock
+                WHERE id_carrito = :cid
+                ORDER BY id_producto
+                FOR UPDATE;
+            """, cid=id_carrito))
+
+        filas = conn.run("""
+            SELECT id, nombre, stock, precio, reservado
+            FROM productos
+            WHERE id = ANY(:ids)
+            ORDER BY id
+            FOR UPDATE;
+        """, ids=ids)
+        # Disponible para este carrito: stock menos lo reservado por los demás
+        actuales = {
+            r[0]: (r[1], None if r[2] is None else r[2] - (r[4] - mias.get(r[0], 0)))
+            for r in filas
+        }
+        precios = {r[0]: _cop_int(r[3]) for r in filas}
+
+        existente = pedido_por_clave(conn, id_usuario, clave)
+        if existente is not None:
+            conn.rollback()
+            return existente
+
+        sin_stock = []
+        insuficiente = []
+        for pid in ids:
+            if pid not in actuales:
+                sin_stock.append(lineas[pid]["nombre"])
+                continue
+            nombre, stock = actuales[pid]
+            pedida = lineas[pid]["cantidad"]
+            if stock is None:
+                # stock NULL = ilimitado
+                continue
+            if stock <= 0:
+                sin_stock.append(nombre)
+            elif pedida > stock:
+                insuficiente.append(f"{nombre} (disponible: {stock}, solicitaste: {pedida})")
+
+        if sin_stock or insuficiente:
+            conn.rollback()
+            raise StockInsuficiente(sin_stock, insuficiente)
+
+        cantidades = [lineas[pid]["cantidad"] for pid in ids]
+        subtotales = [precios[pid] * lineas[pid]["cantidad"] for pid in ids]
+        reservadas = [mias.get(pid, 0) for pid in ids]
+
+        if total_esperado is not None and sum(subtotales) != total_esperado:
+            conn.rollback()
+            raise PrecioCambiado(sum(subtotales), total_esperado)
+
+        res = conn.run("""
+            WITH lineas AS (
+                SELECT *
+                FROM unnest(CAST(:ids AS INT[]), CAST(:cantidades AS INT[]), CAST(:subtotales AS NUMERIC[]),
+                            CAST(:reservadas AS INT[]))
+                     AS l(id_producto, cantidad, subtotal, reservada)
+            ),
+            stock_actualizado AS (
+                UPDATE productos pr
+                SET stock = pr.stock - l.cantidad,
+                    reservado = GREATEST(pr.reservado - l.reservada, 0)
+                FROM lineas l
+                WHERE pr.id = l.id_producto
+                RETURNING pr.id
+            ),
+            reservas_convertidas AS (
+                DELETE FROM reservas_stock
+                WHERE id_carrito = :cid AND id_producto = ANY(:ids)
+                RETURNING id_producto
+            ),
+            nuevo_pedido AS (
+                INSERT INTO pedidos (id_usuario, fecha_pedido, total, estado, clave_idempotencia)
+                VALUES (:uid, :fecha, :total, :estado, :clave)
+                RETURNING id
+            ),
+            detalles AS (
+                INSERT INTO detalle_pedidos (id_pedido, id_producto, cantidad, subtotal)
+                SELECT np.id, l.id_producto, l.cantidad, l.subtotal
+                FROM nuevo_pedido np CROSS JOIN lineas l
+                RETURNING id
+            )
+            SELECT (SELECT id FROM nuevo_pedido),
+                   (SELECT COUNT(*) FROM stock_actualizado),
+                   (SELECT COUNT(*) FROM detalles);
+        """, ids=ids, cantidades=cantidades, subtotales=subtotales, reservadas=reservadas, cid=id_carrito,
+            uid=id_usuario, fecha=datetime.now(), total=sum(subtotales), estado=estado, clave=clave)
+
+        pedido_id, n_stock, n_detalles = res[0]
+        if n_stock != len(ids) or n_detalles != len(ids):
+            raise RuntimeError(f"Checkout inconsistente: {n_stock} stock / {n_detalles} detalles de {len(ids)}")
+
+        conn.commit()
+        return pedido_id
+
+    except (StockInsuficiente, PrecioCambiado):
+        raise
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        if clave and _viola_unica(e, "uq_pedidos_usuario_clave"):
+            # Otro envío con la misma clave se confirmó primero
+            existente = pedido_por_clave(conn, id_usuario, clave)
+            conn.rollback()
+            if existente is not None:
+                return existente
+        raise
+
+
+# ---------------------------------------------------------
+# LISTADO DE ADMIN (gestionar_pedidos)
+# ---------------------------------------------------------
+# Recorre idx_pedidos_fecha_id (migración 002) desde el cursor
+ORDEN_PEDIDOS_ADMIN = OrdenKeyset([("p.fecha_pedido", "fecha_pedido", "TIMESTAMP"), ("p.id", "id", "INT")],
+                                  descendente=True)
+SELECT_PEDIDOS_ADMIN = """
+    SELECT p.id, p.id_usuario, u.nombre_completo, u.correo, p.fecha_pedido, p.total, p.estado
+    FROM pedidos p
+    JOIN usuarios u ON p.id_usuario = u.id
+"""
+
+
+def _fila_a_pedido_admin(r):
+    return {
+        "id": r[0],
+        "id_usuario": r[1],
+        "usuario_nombre": r[2],
+        "usuario_correo": r[3],
+        "fecha_pedido": r[4],
+        "total": _cop_int(r[5]),
+        "estado": r[6],
+    }
+
+
+def pagina_pedidos_admin(conn, cursor=None, limite=ADMIN_PAGE_SIZE):
+    """Una página de todos los pedidos, más recientes primero (keyset, ver paginacion.py)."""
+    return paginar(conn, SELECT_PEDIDOS_ADMIN, [], {}, ORDEN_PEDIDOS_ADMIN, limite, cursor,
+                   fila_a_dict=_fila_a_pedido_admin)
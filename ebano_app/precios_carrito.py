@@ -0,0 +1,133 @@
+"""
+precios_carrito.py
+Cotiza un carrito completo contra los precios y el stock actuales de productos.
+
+- Una sola consulta por carrito, sin importar cuántas líneas tenga.
+- El resultado se memoriza por (versión del catálogo, líneas del carrito):
+  mientras nadie modifique productos, recargar el carrito o pasar al
+  checkout no vuelve a consultar la BD. Cualquier escritura en productos
+  cambia la versión (migración 001) y las cotizaciones viejas dejan de usarse.
+- Sin la migración 001 no hay versión y se consulta siempre.
+- La versión se lee de la copia del catálogo y puede ir hasta
+  CATALOGO_CHECK_SECONDS por detrás: el checkout envía el total mostrado
+  y crear_pedido() se niega a cobrar otro (PrecioCambiado).
+
+Uso:
+    cot = cotizar_carrito([(id_producto, cantidad), ...])
+    cot.lineas      # dicts: id, nombre, precio, imagen_url, stock, cantidad, subtotal, aviso
+    cot.total       # COP (int)
+    cot.avisos      # textos para el usuario (agotado, stock insuficiente, retirado)
+    cot.disponible  # False si alguna línea no se puede comprar tal cual
+"""
+
+import os
+from decimal import Decimal
+
+from bd_config import db_connection
+from cache_memoria import CacheTTL
+from catalogo import catalogo
+
+COTIZACIONES_CACHE_MAX = int(os.getenv("COTIZACIONES_CACHE_MAX", 4096))
+COTIZACIONES_CACHE_TTL = int(os.getenv("COTIZACIONES_CACHE_TTL", 300))
+
+_cotizaciones = CacheTTL("cotizaciones_carrito", max_items=COTIZACIONES_CACHE_MAX, ttl=COTIZACIONES_CACHE_TTL)
+
+
+class Cotizacion:
+    """Resultado de cotizar un carrito. Tratar como solo lectura (puede estar compartido)."""
+
+    def __init__(self, lineas, total, avisos):
+        self.lineas = lineas
+        self.total = total
+        self.avisos = avisos
+
+    @property
+    def disponible(self):
+        return not self.avisos
+
+    def __len__(self):
+        return len(self.lineas)
+
+
+def _precio_int(value):
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(Decimal('1')))
+
+
+def _cotizar(conn, items):
+    # Cantidades agrupadas por producto (un carrito no debería repetirlos, pero por si acaso)
+    cantidades = {}
+    for pid, qty in items:
+        cantidades[pid] = cantidades.get(pid, 0) + qty
+
+    filas = conn.run(
+        "SELECT id, nombre, precio, imagen_url, stock FROM productos WHERE id = ANY(:ids);",
+        ids=list(cantidades)
+    )
+    por_id = {r[0]: r for r in filas}
+
+    lineas, avisos, total = [], [], 0
+    retirados = 0
+    for pid, cantidad in cantidades.items():
+        r = por_id.get(pid)
+        if r is None:
+            retirados += 1
+            continue
+        nombre, stock = r[1], r[4]
+        precio = _precio_int(r[2])
+        aviso = None
+        if stock is not None and stock <= 0:
+            aviso = f"'{nombre}' está agotado."
+        elif stock is not None and cantidad > stock:
+            aviso = f"Sólo hay {stock} unidades de '{nombre}' (tienes {cantidad} en el carrito)."
+        if aviso:
+            avisos.append(aviso)
+        subtotal = precio * cantidad
+        total += subtotal
+        lineas.append({
+            "id": pid,
+            "nombre": nombre,
+            "precio": precio,
+            "imagen_url": r[3],
+            "stock": stock,
+            "cantidad": cantidad,
+            "subtotal": subtotal,
+            "aviso": aviso,
+        })
+    if retirados:
+        avisos.append(f"{retirados} producto(s) de tu carrito ya no están a la venta.")
+    return Cotizacion(lineas, total, avisos)
+
+
+def cotizar_carrito(items, conn=None):
+    """
+    Cotiza [(id_producto, cantidad), ...]. Si se pasa `conn` se usa esa
+    conexión; si no, se toma una del pool solo cuando no hay memoria válida.
+    """
+    items = tuple((int(pid), int(qty)) for pid, qty in items if int(qty) > 0)
+    if not items:
+        return Cotizacion([], 0, [])
+
+    try:
+        version = catalogo.version()
+    except Exception:
+        version = None
+
+    clave = (version, items)
+    if version is not None:
+        cot = _cotizaciones.get(clave)
+        if cot is not None:
+            return cot
+
+    if conn is not None:
+        cot = _cotizar(conn, items)
+    else:
+        with db_connection() as conn:
+            cot = _cotizar(conn, items)
+
+    if version is not None:
+        _cotizaciones.set(clave, cot)
+    return cot
@@ -0,0 +1,331 @@
+"""
+productos_db.py
+Ediciones de productos desde el panel de administración (gestionar_productos).
+
+- Concurrencia optimista (migración 007): cada edición del admin incrementa
+  productos.version y solo se aplica si la versión sigue siendo la que vio
+  el formulario. No se bloquea la fila entre el GET y el POST.
+- El stock se edita como diferencia: si el formulario mostraba 10 y el admin
+  escribe 15 se suman 5 al stock actual, así las ventas que ocurrieron
+  mientras tanto (que descuentan sin tocar la versión) no se pierden.
+- Una sola sentencia UPDATE por producto (stock + precio + versión).
+- Si la versión cambió se relee la fila: si otro admin cambió el precio que
+  este quería cambiar es un conflicto (ConflictoProducto); si no, la edición
+  sigue teniendo sentido y se reintenta con la versión nueva.
+- Edición masiva (tabla completa o CSV): validación fila a fila en Python y
+  una sola sentencia para todo el lote, en una transacción. Si alguna fila
+  no se puede aplicar no se aplica ninguna y se informa cada fila.
+"""
+
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+EDICION_REINTENTOS = 3
+LOTE_MAX_FILAS = 20000
+
+
+class ConflictoProducto(Exception):
+    """
+    La edición no se aplicó. La transacción ya se deshizo.
+
+    - motivo: texto para el admin
+    - actual: dict con id, precio, stock y version vigentes (None si el producto no existe)
+    """
+
+    def __init__(self, motivo, actual=None):
+        super().__init__(motivo)
+        self.motivo = motivo
+        self.actual = actual
+
+
+def _cop_int(value):
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(Decimal('1')))
+
+
+def _leer(conn, producto_id):
+    res = conn.run("SELECT id, precio, stock, version FROM productos WHERE id = :id;", id=producto_id)
+    if not res:
+        return None
+    r = res[0]
+    return {"id": r[0], "precio": r[1], "stock": r[2], "version": r[3]}
+
+
+def actualizar_producto(conn, producto_id, version, stock_original, stock_nuevo,
+                        precio_original=None, precio_nuevo=None):
+    """
+    Aplica la edición del admin sobre el producto y confirma.
+
+    `version`, `stock_original` y `precio_original` son los valores que mostraba
+    el formulario. El precio solo se escribe si `precio_nuevo` es distinto de
+    `precio_original` (comparando en COP enteros, como se muestran).
+    Devuelve el dict del producto tras la edición o None si no había cambios.
+    Lanza ConflictoProducto si no se pudo aplicar.
+    """
+    delta = stock_nuevo - stock_original
+    cambia_precio = precio_nuevo is not None and (
+        precio_original is None or _cop_int(precio_nuevo) != _cop_int(precio_original)
+    )
+    if delta == 0 and not cambia_precio:
+        return None
+
+    try:
+        for _ in range(EDICION_REINTENTOS):
+            res = conn.run("""
+                UPDATE productos
+                SET stock = CASE WHEN stock IS NULL THEN CAST(:stock_nuevo AS INT) ELSE stock + :delta END,
+                    precio = CASE WHEN :cambia_precio THEN CAST(:precio AS NUMERIC) ELSE precio END,
+                    version = version + 1
+                WHERE id = :id
+                AND version = :version
+                AND (stock IS NULL OR stock + :delta >= 0)
+                RETURNING id, precio, stock, version;
+            """, id=producto_id, version=version, delta=delta, stock_nuevo=stock_nuevo,
+                cambia_precio=cambia_precio, precio=precio_nuevo)
+            if res:
+                conn.commit()
+                r = res[0]
+                return {"id": r[0], "precio": r[1], "stock": r[2], "version": r[3]}
+
+            # No se aplicó: ver por qué con la fila actual
+            actual = _leer(conn, producto_id)
+            if actual is None:
+                raise ConflictoProducto("El producto ya no existe.")
+            if actual["stock"] is not None and actual["stock"] + delta < 0:
+                raise ConflictoProducto(
+                    f"El stock cambió mientras editabas (ahora hay {actual['stock']}): "
+                    f"restar {-delta} lo dejaría negativo.", actual)
+            if actual["version"] == version:
+                raise ConflictoProducto("No se pudo actualizar el producto.", actual)
+            if cambia_precio and precio_original is not None \
+                    and _cop_int(actual["precio"]) != _cop_int(precio_original):
+                raise ConflictoProducto(
+                    f"Otro administrador cambió el precio a {_cop_int(actual['precio'])} mientras editabas.",
+                    actual)
+            # Solo cambió lo que esta edición no toca: reintentar sobre la versión nueva
+            version = actual["version"]
+        raise ConflictoProducto("El producto está cambiando demasiado rápido; vuelve a intentarlo.", actual)
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+
+
+# ---------------------------------------------------------
+# EDICIÓN MASIVA
+# ---------------------------------------------------------
+class ResultadoLote:
+    """
+    Resultado de actualizar_productos_lote.
+
+    - aplicados: productos actualizados (0 si hubo errores: el lote es todo o nada)
+    - errores:   lista de (fila, mensaje); fila es el número de línea del CSV o "#id"
+    """
+
+    def __init__(self, aplicados=0, errores=None):
+        self.aplicados = aplicados
+        self.errores = errores or []
+
+    @property
+    def ok(self):
+        return not self.errores
+
+
+def _entero(texto, campo, errores, fila):
+    try:
+        valor = int(texto)
+    except (TypeError, ValueError):
+        errores.append((fila, f"{campo} '{texto}' no es un número entero"))
+        return None
+    if valor < 0:
+        errores.append((fila, f"{campo} no puede ser negativo"))
+        return None
+    return valor
+
+
+def _precio(texto, errores, fila):
+    try:
+        valor = Decimal(texto.replace(",", "."))
+    except (InvalidOperation, AttributeError):
+        errores.append((fila, f"precio '{texto}' no es válido"))
+        return None
+    if valor < 0:
+        errores.append((fila, "el precio no puede ser negativo"))
+        return None
+    return valor
+
+
+def _cambio(fila, id_producto, stock=None, precio=None, delta=None, version=None):
+    return {"fila": fila, "id": id_producto, "stock": stock, "precio": precio,
+            "delta": delta, "version": version}
+
+
+def cambios_desde_csv(texto):
+    """
+    Lee un CSV con cabecera `id,stock,precio` (precio o stock pueden faltar o ir
+    vacíos: no se cambian). El stock es el valor absoluto (conteo de inventario).
+    Devuelve (cambios, errores).
+    """
+    cambios, errores, vistos = [], [], {}
+    lector = csv.DictReader(io.StringIO(texto.lstrip("\ufeff")))
+    columnas = {c.strip().lower() for c in (lector.fieldnames or [])}
+    if "id" not in columnas or not columnas & {"stock", "precio"}:
+        return [], [(1, "la cabecera debe tener id y al menos stock o precio")]
+
+    for row in lector:
+        n = lector.line_num
+        # Columnas de más (clave None) se ignoran
+        row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k is not None}
+        if not any(row.values()):
+            continue
+        if len(cambios) + len(errores) >= LOTE_MAX_FILAS:
+            errores.append((n, f"el lote admite como máximo {LOTE_MAX_FILAS} filas"))
+            break
+        antes = len(errores)
+        id_producto = _entero(row.get("id"), "id", errores, n)
+        stock = _entero(row["stock"], "stock", errores, n) if row.get("stock") else None
+        precio = _precio(row["precio"], errores, n) if row.get("precio") else None
+        if len(errores) > antes:
+            continue
+        if stock is None and precio is None:
+            errores.append((n, "no indica stock ni precio"))
+        elif id_producto in vistos:
+            errores.append((n, f"el producto {id_producto} ya aparece en la línea {vistos[id_producto]}"))
+        else:
+            vistos[id_producto] = n
+            cambios.append(_cambio(n, id_producto, stock=stock, precio=precio))
+    return cambios, errores
+
+
+def cambios_desde_formulario(form):
+    """
+    Lee la tabla de edición masiva: por cada producto stock_<id>, precio_<id> y
+    los valores que mostraba (version_<id>, stock_original_<id>, precio_original_<id>).
+    Solo devuelve las filas que cambiaron. El stock va por diferencia, como
+    en actualizar_producto; los cambios de precio exigen la misma versión.
+    """
+    cambios, errores = [], []
+    for clave in form:
+        if not clave.startswith("stock_") or clave.startswith("stock_original_"):
+            continue
+        try:
+            id_producto = int(clave[len("stock_"):])
+        except ValueError:
+            continue
+        fila = f"#{id_producto}"
+        antes = len(errores)
+        stock = _entero(form.get(clave, "").strip(), "stock", errores, fila)
+        original = form.get(f"stock_original_{id_producto}", "").strip()
+        original = _entero(original, "stock mostrado", errores, fila) if original else None
+        precio_txt = form.get(f"precio_{id_producto}", "").strip()
+        precio = _precio(precio_txt, errores, fila) if precio_txt else None
+        precio_original = form.get(f"precio_original_{id_producto}", "").strip()
+        version = form.get(f"version_{id_producto}", "").strip()
+        if len(errores) > antes:
+            continue
+
+        try:
+            precio_original = Decimal(precio_original) if precio_original else None
+        except InvalidOperation:
+            precio_original = None
+        cambia_precio = precio is not None and (
+            precio_original is None or _cop_int(precio) != _cop_int(precio_original)
+        )
+        delta = None if original is None else stock - original
+        if delta == 0 and not cambia_precio:
+            continue
+        cambios.append(_cambio(
+            fila, id_producto, stock=stock, delta=delta,
+            precio=precio if cambia_precio else None,
+            version=int(version) if cambia_precio and version.isdigit() else None,
+        ))
+    cambios.sort(key=lambda c: c["id"])
+    return cambios, errores
+
+
+def actualizar_productos_lote(conn, cambios):
+    """
+    Aplica todos los `cambios` (de cambios_desde_csv / cambios_desde_formulario)
+    en una sola sentencia y confirma, o no aplica ninguno.
+
+    Las filas se bloquean en orden de id (igual que el checkout y las reservas)
+    para no provocar deadlocks con las ventas en curso. Cada fila se aplica si:
+    el producto existe, su versión coincide (solo si la fila la trae) y el
+    stock por diferencia no queda negativo. Devuelve un ResultadoLote.
+    """
+    if not cambios:
+        return ResultadoLote()
+    cambios = sorted(cambios, key=lambda c: c["id"])
+    try:
+        filas = conn.run("""
+            WITH cambios AS (
+                SELECT *
+                FROM unnest(CAST(:ids AS INT[]), CAST(:stocks AS INT[]), CAST(:deltas AS INT[]),
+                            CAST(:precios AS NUMERIC[]), CAST(:versiones AS INT[]))
+                     AS c(id, stock, delta, precio, version)
+            ),
+            bloqueados AS (
+                -- FOR UPDATE devuelve la versión más reciente de cada fila (no la
+                -- de la instantánea): es la que explica por qué no se aplicó
+                SELECT p.id, p.version, p.stock
+                FROM productos p
+                WHERE p.id = ANY(CAST(:ids AS INT[]))
+                ORDER BY p.id
+                FOR UPDATE
+            ),
+            aplicados AS (
+                UPDATE productos p
+                SET stock = CASE WHEN c.delta IS NOT NULL AND p.stock IS NOT NULL THEN p.stock + c.delta
+                                 ELSE COALESCE(c.stock, p.stock) END,
+                    precio = COALESCE(c.precio, p.precio),
+                    version = p.version + 1
+                FROM cambios c
+                JOIN bloqueados b ON b.id = c.id
+                WHERE p.id = c.id
+                AND (c.version IS NULL OR p.version = c.version)
+                AND (c.delta IS NULL OR p.stock IS NULL OR p.stock + c.delta >= 0)
+                RETURNING p.id
+            )
+            SELECT c.id, a.id IS NOT NULL, b.id IS NOT NULL, b.version, b.stock
+            FROM cambios c
+            LEFT JOIN aplicados a ON a.id = c.id
+            LEFT JOIN bloqueados b ON b.id = c.id;
+        """, ids=[c["id"] for c in cambios],
+            stocks=[c["stock"] for c in cambios],
+            deltas=[c["delta"] for c in cambios],
+            precios=[c["precio"] for c in cambios],
+            versiones=[c["version"] for c in cambios])
+
+        por_id = {c["id"]: c for c in cambios}
+        errores = []
+        for id_producto, aplicado, existe, version, stock in filas:
+            if aplicado:
+                continue
+            cambio = por_id[id_producto]
+            if not existe:
+                errores.append((cambio["fila"], f"el producto {id_producto} no existe"))
+            elif cambio["version"] is not None and version != cambio["version"]:
+                errores.append((cambio["fila"], f"otro administrador modificó el producto {id_producto}"))
+            elif cambio["delta"] is not None and stock is not None and stock + cambio["delta"] < 0:
+                errores.append((cambio["fila"], f"el stock del producto {id_producto} cambió a {stock} "
+                                                f"y restar {-cambio['delta']} lo dejaría negativo"))
+            else:
+                errores.append((cambio["fila"], f"el producto {id_producto} cambió mientras se aplicaba "
+                                                f"el lote; vuelve a intentarlo"))
+        if errores:
+            conn.rollback()
+            return ResultadoLote(0, errores)
+        conn.commit()
+        return ResultadoLote(len(filas))
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
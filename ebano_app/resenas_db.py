@@ -0,0 +1,168 @@
+"""
+resenas_db.py
+Reseñas de un producto para la página de detalle (y listado de admin).
+
+- Las reseñas se paginan por cursor (fecha DESC, id DESC), ver paginacion.py:
+  cada página es un recorrido del índice idx_resenas_producto_fecha.
+- El resumen de calificaciones (promedio, total, histograma 1-5) se calcula en
+  una sola consulta y se guarda por producto en memoria, igual que la primera
+  página (la que ve casi todo el mundo).
+- crear/editar/borrar reseña llaman a invalidar_resenas(id_producto).
+  Otros cambios (p. ej. un usuario cambia su nombre) se reflejan al expirar el TTL.
+"""
+
+import os
+from decimal import Decimal, ROUND_HALF_UP
+
+from cache_memoria import CacheTTL
+from paginacion import ADMIN_PAGE_SIZE, OrdenKeyset, paginar
+
+RESENAS_PAGE_SIZE = int(os.getenv("RESENAS_PAGE_SIZE", 10))
+RESENAS_CACHE_TTL = int(os.getenv("RESENAS_CACHE_TTL", 60))
+RESENAS_CACHE_MAX = int(os.getenv("RESENAS_CACHE_MAX", 1024))
+
+ORDEN_RESENAS = OrdenKeyset([("r.fecha", "fecha", "TIMESTAMP"), ("r.id", "id", "INT")], descendente=True)
+
+# "Mis reseñas" (ruta /resenas de app.py)
+SQL_RESENAS_USUARIO = """
+    SELECT r.id, r.id_producto, r.comentario, r.calificacion, r.fecha, p.nombre
+    FROM resenas r
+    JOIN productos p ON p.id = r.id_producto
+    WHERE r.id_usuario = :uid
+    ORDER BY r.fecha DESC;
+"""
+
+_resumen_cache = CacheTTL("resenas_resumen", max_items=RESENAS_CACHE_MAX, ttl=RESENAS_CACHE_TTL)
+_primera_pagina_cache = CacheTTL("resenas_primera_pagina", max_items=RESENAS_CACHE_MAX, ttl=RESENAS_CACHE_TTL)
+
+
+def _fila_a_resena(r):
+    return {
+        "id": r[0],
+        "comentario": r[1],
+        "nombre_completo": r[2],
+        "fecha": r[3],
+        "calificacion": r[4],
+    }
+
+
+def resumen_resenas(conn, id_producto):
+    """
+    {"total", "promedio", "histograma": {5: n, 4: n, ..., 1: n}} de un producto.
+    Una sola consulta; el resultado se cachea por producto.
+    """
+    resumen = _resumen_cache.get(id_producto)
+    if resumen is not None:
+        return resumen
+
+    fila = conn.run("""
+        SELECT COUNT(*),
+               AVG(calificacion),
+               COUNT(*) FILTER (WHERE calificacion = 1),
+               COUNT(*) FILTER (WHERE calificacion = 2),
+               COUNT(*) FILTER (WHERE calificacion = 3),
+               COUNT(*) FILTER (WHERE calificacion = 4),
+               COUNT(*) FILTER (WHERE calificacion = 5)
+        FROM resenas
+        WHERE id_producto = :pid;
+    """, pid=id_producto)[0]
+
+    total = fila[0]
+    promedio = None
+    if fila[1] is not None:
+        promedio = Decimal(str(fila[1])).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
+    resumen = {
+        "total": total,
+        "promedio": promedio,
+        "histograma": {estrellas: fila[1 + estrellas] for estrellas in range(5, 0, -1)},
+    }
+    _resumen_cache.set(id_producto, resumen)
+    return resumen
+
+
+def pagina_resenas(conn, id_producto, cursor=None, limite=RESENAS_PAGE_SIZE):
+    """Una página de reseñas (más recientes primero). La primera se sirve de la caché."""
+    if not cursor:
+        pagina = _primera_pagina_cache.get(id_producto)
+        if pagina is not None:
+            return pagina
+
+    pagina = paginar(
+        conn,
+        """
+        SELECT r.id, r.comentario, u.nombre_completo, r.fecha, r.calificacion
+        FROM resenas r
+        JOIN usuarios u ON r.id_usuario = u.id
+        """,
+        ["r.id_producto = :pid"], {"pid": id_producto},
+        ORDEN_RESENAS, limite, cursor, fila_a_dict=_fila_a_resena,
+    )
+    if not cursor:
+        _primera_pagina_cache.set(id_producto, pagina)
+    return pagina
+
+
+def invalidar_resenas(id_producto):
+    """Descarta el resumen y la primera página cacheados de un producto."""
+    _resumen_cache.invalidate(id_producto)
+    _primera_pagina_cache.invalidate(id_producto)
+
+
+# ---------------------------------------------------------
+# ALTA DE RESEÑAS (crear_resena)
+# ---------------------------------------------------------
+class ResenaYaExiste(Exception):
+    """El usuario ya tiene una reseña de ese producto. No se escribió nada."""
+
+
+def insertar_resena(conn, id_usuario, id_producto, comentario, calificacion):
+    """
+    Inserta la reseña y devuelve su id (sin commit).
+
+    Una sola sentencia (INSERT ... ON CONFLICT DO NOTHING sobre
+    uq_resenas_usuario_producto, migración 004): dos envíos simultáneos no
+    dan un error 500; uno crea la reseña y el otro recibe ResenaYaExiste.
+    """
+    res = conn.run("""
+        INSERT INTO resenas (id_usuario, id_producto, comentario, calificacion)
+        VALUES (:uid, :pid, :comentario, :calificacion)
+        ON CONFLICT (id_usuario, id_producto) DO NOTHING
+        RETURNING id;
+    """, uid=id_usuario, pid=id_producto, comentario=comentario, calificacion=calificacion)
+    if not res:
+        raise ResenaYaExiste(id_producto)
+    return res[0][0]
+
+
+# ---------------------------------------------------------
+# LISTADO DE ADMIN (gestionar_resenas)
+# ---------------------------------------------------------
+# Mismo orden que ORDEN_RESENAS, sin filtrar por producto: recorre
+# idx_resenas_fecha_id (migración 009) desde el cursor
+SELECT_RESENAS_ADMIN = """
+    SELECT r.id, r.id_usuario, u.nombre_completo, u.correo, r.id_producto,
+           p.nombre, r.comentario, r.calificacion, r.fecha
+    FROM resenas r
+    JOIN usuarios u ON r.id_usuario = u.id
+    JOIN productos p ON r.id_producto = p.id
+"""
+
+
+def _fila_a_resena_admin(r):
+    return {
+        "id": r[0],
+        "id_usuario": r[1],
+        "usuario_nombre": r[2],
+        "usuario_correo": r[3],
+        "id_producto": r[4],
+        "producto_nombre": r[5],
+        "comentario": r[6],
+        "calificacion": r[7],
+        "fecha": r[8],
+    }
+
+
+def pagina_resenas_admin(conn, cursor=None, limite=ADMIN_PAGE_SIZE):
+    """Una página de todas las reseñas, más recientes primero."""
+    return paginar(conn, SELECT_RESENAS_ADMIN, [], {}, ORDEN_RESENAS, limite, cursor,
+                   fila_a_dict=_fila_a_resena_admin)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+reservas.py
+Reservas temporales de stock para los carritos (migración 006).
+
+- Al cambiar un carrito se reservan sus unidades durante RESERVA_MINUTOS.
+  productos.reservado lleva la suma de las reservas de cada producto; a otro
+  carrito solo se le reserva stock - reservado.
+- Una sola sentencia por cambio del carrito, sin importar cuántas líneas
+  tenga: bloquea las reservas del carrito y las filas de los productos que
+  cambian (en orden de id), ajusta reservado y guarda las reservas. Los
+  bloqueos duran lo que dura esa sentencia, así que cientos de carritos
+  reservando el mismo producto solo se turnan durante microsegundos.
+- Antes, un advisory lock por carrito (bloquear_carrito) pone en fila los
+  cambios del MISMO carrito (doble clic, dos pestañas). Sin él, si el
+  carrito aún no tiene reservas no hay filas que FOR UPDATE pueda bloquear:
+  las dos sentencias parten de "nada reservado" y la segunda volvería a
+  sumar su cantidad a productos.reservado, aunque reservas_stock la guarde
+  una sola vez (unidades que el barrido nunca devolvería).
+- Si no hay stock para todo lo pedido se reserva lo disponible y el carrito
+  se recorta a esa cantidad.
+- crear_pedido() convierte las reservas del carrito en el pedido.
+- Un hilo por worker devuelve las reservas vencidas en lotes de
+  RESERVAS_LOTE (FOR UPDATE SKIP LOCKED: varios workers barren sin esperarse).
+
+Orden de bloqueo en todo el código: carrito (advisory lock), reservas_stock
+y después productos.
+
+Uso:
+    recortes = reservar_carrito(conn, id_carrito, carrito)   # recorta `carrito` si hace falta
+    liberar_carrito(conn, id_carrito)
+
+    python reservas.py barrer      # barrido manual (cron)
+    python reservas.py estado
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bd_config import db_connection, get_connection
+
+RESERVA_MINUTOS = float(os.getenv("RESERVA_MINUTOS", 15))
+RESERVAS_BARRIDO_SEGUNDOS = int(os.getenv("RESERVAS_BARRIDO_SEGUNDOS", 30))
+RESERVAS_LOTE = int(os.getenv("RESERVAS_LOTE", 500))
+
+# Primera clave de pg_advisory_xact_lock(clase, hashtext(id_carrito))
+_LOCK_CLASE = 471100018
+
+
+class Recorte:
+    """Línea del carrito que no se pudo reservar completa."""
+
+    def __init__(self, id_producto, nombre, pedida, reservada):
+        self.id_producto = id_producto
+        self.nombre = nombre
+        self.pedida = pedida
+        self.reservada = reservada
+
+    def __repr__(self):
+        return f"Recorte({self.id_producto}, {self.nombre!r}, {self.pedida} -> {self.reservada})"
+
+
+def bloquear_carrito(conn, id_carrito):
+    """
+    Pone en fila las transacciones que tocan las reservas de un carrito
+    (hasta su commit o rollback). Otros carritos no esperan.
+    """
+    conn.run("SELECT pg_advisory_xact_lock(:clase, hashtext(:cid));", clase=_LOCK_CLASE, cid=id_carrito)
+
+
+def _sincronizar(conn, id_carrito, items):
+    """
+    Deja las reservas de `id_carrito` iguales a `items` [(id_producto, cantidad)]
+    en lo que alcance el stock. Devuelve {id_producto: (nombre, pedida, reservada)}
+    de las líneas que cambiaron (las demás solo renuevan su vencimiento).
+    """
+    ids = [pid for pid, _ in items]
+    cantidades = [qty for _, qty in items]
+    bloquear_carrito(conn, id_carrito)
+    filas = conn.run("""
+        WITH deseado AS (
+            SELECT *
+            FROM unnest(CAST(:ids AS INT[]), CAST(:cantidades AS INT[])) AS d(id_producto, cantidad)
+        ),
+        actual AS (
+            SELECT id_producto, cantidad
+            FROM reservas_stock
+            WHERE id_carrito = :cid
+            ORDER BY id_producto
+            FOR UPDATE
+        ),
+        cambios AS (
+            SELECT COALESCE(d.id_producto, a.id_producto) AS id_producto,
+                   COALESCE(d.cantidad, 0) AS deseado,
+                   COALESCE(a.cantidad, 0) AS actual
+            FROM deseado d
+            FULL JOIN actual a ON a.id_producto = d.id_producto
+        ),
+        bloqueados AS (
+            SELECT p.id, p.nombre, p.stock, p.reservado
+            FROM productos p
+            JOIN cambios c ON c.id_producto = p.id
+            WHERE c.deseado <> c.actual
+            ORDER BY p.id
+            FOR UPDATE OF p
+        ),
+        nuevas AS (
+            SELECT c.id_producto, b.nombre, c.deseado, c.actual,
+                   CASE WHEN b.stock IS NULL THEN c.deseado   -- stock NULL = ilimitado
+                        ELSE LEAST(c.deseado, GREATEST(b.stock - b.reservado + c.actual, 0))
+                   END AS reservada
+            FROM cambios c
+            JOIN bloqueados b ON b.id = c.id_producto
+        ),
+        ajuste AS (
+            UPDATE productos p
+            SET reservado = GREATEST(p.reservado - n.actual + n.reservada, 0)
+            FROM nuevas n
+            WHERE p.id = n.id_producto AND n.reservada <> n.actual
+            RETURNING p.id
+        ),
+        borradas AS (
+            DELETE FROM reservas_stock r
+            USING nuevas n
+            WHERE r.id_carrito = :cid AND r.id_producto = n.id_producto AND n.reservada = 0
+            RETURNING r.id_producto
+        ),
+        guardadas AS (
+            INSERT INTO reservas_stock (id_carrito, id_producto, cantidad, expira_en)
+            SELECT :cid, n.id_producto, n.reservada, :expira
+            FROM nuevas n
+            WHERE n.reservada > 0
+            ON CONFLICT (id_carrito, id_producto)
+            DO UPDATE SET cantidad = EXCLUDED.cantidad, expira_en = EXCLUDED.expira_en
+            RETURNING id_producto
+        ),
+        renovadas AS (
+            UPDATE reservas_stock r
+            SET expira_en = :expira
+            FROM cambios c
+            WHERE r.id_carrito = :cid AND r.id_producto = c.id_producto AND c.deseado = c.actual
+            RETURNING r.id_producto
+        )
+        SELECT id_producto, nombre, deseado, reservada FROM nuevas;
+    """, ids=ids, cantidades=cantidades, cid=id_carrito,
+        expira=datetime.now() + timedelta(minutes=RESERVA_MINUTOS))
+    return {r[0]: (r[1], r[2], r[3]) for r in filas}
+
+
+def reservar_carrito(conn, id_carrito, carrito):
+    """
+    Reserva las unidades del Carrito `carrito` (y libera las que ya no tiene).
+    Las líneas sin stock suficiente se recortan en `carrito` a lo reservado
+    (0 las quita). Confirma la transacción y devuelve la lista de Recorte.
+    """
+    _barrendero.asegurar()
+    try:
+        cambios = _sincronizar(conn, id_carrito, carrito.items())
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+
+    recortes = []
+    for pid, (nombre, pedida, reservada) in cambios.items():
+        if reservada < pedida:
+            carrito.fijar(pid, reservada)
+            recortes.append(Recorte(pid, nombre, pedida, reservada))
+    return recortes
+
+
+def liberar_carrito(conn, id_carrito):
+    """Devuelve todas las reservas del carrito (vaciar carrito, cerrar sesión)."""
+    try:
+        _sincronizar(conn, id_carrito, [])
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+
+
+# ---------------------------------------------------------
+# BARRIDO DE RESERVAS VENCIDAS
+# ---------------------------------------------------------
+def barrer_lote(conn, lote=RESERVAS_LOTE, ahora=None):
+    """Libera hasta `lote` reservas vencidas en una transacción. Devuelve (reservas, unidades)."""
+    try:
+        res = conn.run("""
+            WITH vencidas AS (
+                DELETE FROM reservas_stock r
+                USING (
+                    SELECT id_carrito, id_producto
+                    FROM reservas_stock
+                    WHERE expira_en < :ahora
+                    ORDER BY expira_en
+                    LIMIT CAST(:lote AS INT)
+                    FOR UPDATE SKIP LOCKED
+                ) v
+                WHERE r.id_carrito = v.id_carrito AND r.id_producto = v.id_producto
+                RETURNING r.id_producto, r.cantidad
+            ),
+            por_producto AS (
+                SELECT id_producto, SUM(cantidad) AS cantidad
+                FROM vencidas
+                GROUP BY id_producto
+            ),
+            bloqueados AS (
+                SELECT p.id
+                FROM productos p
+                JOIN por_producto x ON x.id_producto = p.id
+                ORDER BY p.id
+                FOR UPDATE OF p
+            ),
+            liberados AS (
+                UPDATE productos p
+                SET reservado = GREATEST(p.reservado - x.cantidad, 0)
+                FROM por_producto x
+                JOIN bloqueados b ON b.id = x.id_producto
+                WHERE p.id = x.id_producto
+                RETURNING p.id
+            )
+            SELECT COUNT(*), COALESCE(SUM(cantidad), 0) FROM vencidas;
+        """, ahora=ahora or datetime.now(), lote=lote)
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    return int(res[0][0]), int(res[0][1])
+
+
+def barrer_vencidas(conn, lote=RESERVAS_LOTE):
+    """Libera todas las reservas vencidas, lote a lote. Devuelve (reservas, unidades)."""
+    ahora = datetime.now()
+    total_reservas = total_unidades = 0
+    while True:
+        reservas, unidades = barrer_lote(conn, lote, ahora)
+        total_reservas += reservas
+        total_unidades += unidades
+        if reservas < lote:
+            return total_reservas, total_unidades
+
+
+class Barrendero:
+    """Hilo del worker que barre las reservas vencidas cada RESERVAS_BARRIDO_SEGUNDOS."""
+
+    def __init__(self, intervalo=RESERVAS_BARRIDO_SEGUNDOS):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def barrer(self):
+        with db_connection() as conn:
+            reservas, unidades = barrer_vencidas(conn)
+        if reservas:
+            print(f"🧹 {reservas} reservas vencidas liberadas ({unidades} unidades)")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.barrer()
+            except Exception as e:
+                print(f"❌ Error en el barrido de reservas: {e}")
+
+    def asegurar(self):
+        """Arranca el hilo del worker (una vez por proceso, también tras un fork)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="reservas-barrido", daemon=True)
+            self._thread.start()
+
+
+_barrendero = Barrendero()
+
+
+def main(args):
+    orden = args[0] if args else "barrer"
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        return 1
+    try:
+        if orden == "barrer":
+            reservas, unidades = barrer_vencidas(conn)
+            print(f"✅ {reservas} reservas vencidas liberadas ({unidades} unidades)")
+        elif orden == "estado":
+            vivas, vencidas, unidades = conn.run("""
+                SELECT COUNT(*) FILTER (WHERE expira_en >= :ahora),
+                       COUNT(*) FILTER (WHERE expira_en < :ahora),
+                       COALESCE(SUM(cantidad), 0)
+                FROM reservas_stock;
+            """, ahora=datetime.now())[0]
+            print(f"Reservas vivas: {vivas} | vencidas sin barrer: {vencidas} | unidades: {unidades}")
+        else:
+            print(__doc__)
+            return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,332 @@
+"""
+tasa_cambio.py
+Tasa COP -> USD (currencyapi.com v3) compartida entre workers de gunicorn.
+
+- La tasa vive en un archivo JSON local (EXCHANGE_CACHE_FILE) que leen todos
+  los workers; cada worker solo relee el archivo cuando cambia su mtime.
+- Un hilo en segundo plano por worker refresca la tasa cuando caduca, pero
+  solo uno a la vez llama a la API (flock sobre un archivo .lock).
+- Stale-while-revalidate: las peticiones nunca esperan la llamada HTTP;
+  devuelven la última tasa conocida (o la de fallback) y despiertan al hilo.
+- Caché negativa: si la API falla no se reintenta hasta EXCHANGE_RETRY_SECONDS.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
+
+import requests
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: cada proceso refresca por su cuenta
+    fcntl = None
+
+load_dotenv()
+
+# ------------------------------------------------------------
+# CONFIGURACIÓN DE TASA DE CAMBIO (COP -> USD)
+# ------------------------------------------------------------
+EXCHANGE_TTL_SECONDS = int(os.getenv("EXCHANGE_TTL_SECONDS", 43200))  # 12 horas
+EXCHANGE_API_URL = os.getenv("EXCHANGE_API_URL", "https://api.currencyapi.com/v3/latest")
+CURRENCY_API_KEY = os.getenv("CURRENCY_API_KEY", "")
+EXCHANGE_REQUEST_TIMEOUT = int(os.getenv("EXCHANGE_REQUEST_TIMEOUT", 8))
+EXCHANGE_RETRY_SECONDS = int(os.getenv("EXCHANGE_RETRY_SECONDS", 300))  # espera tras un fallo
+EXCHANGE_CACHE_FILE = os.getenv(
+    "EXCHANGE_CACHE_FILE",
+    os.path.join(tempfile.gettempdir(), "ebano_tasa_cambio.json")
+)
+
+# Tasa de fallback (si la API falla): 1 COP = 0.00026 USD (~3,846 COP = 1 USD)
+FALLBACK_COP_TO_USD = Decimal("0.00026")
+
+# Cada cuánto (s) un worker comprueba si otro worker actualizó el archivo
+_STAT_INTERVAL = 1.0
+
+
+def _inverse(cop_to_usd):
+    return (Decimal('1') / cop_to_usd).quantize(Decimal('0.01'))
+
+
+FALLBACK_USD_TO_COP = _inverse(FALLBACK_COP_TO_USD)
+
+
+def _fetch_rate():
+    """
+    Consulta currencyapi.com v3. Respuesta esperada:
+    {
+      "meta": {"last_updated_at": "2025-11-14T23:59:59Z"},
+      "data": {
+        "USD": {"code": "USD", "value": 0.0002662073}
+      }
+    }
+    Lanza una excepción si la respuesta no es válida.
+    """
+    params = {
+        "apikey": CURRENCY_API_KEY,
+        "base_currency": "COP",
+        "currencies": "USD"
+    }
+    print(f"🔄 Obteniendo tasa COP->USD desde {EXCHANGE_API_URL}...")
+    resp = requests.get(EXCHANGE_API_URL, params=params, timeout=EXCHANGE_REQUEST_TIMEOUT)
+    resp.raise_for_status()
+    data = resp.json()
+
+    # Validar estructura de respuesta de currencyapi.com
+    if "data" not in data or "USD" not in data["data"]:
+        raise ValueError("Respuesta inválida de currencyapi.com: falta 'data.USD'")
+
+    cop_to_usd = Decimal(str(data["data"]["USD"]["value"]))
+    if cop_to_usd <= 0:
+        raise ValueError("Tasa COP->USD inválida (cero o negativa)")
+    return cop_to_usd
+
+
+@contextmanager
+def _exclusive(lock_path):
+    """Intenta tomar el lock entre procesos sin bloquear. Cede True si se obtuvo."""
+    if fcntl is None:
+        yield True
+        return
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class TasaCompartida:
+    """Registro de la tasa en disco + hilo refrescador del worker."""
+
+    def __init__(self, path=EXCHANGE_CACHE_FILE):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._record = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._read_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    # ---------------- lectura / escritura ----------------
+    def read(self, force=False):
+        """Registro actual (dict) o None. Relee el archivo solo si cambió."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < _STAT_INTERVAL:
+            return self._record
+        with self._read_lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return self._record
+            if force or mtime != self._mtime:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        raw = json.load(f)
+                    raw["cop_to_usd"] = Decimal(raw["cop_to_usd"])
+                    raw["usd_to_cop"] = Decimal(raw["usd_to_cop"])
+                    self._record, self._mtime = raw, mtime
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"⚠️ Caché de tasa ilegible ({self.path}): {e}")
+            return self._record
+
+    def _write(self, record):
+        data = dict(record, cop_to_usd=str(record["cop_to_usd"]), usd_to_cop=str(record["usd_to_cop"]))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".tasa_")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)  # atómico: los lectores nunca ven un archivo a medias
+        self.read(force=True)
+
+    # ---------------- refresco ----------------
+    def needs_refresh(self, record, now=None):
+        if record is None:
+            return True
+        now = time.time() if now is None else now
+        if now - record["fetched_at"] < EXCHANGE_TTL_SECONDS:
+            return False
+        # Caché negativa: no martillar la API mientras está caída
+        error_at = record.get("error_at")
+        return not error_at or now - error_at >= EXCHANGE_RETRY_SECONDS
+
+    def refresh(self):
+        """Refresca la tasa si caducó y ningún otro worker lo está haciendo."""
+        if not self.needs_refresh(self.read()):
+            return
+        with _exclusive(self.lock_path) as acquired:
+            if not acquired:
+                return
+            previous = self.read(force=True)
+            if not self.needs_refresh(previous):
+                return  # otro worker acaba de refrescar
+
+            now = time.time()
+            if not CURRENCY_API_KEY:
+                print("⚠️ CURRENCY_API_KEY no configurada en .env, usando tasa de fallback")
+                self._write({"cop_to_usd": FALLBACK_COP_TO_USD, "usd_to_cop": FALLBACK_USD_TO_COP,
+                             "fetched_at": now, "source": "fallback"})
+                return
+            try:
+                cop_to_usd = _fetch_rate()
+                usd_to_cop = _inverse(cop_to_usd)
+                self._write({"cop_to_usd": cop_to_usd, "usd_to_cop": usd_to_cop,
+                             "fetched_at": now, "source": "currencyapi.com"})
+                print(f"✅ Tasa actualizada: 1 COP = {cop_to_usd} USD | 1 USD = {usd_to_cop} COP")
+            except Exception as e:
+                # Conservar la última tasa buena; si no hay, usar la de fallback
+                record = dict(previous) if previous else {
+                    "cop_to_usd": FALLBACK_COP_TO_USD, "usd_to_cop": FALLBACK_USD_TO_COP,
+                    "fetched_at": 0.0, "source": "fallback"}
+                error = str(e).replace(CURRENCY_API_KEY, "***")  # la URL del error incluye la apikey
+                record.update(error_at=now, error=error)
+                self._write(record)
+                print(f"❌ Error al obtener tasa: {error}")
+                print(f"⚠️ Usando tasa {record['source']}: 1 COP = {record['cop_to_usd']} USD "
+                      f"(reintento en {EXCHANGE_RETRY_SECONDS}s)")
+
+    def _loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Error en el refresco de tasa: {e}")
+            self._wake.wait(timeout=min(60, EXCHANGE_TTL_SECONDS))
+            self._wake.clear()
+
+    def ensure_refresher(self):
+        """Arranca el hilo del worker (una vez por proceso, también tras un fork)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._read_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._loop, name="tasa-cambio", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+
+_store = TasaCompartida()
+
+
+def get_cop_to_usd_rate():
+    """
+    Devuelve (cop_to_usd, usd_to_cop) como Decimal sin bloquear nunca en HTTP.
+    Si la tasa caducó se devuelve la anterior y se pide un refresco en segundo plano;
+    si aún no hay ninguna se devuelve la tasa de fallback.
+    """
+    record = _registro_actual()
+    if record is None:
+        return FALLBACK_COP_TO_USD, FALLBACK_USD_TO_COP
+    return record["cop_to_usd"], record["usd_to_cop"]
+
+
+def _registro_actual():
+    """Registro de la tasa en uso (o None); despierta al hilo si caducó."""
+    _store.ensure_refresher()
+    record = _store.read()
+    if _store.needs_refresh(record):
+        _store.wake()
+    return record
+
+
+def rate_info():
+    """Detalle de la tasa en uso (para /api/rate)."""
+    cop_to_usd, usd_to_cop = get_cop_to_usd_rate()
+    record = _store.read() or {}
+    fetched_at = record.get("fetched_at", 0.0)
+    return {
+        "cop_to_usd": cop_to_usd,
+        "usd_to_cop": usd_to_cop,
+        "cached_at": fetched_at,
+        "cache_ttl_seconds": EXCHANGE_TTL_SECONDS,
+        "stale": time.time() - fetched_at >= EXCHANGE_TTL_SECONDS,
+        "source": record.get("source", "fallback"),
+        "last_error": record.get("error"),
+        "last_error_at": record.get("error_at"),
+    }
+
+
+# ------------------------------------------------------------
+# CONVERSIÓN POR LOTES (plantillas)
+# ------------------------------------------------------------
+# Precio COP -> "$10.95 USD" ya formateado, válido mientras no cambie la tasa.
+# La clave de versión es (tasa, fetched_at): al refrescarse la tasa se descarta todo.
+USD_FORMAT_CACHE_MAX = int(os.getenv("USD_FORMAT_CACHE_MAX", 20000))
+_usd_formatted = (None, {})
+
+
+def _to_decimal(value):
+    if isinstance(value, Decimal):
+        return value
+    if value is None:
+        return Decimal(0)
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    return Decimal(str(value).strip().replace(",", ""))
+
+
+def _format_one(value, cop_to_usd):
+    usd = (_to_decimal(value) * cop_to_usd).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return "${:,.2f} USD".format(float(usd))
+
+
+def format_usd_many(values):
+    """
+    Convierte una secuencia de precios COP a textos USD en una sola pasada:
+    una lectura de la tasa para todo el lote y caché por (precio, versión de tasa).
+    """
+    global _usd_formatted
+    # Tasa y versión salen del mismo registro: un refresco a mitad no las mezcla
+    record = _registro_actual()
+    if record is None:
+        cop_to_usd, version = FALLBACK_COP_TO_USD, (FALLBACK_COP_TO_USD, 0.0)
+    else:
+        cop_to_usd = record["cop_to_usd"]
+        version = (cop_to_usd, record["fetched_at"])
+
+    cached_version, cache = _usd_formatted
+    if cached_version != version:
+        cache = {}
+        _usd_formatted = (version, cache)
+
+    out = []
+    for value in values:
+        text = cache.get(value)
+        if text is None:
+            text = _format_one(value, cop_to_usd)
+            if len(cache) < USD_FORMAT_CACHE_MAX:
+                cache[value] = text
+        out.append(text)
+    return out
+
+
+def limpiar_cache():
+    """Descarta los textos USD ya formateados (la próxima llamada los recalcula)."""
+    global _usd_formatted
+    _usd_formatted = (None, {})
+
+
+def annotate_usd(rows, field="precio", target="precio_usd"):
+    """Añade a cada dict de `rows` el texto USD de rows[i][field] (en un solo lote)."""
+    for row, text in zip(rows, format_usd_many([row[field] for row in rows])):
+        row[target] = text
+    return rows
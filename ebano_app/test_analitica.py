@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+test_analitica.py
+Comprueba los resúmenes diarios de ventas (migración 008, analitica.py):
+tras checkouts, un pedido con fecha pasada y una cancelación, refrescar()
+deja los tres resúmenes iguales a agregar pedidos/detalle_pedidos a mano, y
+reconstruir() llega al mismo resultado. También mide resumen_ventas().
+"""
+
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from bd_config import get_connection
+from benchmarks import (
+    crear_usuario_bench, borrar_usuario_bench, crear_productos_bench, borrar_productos_bench,
+    exigir_bd_local, print_section
+)
+from comprobaciones import comprobar, terminar
+from pedidos_db import crear_pedido
+from analitica import refrescar, reconstruir, resumen_ventas
+
+
+def _desde_resumenes(conn, dias):
+    """Filas de los tres resúmenes para `dias`."""
+    r = (
+        set(tuple(f) for f in conn.run("""
+            SELECT dia, id_producto, pedidos, unidades, ingresos FROM ventas_dia_producto
+            WHERE dia = ANY(CAST(:dias AS DATE[]));
+        """, dias=dias)),
+        set(tuple(f) for f in conn.run("""
+            SELECT dia, estado_us, pedidos, unidades, ingresos FROM ventas_dia_estado_us
+            WHERE dia = ANY(CAST(:dias AS DATE[]));
+        """, dias=dias)),
+        set(tuple(f) for f in conn.run("""
+            SELECT dia, estado, pedidos, ingresos FROM ventas_dia_estado_pedido
+            WHERE dia = ANY(CAST(:dias AS DATE[]));
+        """, dias=dias)),
+    )
+    conn.rollback()
+    return r
+
+
+def _desde_pedidos(conn, dias):
+    """Lo mismo, agregando las tablas de pedidos directamente."""
+    r = (
+        set(tuple(f) for f in conn.run("""
+            SELECT CAST(p.fecha_pedido AS DATE), dp.id_producto, COUNT(DISTINCT p.id),
+                   SUM(dp.cantidad), SUM(dp.subtotal)
+            FROM pedidos p JOIN detalle_pedidos dp ON dp.id_pedido = p.id
+            WHERE CAST(p.fecha_pedido AS DATE) = ANY(CAST(:dias AS DATE[]))
+            AND p.estado IS DISTINCT FROM 'Cancelado'
+            GROUP BY 1, 2;
+        """, dias=dias)),
+        set(tuple(f) for f in conn.run("""
+            SELECT CAST(p.fecha_pedido AS DATE), COALESCE(NULLIF(u.estado, ''), '—'), COUNT(*),
+                   COALESCE(SUM(l.unidades), 0), SUM(p.total)
+            FROM pedidos p
+            LEFT JOIN usuarios u ON u.id = p.id_usuario
+            LEFT JOIN (
+                SELECT id_pedido, SUM(cantidad) AS unidades FROM detalle_pedidos GROUP BY id_pedido
+            ) l ON l.id_pedido = p.id
+            WHERE CAST(p.fecha_pedido AS DATE) = ANY(CAST(:dias AS DATE[]))
+            AND p.estado IS DISTINCT FROM 'Cancelado'
+            GROUP BY 1, 2;
+        """, dias=dias)),
+        set(tuple(f) for f in conn.run("""
+            SELECT CAST(fecha_pedido AS DATE), COALESCE(estado, 'Pendiente'), COUNT(*), SUM(total)
+            FROM pedidos
+            WHERE CAST(fecha_pedido AS DATE) = ANY(CAST(:dias AS DATE[]))
+            GROUP BY 1, 2;
+        """, dias=dias)),
+    )
+    conn.rollback()
+    return r
+
+
+def _cuadran(conn, dias, nombre):
+    resumenes, pedidos = _desde_resumenes(conn, dias), _desde_pedidos(conn, dias)
+    for tabla, r, p in zip(("producto", "estado_us", "estado_pedido"), resumenes, pedidos):
+        comprobar(f"{nombre}: ventas_dia_{tabla} cuadra", r == p, (r ^ p))
+
+
+def probar_incremental(conn, id_usuario, ids):
+    print_section("REFRESCO INCREMENTAL")
+    hoy = date.today()
+    hace_10 = hoy - timedelta(days=10)
+
+    pedidos = [
+        crear_pedido(conn, id_usuario, [{"id": ids[0], "nombre": "a", "cantidad": 2}]),
+        crear_pedido(conn, id_usuario, [{"id": ids[0], "nombre": "a", "cantidad": 1},
+                                        {"id": ids[1], "nombre": "b", "cantidad": 3}]),
+    ]
+    # Un pedido "antiguo" insertado a mano (como restaurar_datos.py)
+    viejo = conn.run("""
+        INSERT INTO pedidos (id_usuario, fecha_pedido, total, estado)
+        VALUES (:uid, :fecha, 5000, 'Entregado') RETURNING id;
+    """, uid=id_usuario, fecha=datetime.combine(hace_10, datetime.min.time()) + timedelta(hours=15))[0][0]
+    conn.run("INSERT INTO detalle_pedidos (id_pedido, id_producto, cantidad, subtotal) VALUES (:p, :id, 5, 5000);",
+             p=viejo, id=ids[1])
+    conn.commit()
+
+    refrescar(conn)
+    _cuadran(conn, [hoy, hace_10], "tras los checkouts")
+
+    conn.run("UPDATE pedidos SET estado = 'Cancelado' WHERE id = :id;", id=pedidos[0])
+    conn.commit()
+    refrescar(conn)
+    _cuadran(conn, [hoy, hace_10], "tras cancelar un pedido")
+    return [hoy, hace_10]
+
+
+def probar_reconstruir(conn, dias):
+    print_section("RECONSTRUCCIÓN COMPLETA")
+    antes = _desde_resumenes(conn, dias)
+    inicio = time.perf_counter()
+    n = reconstruir(conn)
+    print(f"   {n} días reconstruidos en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+    comprobar("reconstruir da lo mismo que el refresco incremental", _desde_resumenes(conn, dias) == antes)
+
+
+def probar_lectura(conn, dias):
+    print_section("LECTURA DEL PANEL")
+    inicio = time.perf_counter()
+    datos = resumen_ventas(conn, min(dias), max(dias))
+    ms = (time.perf_counter() - inicio) * 1000
+    print(f"   resumen_ventas() en {ms:.1f} ms")
+    comprobar("el panel incluye los estados de pedido", {"Cancelado"} <= {e["estado"] for e in datos["por_estado"]},
+              datos["por_estado"])
+    comprobar("el panel incluye el estado del cliente", any(e["estado_us"] == "CA" for e in datos["por_estado_us"]))
+
+
+def main():
+    exigir_bd_local()
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        sys.exit(1)
+
+    id_usuario = crear_usuario_bench(conn)
+    ids = crear_productos_bench(conn, 2, stock=100)
+    try:
+        dias = probar_incremental(conn, id_usuario, ids)
+        probar_reconstruir(conn, dias)
+        probar_lectura(conn, dias)
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        borrar_usuario_bench(conn, id_usuario)
+        borrar_productos_bench(conn, ids)
+        # Los borrados anotaron sus días: los resúmenes vuelven a cuadrar
+        refrescar(conn)
+        conn.close()
+
+    terminar("Los resúmenes de ventas cuadran con los pedidos", "¿Falta la migración 008?")
+
+
+if __name__ == "__main__":
+    main()
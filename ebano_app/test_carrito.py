@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+test_carrito.py
+Comprueba el Carrito de carrito_store.py: orden estable de las líneas,
+fusión de pedidos anteriores, cambios de cantidad, ida y vuelta por el
+almacén y que fusionar un pedido grande cueste O(líneas).
+
+No necesita base de datos (usa el almacén en memoria).
+"""
+
+import time
+
+from benchmarks import print_section
+from comprobaciones import comprobar, terminar
+from carrito_store import Carrito, MemoriaCarritoStore
+
+
+def probar_operaciones():
+    print_section("OPERACIONES")
+    c = Carrito([(3, 1), (5, 2)])
+    c.agregar(3, 2)
+    comprobar("agregar suma sin mover la línea", c.items() == [(3, 3), (5, 2)], c)
+
+    c.agregar(9, 1)
+    comprobar("un producto nuevo va al final", c.items() == [(3, 3), (5, 2), (9, 1)], c)
+
+    c.agregar(5, 0)
+    c.agregar(5, -4)
+    comprobar("agregar ignora cantidades <= 0", c.cantidad(5) == 2, c)
+
+    c.fusionar([(9, 2), (11, 1), (3, 1), (11, 4)])
+    comprobar("fusionar acumula y respeta el orden",
+              c.items() == [(3, 4), (5, 2), (9, 3), (11, 5)], c)
+
+    c.fijar(5, 7)
+    comprobar("fijar cambia la cantidad", c.cantidad(5) == 7, c)
+    c.fijar(9, 0)
+    comprobar("fijar a 0 quita la línea", 9 not in c and len(c) == 3, c)
+    c.fijar(42, 3)
+    comprobar("fijar no crea líneas", 42 not in c, c)
+
+    c.quitar(3)
+    c.quitar(3)
+    comprobar("quitar es idempotente", c.items() == [(5, 7), (11, 5)], c)
+
+    comprobar("iterar da (id, cantidad)", list(c) == c.items(), c)
+    comprobar("carrito vacío es falso", not Carrito() and bool(c))
+
+
+def probar_almacen():
+    print_section("IDA Y VUELTA POR EL ALMACÉN")
+    store = MemoriaCarritoStore()
+    c = Carrito([(7, 1), (2, 3), (5, 1)])
+    store.set("abc", c.items())
+    leido = Carrito(store.get("abc"))
+    comprobar("se conserva el orden de visualización", leido == c, leido)
+
+    store.set("viejo", [(1, 1), (2, 1), (1, 2)])
+    comprobar("líneas repetidas de carritos antiguos se agrupan",
+              Carrito(store.get("viejo")).items() == [(1, 3), (2, 1)])
+
+
+def _medir_fusion(lineas, repeticiones=20):
+    pedido = [(pid, 1) for pid in range(lineas)]
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        c = Carrito(pedido)       # carrito con las mismas líneas...
+        c.fusionar(pedido)        # ...y se vuelve a pedir todo el pedido
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def probar_complejidad():
+    print_section("FUSIÓN DE PEDIDOS GRANDES")
+    c = Carrito((pid, 1) for pid in range(100))
+    c.fusionar((pid, 2) for pid in range(100))
+    comprobar("pedido de 100 líneas sobre un carrito de 100",
+              len(c) == 100 and all(q == 3 for _, q in c), c)
+
+    _medir_fusion(1000)  # calentamiento
+    t_1k = _medir_fusion(1000)
+    t_10k = _medir_fusion(10000)
+    proporcion = t_10k / t_1k if t_1k else 0
+    print(f"   1.000 líneas: {t_1k * 1000:.3f} ms, 10.000 líneas: {t_10k * 1000:.3f} ms "
+          f"(x{proporcion:.1f})")
+    # Lineal: x10. Con el recorrido cuadrático de antes sería ~x100.
+    comprobar("la fusión crece linealmente", proporcion < 30, f"(x{proporcion:.1f})")
+
+
+def main():
+    probar_operaciones()
+    probar_almacen()
+    probar_complejidad()
+
+    terminar("Carrito correcto")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+test_checkout.py
+Comprueba que el checkout es idempotente (migración 005): varios envíos
+simultáneos del mismo formulario (misma clave) crean un solo pedido y
+descuentan el stock una sola vez, y un reenvío posterior devuelve el mismo
+pedido sin escribir nada. Si el precio cambió desde que se mostró el total,
+no se cobra (PrecioCambiado).
+"""
+
+import sys
+import threading
+import uuid
+
+from bd_config import get_connection, get_direct_connection
+from benchmarks import (
+    ContadorConsultas, crear_usuario_bench, borrar_usuario_bench, crear_productos_bench, borrar_productos_bench,
+    exigir_bd_local, print_section
+)
+from comprobaciones import comprobar, terminar
+from pedidos_db import crear_pedido, PrecioCambiado
+
+ENVIOS = 8
+STOCK = 10
+
+
+def _stock(conn, ids):
+    return {r[0]: r[1] for r in conn.run("SELECT id, stock FROM productos WHERE id = ANY(:ids);", ids=ids)}
+
+
+def _pedidos(conn, id_usuario):
+    return [r[0] for r in conn.run("SELECT id FROM pedidos WHERE id_usuario = :uid;", uid=id_usuario)]
+
+
+def _envios_paralelos(id_usuario, carrito, clave):
+    """Lanza ENVIOS crear_pedido a la vez, cada uno con su conexión; devuelve (ids, errores)."""
+    barrera = threading.Barrier(ENVIOS)
+    resultados, errores = [], []
+
+    def enviar():
+        # Conexión propia: el pool del proceso tiene menos conexiones que envíos
+        conn = get_direct_connection()
+        try:
+            barrera.wait()
+            resultados.append(crear_pedido(conn, id_usuario, carrito, clave=clave))
+        except Exception as e:
+            errores.append(e)
+        finally:
+            conn.close()
+
+    hilos = [threading.Thread(target=enviar) for _ in range(ENVIOS)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return resultados, errores
+
+
+def probar_envios_simultaneos(conn, id_usuario, ids):
+    print_section(f"{ENVIOS} ENVÍOS SIMULTÁNEOS CON LA MISMA CLAVE")
+    carrito = [{"id": ids[0], "nombre": "a", "cantidad": 2}, {"id": ids[1], "nombre": "b", "cantidad": 1}]
+    clave = uuid.uuid4().hex
+    resultados, errores = _envios_paralelos(id_usuario, carrito, clave)
+
+    comprobar("ningún envío falla", not errores, errores)
+    comprobar("todos devuelven el mismo pedido", len(set(resultados)) == 1, resultados)
+    comprobar("se crea un solo pedido", len(_pedidos(conn, id_usuario)) == 1, _pedidos(conn, id_usuario))
+    stock = _stock(conn, ids)
+    comprobar("el stock se descuenta una vez",
+              stock == {ids[0]: STOCK - 2, ids[1]: STOCK - 1}, stock)
+    conn.rollback()
+    return carrito, clave, resultados[0] if resultados else None
+
+
+def probar_reenvio(conn, id_usuario, ids, carrito, clave, pedido_id):
+    print_section("REENVÍO POSTERIOR")
+    contador = ContadorConsultas(conn)
+    repetido = crear_pedido(contador, id_usuario, carrito, clave=clave)
+    comprobar("devuelve el pedido original", repetido == pedido_id, (repetido, pedido_id))
+    comprobar("no escribe (bloqueo + búsqueda de la clave)", contador.consultas == 2, contador.consultas)
+    comprobar("sigue habiendo un solo pedido", len(_pedidos(conn, id_usuario)) == 1)
+    comprobar("el stock no cambia", _stock(conn, ids) == {ids[0]: STOCK - 2, ids[1]: STOCK - 1})
+    conn.rollback()
+
+    otro = crear_pedido(conn, id_usuario, carrito, clave=uuid.uuid4().hex)
+    comprobar("otra clave crea otro pedido", otro != pedido_id and len(_pedidos(conn, id_usuario)) == 2)
+    conn.rollback()
+
+
+def probar_precio_cambiado(conn, id_usuario, ids):
+    print_section("EL PRECIO CAMBIA ANTES DE CONFIRMAR")
+    carrito = [{"id": ids[0], "nombre": "a", "cantidad": 1}]
+    mostrado = int(conn.run("SELECT precio FROM productos WHERE id = :id;", id=ids[0])[0][0])
+    conn.run("UPDATE productos SET precio = precio + 500 WHERE id = :id;", id=ids[0])
+    conn.commit()
+    antes, stock = _pedidos(conn, id_usuario), _stock(conn, ids)
+    conn.rollback()
+
+    try:
+        crear_pedido(conn, id_usuario, carrito, clave=uuid.uuid4().hex, total_esperado=mostrado)
+        error = None
+    except PrecioCambiado as e:
+        error = e
+    comprobar("lanza PrecioCambiado con el total nuevo", error is not None and error.total == mostrado + 500, error)
+    comprobar("no crea pedido ni toca el stock",
+              _pedidos(conn, id_usuario) == antes and _stock(conn, ids) == stock)
+    conn.rollback()
+
+    pedido = crear_pedido(conn, id_usuario, carrito, clave=uuid.uuid4().hex, total_esperado=mostrado + 500)
+    comprobar("con el total nuevo sí se cobra", pedido not in antes and len(_pedidos(conn, id_usuario)) == len(antes) + 1)
+    conn.rollback()
+
+
+def main():
+    exigir_bd_local()
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        sys.exit(1)
+
+    id_usuario = crear_usuario_bench(conn)
+    ids = crear_productos_bench(conn, 2, stock=STOCK)
+    try:
+        carrito, clave, pedido_id = probar_envios_simultaneos(conn, id_usuario, ids)
+        probar_reenvio(conn, id_usuario, ids, carrito, clave, pedido_id)
+        probar_precio_cambiado(conn, id_usuario, ids)
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        borrar_usuario_bench(conn, id_usuario)
+        borrar_productos_bench(conn, ids)
+        conn.close()
+
+    terminar("El checkout es idempotente", "¿Falta la migración 005?")
+
+
+if __name__ == "__main__":
+    main()
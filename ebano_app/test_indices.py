@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+test_indices.py
+Comprueba con EXPLAIN que las consultas calientes usan índices
+(migraciones 002, 003, 004 y 009) sobre un volumen de datos grande.
+Se analiza el SQL que ejecutan las rutas: las funciones de *_db.py y
+catalogo.py se llaman tal cual y las consultas de app.py se importan
+de los módulos donde viven (SQL_*).
+
+Siembra ~5.000 usuarios, 500 productos, 100.000 pedidos, 300.000 líneas y
+50.000 reseñas DENTRO de una transacción, ejecuta ANALYZE y EXPLAIN, y al
+final hace ROLLBACK: la base de datos queda exactamente como estaba.
+"""
+
+import json
+import sys
+
+from bd_config import get_connection
+from benchmarks import exigir_bd_local, print_section
+from catalogo import ORDENES_TIENDA, _SELECT_PRODUCTOS, _fila_a_producto
+from paginacion import paginar
+from pedidos_db import cargar_pedidos_usuario, preparar_recompra, pagina_pedidos_admin, ESTADOS_FINALES
+from resenas_db import (
+    pagina_resenas, resumen_resenas, invalidar_resenas, pagina_resenas_admin, SQL_RESENAS_USUARIO
+)
+from usuarios_db import pagina_clientes_admin, SQL_USUARIO_POR_ID, SQL_USUARIO_POR_CORREO
+
+USUARIOS = 5000
+PRODUCTOS = 500
+PEDIDOS = 100000
+RESENAS = 50000
+
+
+# ---------------------------------------------------------
+# EXPLAIN
+# ---------------------------------------------------------
+class ConexionExplain:
+    """
+    Envuelve una conexión: antes de cada consulta guarda su plan
+    (EXPLAIN FORMAT JSON) y después la ejecuta normalmente.
+    Permite analizar el SQL real de pedidos_db, resenas_db, etc.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.planes = []
+
+    def run(self, sql, **params):
+        plan = self._conn.run("EXPLAIN (FORMAT JSON) " + sql.strip().rstrip(";"), **params)[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        self.planes.append((sql, plan[0]["Plan"]))
+        return self._conn.run(sql, **params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def escaneos(plan):
+    """Lista de (tipo de nodo, tabla, índice) de los accesos a tablas del plan."""
+    resultado = []
+    for nodo in _nodos(plan):
+        tabla = nodo.get("Relation Name")
+        if "Scan" not in nodo["Node Type"] or not tabla:
+            continue
+        if nodo["Node Type"] == "Bitmap Heap Scan":
+            # El índice está en los nodos Bitmap Index Scan hijos (varios si hay BitmapOr/And)
+            for hijo in _nodos(nodo):
+                if hijo["Node Type"] == "Bitmap Index Scan":
+                    resultado.append((nodo["Node Type"], tabla, hijo["Index Name"]))
+        else:
+            resultado.append((nodo["Node Type"], tabla, nodo.get("Index Name")))
+    return resultado
+
+
+# ---------------------------------------------------------
+# DATOS DE PRUEBA
+# ---------------------------------------------------------
+def sembrar(conn):
+    print("🌱 Sembrando datos de prueba (dentro de la transacción)...")
+    conn.run("""
+        INSERT INTO usuarios (nombre_usuario, correo, contraseña, rol, nombre_completo, fecha_registro)
+        SELECT 'idx_' || g, 'idx_' || g || '@indices.local', 'x',
+               CASE WHEN g % 500 = 0 THEN 'admin' ELSE 'cliente' END,
+               'Usuario ' || g, NOW() - (g || ' minutes')::interval
+        FROM generate_series(1, CAST(:n AS INT)) g;
+    """, n=USUARIOS)
+    conn.run("""
+        INSERT INTO productos (nombre, descripcion, precio, stock)
+        SELECT 'Vino índice ' || g, 'Producto de prueba', 20000 + (g % 97) * 1000, g % 30
+        FROM generate_series(1, CAST(:n AS INT)) g;
+    """, n=PRODUCTOS)
+    # Los ids recién insertados son consecutivos: se reparten por aritmética
+    u0 = conn.run("SELECT MIN(id) FROM usuarios WHERE correo LIKE 'idx\\_%@indices.local';")[0][0]
+    p0 = conn.run("SELECT MIN(id) FROM productos WHERE nombre LIKE 'Vino índice %';")[0][0]
+    conn.run("""
+        INSERT INTO pedidos (id_usuario, fecha_pedido, total, estado)
+        SELECT CAST(:u0 AS INT) + g % CAST(:u AS INT), NOW() - (g || ' minutes')::interval, 100000,
+               (ARRAY['Pendiente', 'Enviado', 'Entregado', 'Cancelado'])[1 + g % 4]
+        FROM generate_series(1, CAST(:n AS INT)) g;
+    """, u0=u0, u=USUARIOS, n=PEDIDOS)
+    conn.run("""
+        INSERT INTO detalle_pedidos (id_pedido, id_producto, cantidad, subtotal)
+        SELECT p.id, CAST(:p0 AS INT) + (p.id + k) % CAST(:np AS INT), 1, 20000
+        FROM pedidos p
+        CROSS JOIN generate_series(0, 2) k
+        WHERE p.id_usuario >= :u0;
+    """, p0=p0, np=PRODUCTOS, u0=u0)
+    # Reseñas: pares (usuario, producto) distintos para respetar la restricción única
+    conn.run("""
+        INSERT INTO resenas (id_usuario, id_producto, comentario, calificacion, fecha)
+        SELECT u.id, pr.id, 'Reseña de prueba', 1 + (u.id + pr.id) % 5,
+               NOW() - ((u.id + pr.id) || ' minutes')::interval
+        FROM (SELECT id, row_number() OVER (ORDER BY id) rn FROM usuarios
+              WHERE correo LIKE 'idx\\_%@indices.local') u
+        JOIN (SELECT id, row_number() OVER (ORDER BY id) rn FROM productos
+              WHERE nombre LIKE 'Vino índice %') pr
+          ON (u.rn + pr.rn) % 50 = 0
+        LIMIT CAST(:n AS INT)
+        ON CONFLICT DO NOTHING;
+    """, n=RESENAS)
+    for tabla in ("usuarios", "productos", "pedidos", "detalle_pedidos", "resenas"):
+        conn.run(f"ANALYZE {tabla};")
+    conteos = conn.run("""
+        SELECT (SELECT COUNT(*) FROM usuarios), (SELECT COUNT(*) FROM productos),
+               (SELECT COUNT(*) FROM pedidos), (SELECT COUNT(*) FROM detalle_pedidos),
+               (SELECT COUNT(*) FROM resenas);
+    """)[0]
+    print("   usuarios={} productos={} pedidos={} detalle_pedidos={} resenas={}".format(*conteos))
+
+
+# ---------------------------------------------------------
+# CONSULTAS CALIENTES
+# ---------------------------------------------------------
+def consultas(conn):
+    """
+    Devuelve [(nombre, tabla que debe ir por índice, [planes])].
+    Cada consulta se ejecuta a través de ConexionExplain con el mismo SQL
+    que usa la ruta correspondiente.
+    """
+    uid = conn.run("SELECT id FROM usuarios WHERE correo = 'idx_42@indices.local';")[0][0]
+    pid = conn.run("SELECT MIN(id) FROM productos WHERE nombre LIKE 'Vino índice %';")[0][0]
+    pedido_id = conn.run("SELECT MIN(id) FROM pedidos WHERE id_usuario = :uid;", uid=uid)[0][0]
+    # Un cliente sembrado con pedidos finalizados (para que el historial llegue a las líneas)
+    uid_historial = conn.run("""
+        SELECT p.id_usuario FROM pedidos p JOIN usuarios u ON u.id = p.id_usuario
+        WHERE u.correo LIKE 'idx\\_%@indices.local' AND p.estado = ANY(:estados)
+        LIMIT 1;
+    """, estados=list(ESTADOS_FINALES))[0][0]
+    resultado = []
+
+    def con_explain(nombre, tabla, fn):
+        cx = ConexionExplain(conn)
+        fn(cx)
+        resultado.append((nombre, tabla, [plan for _, plan in cx.planes]))
+
+    def sql(nombre, tabla, query, **params):
+        con_explain(nombre, tabla, lambda cx: cx.run(query, **params))
+
+    # app.py: load_user / login (usuarios_db)
+    sql("load_user", "usuarios", SQL_USUARIO_POR_ID, id=uid)
+    sql("login por correo", "usuarios", SQL_USUARIO_POR_CORREO, correo="idx_42@indices.local")
+
+    # pedidos_db: /pedidos y /historial (pedidos + líneas)
+    con_explain("pedidos activos del usuario", "pedidos",
+                lambda cx: cargar_pedidos_usuario(cx, uid, finalizados=False))
+    con_explain("historial del usuario (pedidos + detalle)", "detalle_pedidos",
+                lambda cx: cargar_pedidos_usuario(cx, uid_historial, finalizados=True))
+
+    # pedidos_db: /recomprar/<id> (pedido + líneas + productos)
+    con_explain("recomprar (líneas del pedido)", "detalle_pedidos",
+                lambda cx: preparar_recompra(cx, pedido_id, uid))
+
+    # app.py: "Mis reseñas" (resenas_db). Crear reseña es un INSERT ... ON CONFLICT
+    # sobre la restricción única: no hay lectura previa que comprobar.
+    sql("mis reseñas", "resenas", SQL_RESENAS_USUARIO, uid=uid)
+
+    # resenas_db: detalle de producto (sin caché para que llegue a la BD)
+    def resenas_producto(cx):
+        invalidar_resenas(pid)
+        resumen_resenas(cx, pid)
+        pagina = pagina_resenas(cx, pid)
+        pagina_resenas(cx, pid, cursor=pagina.siguiente)
+        invalidar_resenas(pid)
+    con_explain("reseñas de producto (resumen + páginas 1 y 2)", "resenas", resenas_producto)
+
+    # catalogo: /tienda paginada en la BD (catálogos grandes), página 1 y 2 de cada orden
+    for nombre, orden in ORDENES_TIENDA.items():
+        def tienda(cx, orden=orden):
+            pagina = paginar(cx, _SELECT_PRODUCTOS, [], {}, orden, 12, fila_a_dict=_fila_a_producto)
+            paginar(cx, _SELECT_PRODUCTOS, [], {}, orden, 12, pagina.siguiente, fila_a_dict=_fila_a_producto)
+        con_explain(f"tienda orden={nombre} (páginas 1 y 2)", "productos", tienda)
+
+    # admin: gestionar_pedidos / gestionar_usuarios / gestionar_resenas, páginas 1 y 2
+    for nombre, tabla, listar in (("gestionar_pedidos", "pedidos", pagina_pedidos_admin),
+                                  ("gestionar_usuarios", "usuarios", pagina_clientes_admin),
+                                  ("gestionar_resenas", "resenas", pagina_resenas_admin)):
+        def admin(cx, listar=listar):
+            pagina = listar(cx)
+            listar(cx, cursor=pagina.siguiente)
+        con_explain(f"{nombre} (páginas 1 y 2)", tabla, admin)
+    return resultado
+
+
+# ---------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------
+def main():
+    exigir_bd_local()
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        sys.exit(1)
+
+    fallos = 0
+    try:
+        print_section("ÍNDICES DE LAS CONSULTAS CALIENTES (EXPLAIN)")
+        # pg8000 abre la transacción sola; nada se confirma (ROLLBACK al final)
+        sembrar(conn)
+
+        for nombre, tabla, planes in consultas(conn):
+            accesos = [e for plan in planes for e in escaneos(plan) if e[1] == tabla]
+            secuenciales = [e for e in accesos if e[0] == "Seq Scan"]
+            indices = sorted({e[2] for e in accesos if e[2]})
+            if secuenciales or not indices:
+                fallos += 1
+                print(f"❌ {nombre}: {tabla} sin índice -> {accesos}")
+            else:
+                print(f"✅ {nombre}: {tabla} vía {', '.join(indices)}")
+    finally:
+        # Deshace la siembra (y las estadísticas de ANALYZE)
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        conn.close()
+
+    print_section("RESULTADO")
+    if fallos:
+        print(f"❌ {fallos} consulta(s) sin índice. ¿Faltan migraciones? (migrations/002, 003, 004, 009)")
+        sys.exit(1)
+    print("✅ Todas las consultas calientes usan índices")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+test_limites.py
+Comprueba el storage compartido del rate limiter (limites_store.py): varios
+procesos que golpean el mismo límite conceden el cupo una sola vez, la
+ventana deslizante pondera la ventana anterior y la purga borra las claves
+caducadas.
+
+No usa la base de datos: trabaja sobre un archivo SQLite temporal.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from limites_store import conteo_deslizante
+from benchmarks import print_section
+from comprobaciones import comprobar, terminar
+
+PROCESOS = 4
+GOLPES = 20
+
+
+def _golpear(uri, q):
+    limitador = FixedWindowRateLimiter(storage_from_string(uri))
+    limite = parse("5 per minute")
+    q.put(sum(limitador.hit(limite, "login", "10.0.0.1") for _ in range(GOLPES)))
+
+
+def probar_varios_procesos(uri):
+    print_section(f"{PROCESOS} WORKERS CONTRA EL MISMO LÍMITE (5 por minuto)")
+    ctx = multiprocessing.get_context("fork")
+    q = ctx.Queue()
+    procesos = [ctx.Process(target=_golpear, args=(uri, q)) for _ in range(PROCESOS)]
+    for p in procesos:
+        p.start()
+    permitidos = sum(q.get() for _ in procesos)
+    for p in procesos:
+        p.join()
+    comprobar("se conceden 5 en total, no 5 por worker", permitidos == 5, permitidos)
+
+
+def probar_ventana_deslizante():
+    print_section("VENTANA DESLIZANTE")
+    inicio = 6000
+    # 10 peticiones en la ventana anterior, 2 en la actual, a un cuarto de ventana
+    comprobar("pondera la ventana anterior", conteo_deslizante(2, 10, inicio, 60, inicio + 15) == 2 + 7)
+    # Fila escrita por última vez en la ventana anterior: su "actual" pasa a "anterior"
+    comprobar("la ventana anterior sin escrituras nuevas cuenta",
+              conteo_deslizante(10, 0, inicio - 60, 60, inicio + 30) == 5)
+    comprobar("dos ventanas atrás ya no cuenta", conteo_deslizante(10, 10, inicio - 120, 60, inicio + 1) == 0)
+
+
+def probar_purga(uri):
+    print_section("PURGA DE CLAVES CADUCADAS")
+    storage = storage_from_string(uri)
+    storage.reset()
+    for i in range(50):
+        storage.incr(f"vieja_{i}", 1)
+    storage.incr("viva", 3600)
+    time.sleep(2.1)
+    borradas = storage.purgar(lote=7)
+    comprobar("borra las caducadas en lotes", borradas == 50, borradas)
+    comprobar("conserva las vigentes", storage.get("viva") == 1, storage.get("viva"))
+    storage.clear("viva")
+    comprobar("clear() borra una clave", storage.get("viva") == 0)
+
+
+def main():
+    uri = f"sqlite://{os.path.join(tempfile.mkdtemp(prefix='test_limites_'), 'limites.sqlite3')}"
+    probar_varios_procesos(uri)
+    probar_ventana_deslizante()
+    probar_purga(uri)
+
+    terminar("Los límites se comparten entre workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -142,6 +142,52 @@ def check_jwt_generation():
         traceback.print_exc()
         return False
 
+def check_embed_tokens():
+    """Verifica los tokens de metabase_embed.py: firma válida y caché"""
+    print_section("4. TOKENS DE EMBED (metabase_embed.py)")
+
+    try:
+        import jwt
+        import metabase_embed
+    except ImportError as e:
+        print(f"\n❌ ERROR: {e}")
+        return False
+
+    ok = True
+    for nombre, tablero in metabase_embed.TABLEROS.items():
+        if tablero.params_usuario:
+            print(f"\n   ⏭️  {nombre}: necesita un usuario, se omite")
+            continue
+        try:
+            url = metabase_embed.url_tablero(nombre)
+            token = url.split("/embed/dashboard/", 1)[1].split("#", 1)[0]
+            # La app no verifica la firma en cada visita: se comprueba aquí
+            decoded = jwt.decode(token, metabase_embed.METABASE_SECRET_KEY, algorithms=["HS256"], leeway=10)
+            print(f"\n   ✅ {nombre}: dashboard {decoded['resource']['dashboard']}, "
+                  f"vence en {decoded['exp'] - int(time.time())} s")
+        except Exception as e:
+            print(f"\n   ❌ {nombre}: {type(e).__name__}: {e}")
+            ok = False
+            continue
+
+        inicio = time.perf_counter()
+        for _ in range(1000):
+            repetida = metabase_embed.url_tablero(nombre)
+        us = (time.perf_counter() - inicio) * 1000
+        if repetida == url:
+            print(f"   ✅ Token reutilizado desde la caché ({us:.1f} µs por visita)")
+        else:
+            print("   ❌ Cada visita firma un token nuevo")
+            ok = False
+
+    try:
+        metabase_embed.url_tablero("__no_existe__")
+        print("\n   ❌ Un tablero desconocido no da error")
+        ok = False
+    except metabase_embed.TableroDesconocido:
+        print("\n   ✅ Un tablero desconocido lanza TableroDesconocido")
+    return ok
+
 def print_recommendations():
     """Imprime recomendaciones finales"""
     print_section("RECOMENDACIONES Y PRÓXIMOS PASOS")
@@ -227,15 +273,19 @@ def main():
         print("\n❌ ERROR: No se puede generar token JWT")
         sys.exit(1)
     
-    # Paso 4: Resumen final
+    # Paso 4: Tokens de embed de la app
+    embed_ok = check_embed_tokens()
+    
+    # Paso 5: Resumen final
     print_section("RESUMEN DEL DIAGNÓSTICO")
     
     print("\n📊 Estado de los componentes:")
     print(f"   Variables de entorno: ✅")
     print(f"   Servicio Metabase: {'✅' if service_ok else '⚠️  (verificar)'}")
     print(f"   Generación JWT: {'✅' if jwt_ok else '❌'}")
+    print(f"   Tokens de embed: {'✅' if embed_ok else '❌'}")
     
-    if service_ok and jwt_ok:
+    if service_ok and jwt_ok and embed_ok:
         print("\n🎉 ¡TODO CONFIGURADO CORRECTAMENTE!")
         print("\n   Puedes acceder al dashboard en:")
         print(f"   {url}")
@@ -244,7 +294,7 @@ def main():
     else:
         print("\n⚠️  Algunos componentes necesitan atención")
     
-    # Paso 5: Recomendaciones
+    # Paso 6: Recomendaciones
     print_recommendations()
 
 if __name__ == "__main__":
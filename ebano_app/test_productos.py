@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+test_productos.py
+Comprueba las ediciones del admin con concurrencia optimista (migración 007,
+productos_db.py): una edición de stock no pisa las ventas hechas mientras
+el formulario estaba abierto, dos admins que cambian el precio a la vez dan
+conflicto y uno que solo cambia stock se reintenta sobre la versión nueva.
+También aplica un CSV de LOTE_FILAS productos en una transacción y comprueba
+que un lote con una fila inválida no aplica nada.
+"""
+
+import sys
+import threading
+import time
+from decimal import Decimal
+
+from bd_config import get_connection, get_direct_connection
+from benchmarks import (
+    crear_usuario_bench, borrar_usuario_bench, crear_productos_bench, borrar_productos_bench,
+    exigir_bd_local, print_section
+)
+from comprobaciones import comprobar, terminar
+from pedidos_db import crear_pedido
+from productos_db import (
+    actualizar_producto, ConflictoProducto, actualizar_productos_lote, cambios_desde_csv, cambios_desde_formulario
+)
+
+STOCK = 100
+VENTAS = 20
+LOTE_FILAS = 10000
+
+
+def _formulario(conn, pid):
+    """(version, stock, precio) como los muestra gestionar_productos."""
+    r = conn.run("SELECT version, stock, precio FROM productos WHERE id = :id;", id=pid)[0]
+    conn.rollback()
+    return r[0], r[1], r[2]
+
+
+def probar_stock_con_ventas(conn, id_usuario, pid):
+    print_section(f"EDICIÓN DE STOCK MIENTRAS SE VENDEN {VENTAS} UNIDADES")
+    version, stock, _ = _formulario(conn, pid)
+
+    def vender():
+        c = get_direct_connection()
+        try:
+            for _ in range(VENTAS // 4):
+                crear_pedido(c, id_usuario, [{"id": pid, "nombre": "x", "cantidad": 1}])
+        finally:
+            c.close()
+
+    hilos = [threading.Thread(target=vender) for _ in range(4)]
+    for h in hilos:
+        h.start()
+    # El admin repone 50 unidades sobre lo que vio en el formulario
+    actualizado = actualizar_producto(conn, pid, version, stock, stock + 50)
+    for h in hilos:
+        h.join()
+
+    _, final, _ = _formulario(conn, pid)
+    comprobar("la edición se aplica", actualizado is not None)
+    comprobar("no se pierden ventas ni reposición", final == STOCK + 50 - VENTAS, final)
+
+
+def probar_precio_concurrente(conn, pid):
+    print_section("DOS ADMINS CAMBIAN EL PRECIO")
+    version, stock, precio = _formulario(conn, pid)
+    actualizar_producto(conn, pid, version, stock, stock, precio, Decimal("95000"))
+    try:
+        actualizar_producto(conn, pid, version, stock, stock, precio, Decimal("99000"))
+        comprobar("el segundo cambio de precio da conflicto", False)
+    except ConflictoProducto as e:
+        comprobar("el segundo cambio de precio da conflicto", e.actual and e.actual["version"] == version + 1)
+
+    _, _, precio_final = _formulario(conn, pid)
+    comprobar("se conserva el primer precio", int(precio_final) == 95000, precio_final)
+
+    # Con la versión vieja, pero solo cambiando stock: se reintenta y se aplica
+    actualizado = actualizar_producto(conn, pid, version, stock, stock + 1, precio, precio)
+    comprobar("un cambio de solo stock se reintenta",
+              actualizado is not None and actualizado["stock"] == stock + 1, actualizado)
+
+    try:
+        actualizar_producto(conn, pid, actualizado["version"], stock + 1, -1)
+        comprobar("no deja el stock negativo", False)
+    except ConflictoProducto:
+        comprobar("no deja el stock negativo", True)
+
+
+def probar_lote(conn):
+    print_section(f"EDICIÓN MASIVA DE {LOTE_FILAS} PRODUCTOS")
+    ids = crear_productos_bench(conn, LOTE_FILAS, stock=5, precio=1000)
+    try:
+        texto = "id,stock,precio\n" + "".join(f"{pid},{i % 40},{2000 + i}\n" for i, pid in enumerate(ids))
+        inicio = time.perf_counter()
+        cambios, errores = cambios_desde_csv(texto)
+        resultado = actualizar_productos_lote(conn, cambios)
+        ms = (time.perf_counter() - inicio) * 1000
+        print(f"   CSV de {LOTE_FILAS} filas aplicado en {ms:.0f} ms")
+        comprobar("el CSV se valida sin errores", not errores, errores[:3])
+        comprobar("se aplican todas las filas", resultado.ok and resultado.aplicados == LOTE_FILAS,
+                  (resultado.aplicados, resultado.errores[:3]))
+        stock, precio = conn.run("SELECT stock, precio FROM productos WHERE id = :id;", id=ids[-1])[0]
+        conn.rollback()
+        comprobar("stock y precio quedan como en el CSV",
+                  stock == (LOTE_FILAS - 1) % 40 and int(precio) == 2000 + LOTE_FILAS - 1, (stock, precio))
+
+        # Una fila con un producto inexistente: no se aplica nada
+        cambios, _ = cambios_desde_csv(f"id,stock\n{ids[0]},99\n{ids[1]},99\n0,1\n")
+        resultado = actualizar_productos_lote(conn, cambios)
+        stock = conn.run("SELECT stock FROM productos WHERE id = :id;", id=ids[0])[0][0]
+        conn.rollback()
+        comprobar("un lote con errores no aplica nada", not resultado.ok and stock == 0,
+                  (resultado.errores, stock))
+
+        # Tabla: precio con versión vieja -> conflicto de esa fila
+        version = conn.run("SELECT version FROM productos WHERE id = :id;", id=ids[2])[0][0]
+        conn.rollback()
+        form = {
+            f"stock_{ids[2]}": "7", f"stock_original_{ids[2]}": "2",
+            f"precio_{ids[2]}": "5000", f"precio_original_{ids[2]}": "2002", f"version_{ids[2]}": str(version - 1),
+        }
+        cambios, errores = cambios_desde_formulario(form)
+        resultado = actualizar_productos_lote(conn, cambios)
+        comprobar("la tabla informa el conflicto de versión por fila",
+                  len(resultado.errores) == 1 and resultado.errores[0][0] == f"#{ids[2]}", resultado.errores)
+    finally:
+        conn.rollback()
+        borrar_productos_bench(conn, ids)
+
+
+def main():
+    exigir_bd_local()
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        sys.exit(1)
+
+    id_usuario = crear_usuario_bench(conn)
+    pid = crear_productos_bench(conn, stock=STOCK, precio=90000)[0]
+    try:
+        probar_stock_con_ventas(conn, id_usuario, pid)
+        probar_precio_concurrente(conn, pid)
+        probar_lote(conn)
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        borrar_usuario_bench(conn, id_usuario)
+        borrar_productos_bench(conn, [pid])
+        conn.close()
+
+    terminar("Las ediciones del admin no pisan el inventario", "¿Falta la migración 007?")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+test_registro.py
+Prueba de carga del registro (usuarios_db.py): cientos de altas simultáneas
+con correos repetidos y partes locales compartidas ("ana@a.test",
+"ana@b.test", ...) no dan ningún error, cada correo crea una sola cuenta y
+los nombres de usuario son únicos y deterministas.
+"""
+
+import hashlib
+import sys
+import threading
+import time
+import uuid
+
+from bd_config import get_connection, get_direct_connection
+from benchmarks import exigir_bd_local, print_section
+from comprobaciones import comprobar, terminar
+from usuarios_db import registrar_usuario, CorreoYaRegistrado
+
+LOCALES = 10      # partes locales distintas
+DOMINIOS = 20     # cada parte local se registra en todos los dominios
+ENVIOS = 2        # cada correo se envía dos veces
+HILOS = 40
+
+
+def probar_altas_simultaneas(conn, etiqueta):
+    correos = [f"r{etiqueta}_{l}@bench-reg-{etiqueta}-{d}.test" for l in range(LOCALES) for d in range(DOMINIOS)]
+    envios = [c for c in correos for _ in range(ENVIOS)]
+    print_section(f"{len(envios)} REGISTROS SIMULTÁNEOS ({len(correos)} correos, {HILOS} conexiones)")
+    barrera = threading.Barrier(HILOS)
+    creados, repetidos, errores = [], [], []
+
+    def registrar(mios):
+        c = get_direct_connection()
+        try:
+            barrera.wait()
+            for correo in mios:
+                try:
+                    creados.append((correo, registrar_usuario(c, correo, "x", "Usuario Benchmark", "", "CA", "")))
+                except CorreoYaRegistrado:
+                    repetidos.append(correo)
+                except Exception as e:
+                    errores.append(e)
+        finally:
+            c.close()
+
+    hilos = [threading.Thread(target=registrar, args=(envios[i::HILOS],)) for i in range(HILOS)]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    ms = (time.perf_counter() - inicio) * 1000
+    print(f"   {len(envios)} registros en {ms:.0f} ms")
+
+    comprobar("ningún registro falla", not errores, errores[:3])
+    comprobar("una cuenta por correo", sorted(c for c, _ in creados) == sorted(correos), len(creados))
+    comprobar("el segundo envío de cada correo se rechaza", len(repetidos) == len(correos) * (ENVIOS - 1),
+              len(repetidos))
+
+    filas = conn.run("SELECT correo, nombre_usuario FROM usuarios WHERE correo LIKE :p;",
+                     p=f"%@bench-reg-{etiqueta}-%")
+    conn.rollback()
+    nombres = [n for _, n in filas]
+    comprobar("nombres de usuario únicos", len(set(nombres)) == len(nombres) == len(correos))
+    # Cada parte local: una cuenta con el nombre "limpio", el resto con el sufijo de su correo
+    esperados = all(
+        n == c.split("@")[0] or n == f"{c.split('@')[0]}_{hashlib.md5(c.encode()).hexdigest()[:6]}"
+        for c, n in filas
+    )
+    limpios = sum(1 for c, n in filas if n == c.split("@")[0])
+    comprobar("sufijos deterministas", esperados and limpios == LOCALES, limpios)
+
+
+def main():
+    exigir_bd_local()
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        sys.exit(1)
+
+    etiqueta = uuid.uuid4().hex[:8]
+    try:
+        probar_altas_simultaneas(conn, etiqueta)
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        conn.run("DELETE FROM usuarios WHERE correo LIKE :p;", p=f"%@bench-reg-{etiqueta}-%")
+        conn.commit()
+        conn.close()
+
+    terminar("El registro no tiene carreras")
+
+
+if __name__ == "__main__":
+    main()
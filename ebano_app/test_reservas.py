@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+test_reservas.py
+Comprueba las reservas de stock (migración 006, reservas.py): cientos de
+carritos reservando a la vez un producto de edición limitada nunca reservan
+más que su stock, cambios simultáneos del mismo carrito reservan una sola
+vez, el checkout convierte las reservas en el pedido y el barrido devuelve
+las vencidas.
+"""
+
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bd_config import get_connection, get_direct_connection
+from benchmarks import (
+    crear_usuario_bench, borrar_usuario_bench, crear_productos_bench, borrar_productos_bench,
+    exigir_bd_local, print_section
+)
+from comprobaciones import comprobar, terminar
+from carrito_store import Carrito
+from pedidos_db import crear_pedido, StockInsuficiente
+from reservas import reservar_carrito, liberar_carrito, barrer_vencidas
+
+CARRITOS = 300
+HILOS = 40   # conexiones simultáneas (cada una reserva para varios carritos)
+STOCK = 50
+
+
+def _estado(conn, pid):
+    """(stock, reservado, suma de reservas_stock) del producto."""
+    fila = conn.run("""
+        SELECT p.stock, p.reservado,
+               (SELECT COALESCE(SUM(cantidad), 0) FROM reservas_stock WHERE id_producto = p.id)
+        FROM productos p WHERE p.id = :id;
+    """, id=pid)[0]
+    conn.rollback()
+    return tuple(fila)
+
+
+def probar_reservas_simultaneas(conn, pid):
+    print_section(f"{CARRITOS} CARRITOS RESERVAN A LA VEZ ({STOCK} UNIDADES, {HILOS} CONEXIONES)")
+    cids = [f"bench_{uuid.uuid4().hex[:12]}" for _ in range(CARRITOS)]
+    barrera = threading.Barrier(HILOS)
+    reservadas, errores = {}, []
+
+    def reservar(mis_cids):
+        c = get_direct_connection()
+        try:
+            barrera.wait()
+            for cid in mis_cids:
+                carrito = Carrito([(pid, 1)])
+                reservar_carrito(c, cid, carrito)
+                reservadas[cid] = carrito.cantidad(pid)
+        except Exception as e:
+            errores.append(e)
+        finally:
+            c.close()
+
+    hilos = [threading.Thread(target=reservar, args=(cids[i::HILOS],)) for i in range(HILOS)]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    ms = (time.perf_counter() - inicio) * 1000
+
+    con_unidad = [cid for cid, qty in reservadas.items() if qty == 1]
+    stock, reservado, suma = _estado(conn, pid)
+    comprobar("ninguna reserva falla", not errores, errores[:3])
+    comprobar(f"exactamente {STOCK} carritos consiguen unidad", len(con_unidad) == STOCK, len(con_unidad))
+    comprobar("reservado == suma de reservas == stock", reservado == suma == STOCK, (stock, reservado, suma))
+    print(f"   {CARRITOS} reservas en {ms:.0f} ms")
+    return con_unidad, [cid for cid in cids if cid not in con_unidad]
+
+
+def probar_mismo_carrito(conn, pid):
+    print_section(f"{HILOS} CAMBIOS SIMULTÁNEOS DEL MISMO CARRITO (doble clic)")
+    cid = f"bench_{uuid.uuid4().hex[:12]}"
+    barrera = threading.Barrier(HILOS)
+    errores = []
+
+    def reservar():
+        c = get_direct_connection()
+        try:
+            barrera.wait()
+            reservar_carrito(c, cid, Carrito([(pid, 2)]))
+        except Exception as e:
+            errores.append(e)
+        finally:
+            c.close()
+
+    hilos = [threading.Thread(target=reservar) for _ in range(HILOS)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    stock, reservado, suma = _estado(conn, pid)
+    comprobar("ningún cambio falla", not errores, errores[:3])
+    comprobar("se reserva una sola vez", reservado == suma == 2, (reservado, suma))
+    liberar_carrito(conn, cid)
+    stock, reservado, suma = _estado(conn, pid)
+    comprobar("liberar lo devuelve todo", reservado == suma == 0, (reservado, suma))
+
+
+def probar_checkout(conn, id_usuario, pid, con_unidad, sin_unidad):
+    print_section("CHECKOUT CON Y SIN RESERVA")
+    carrito = [{"id": pid, "nombre": "x", "cantidad": 1}]
+    try:
+        crear_pedido(conn, id_usuario, carrito, id_carrito=sin_unidad[0])
+        comprobar("sin reserva no se compra lo reservado por otros", False)
+    except StockInsuficiente:
+        comprobar("sin reserva no se compra lo reservado por otros", True)
+
+    pedido = crear_pedido(conn, id_usuario, carrito, id_carrito=con_unidad[0])
+    stock, reservado, suma = _estado(conn, pid)
+    comprobar("con reserva se compra", pedido is not None)
+    comprobar("la reserva pasa al pedido",
+              (stock, reservado, suma) == (STOCK - 1, STOCK - 1, STOCK - 1), (stock, reservado, suma))
+
+
+def probar_liberar_y_barrer(conn, pid, con_unidad):
+    print_section("LIBERAR Y BARRER")
+    liberar_carrito(conn, con_unidad[1])
+    stock, reservado, suma = _estado(conn, pid)
+    comprobar("vaciar un carrito libera su reserva", reservado == suma == STOCK - 2, (reservado, suma))
+
+    # Vencer todas las reservas restantes y barrerlas en lotes pequeños
+    conn.run("UPDATE reservas_stock SET expira_en = :t WHERE id_producto = :id;",
+             t=datetime.now() - timedelta(minutes=1), id=pid)
+    conn.commit()
+    reservas, unidades = barrer_vencidas(conn, lote=7)
+    stock, reservado, suma = _estado(conn, pid)
+    # >=: el barrido también libera vencidas ajenas a esta prueba
+    comprobar("el barrido libera todas las vencidas", reservas >= STOCK - 2 and unidades >= STOCK - 2,
+              (reservas, unidades))
+    comprobar("no queda nada reservado", reservado == suma == 0, (reservado, suma))
+
+
+def main():
+    exigir_bd_local()
+    conn = get_connection()
+    if not conn:
+        print("❌ No se pudo conectar a la base de datos")
+        sys.exit(1)
+
+    id_usuario = crear_usuario_bench(conn)
+    pid = crear_productos_bench(conn, stock=STOCK, precio=90000)[0]
+    try:
+        probar_mismo_carrito(conn, pid)
+        con_unidad, sin_unidad = probar_reservas_simultaneas(conn, pid)
+        if len(con_unidad) >= 2 and sin_unidad:
+            probar_checkout(conn, id_usuario, pid, con_unidad, sin_unidad)
+            probar_liberar_y_barrer(conn, pid, con_unidad)
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        borrar_usuario_bench(conn, id_usuario)
+        borrar_productos_bench(conn, [pid])
+        conn.close()
+
+    terminar("Las reservas nunca superan el stock", "¿Falta la migración 006?")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+usuarios_db.py
+Alta de usuarios sin carreras entre registros simultáneos y listado de
+clientes del panel de administración.
+"""
+
+from paginacion import ADMIN_PAGE_SIZE, OrdenKeyset, paginar
+
+REGISTRO_REINTENTOS = 3
+
+# Consultas de sesión (load_user y login en app.py; test_indices.py comprueba su plan)
+SQL_USUARIO_POR_ID = "SELECT id, nombre_usuario, correo, rol, nombre_completo FROM usuarios WHERE id = :id;"
+SQL_USUARIO_POR_CORREO = """
+    SELECT id, nombre_usuario, correo, contraseña, rol, nombre_completo
+    FROM usuarios
+    WHERE correo = :correo;
+"""
+
+
+class CorreoYaRegistrado(Exception):
+    """Ya existe una cuenta con ese correo. No se escribió nada."""
+
+
+def registrar_usuario(conn, correo, contrasena_hash, nombre_completo, telefono, estado, direccion,
+                      pais="United States", rol="cliente"):
+    """
+    Crea el usuario y devuelve (id, nombre_usuario). Hace commit.
+
+    Una sola sentencia elige el nombre de usuario, inserta y dice si el correo
+    ya existía (INSERT ... ON CONFLICT DO NOTHING), así que dos registros
+    simultáneos del mismo correo no dan un error 500: uno crea la cuenta y el
+    otro recibe CorreoYaRegistrado.
+
+    El nombre de usuario es la parte local del correo; si ya está tomado se le
+    añade un sufijo que depende solo del correo (6 caracteres de su md5, o 12
+    si también están tomados). Si otro registro se queda con el mismo nombre
+    entre la elección y el INSERT, la sentencia no inserta nada y se repite
+    (como mucho REGISTRO_REINTENTOS veces); la repetición ya ve ese nombre
+    ocupado y usa el sufijo.
+    """
+    base = correo.split("@")[0]
+    for _ in range(REGISTRO_REINTENTOS):
+        id_usuario, nombre_usuario, existia = conn.run("""
+            WITH candidatos (orden, nombre) AS (
+                VALUES (1, left(:base, 50)),
+                       (2, left(:base, 43) || '_' || left(md5(:correo), 6)),
+                       (3, left(:base, 37) || '_' || left(md5(:correo), 12))
+            ),
+            libre AS (
+                SELECT c.nombre FROM candidatos c
+                WHERE NOT EXISTS (SELECT 1 FROM usuarios u WHERE u.nombre_usuario = c.nombre)
+                ORDER BY c.orden
+                LIMIT 1
+            ),
+            nuevo AS (
+                INSERT INTO usuarios
+                    (nombre_usuario, correo, contraseña, rol, nombre_completo, telefono, estado, direccion, pais)
+                SELECT nombre, :correo, :hash, :rol, :nombre_completo, :telefono, :estado, :direccion, :pais
+                FROM libre
+                ON CONFLICT DO NOTHING
+                RETURNING id, nombre_usuario
+            )
+            SELECT (SELECT id FROM nuevo),
+                   (SELECT nombre_usuario FROM nuevo),
+                   EXISTS (SELECT 1 FROM usuarios WHERE correo = :correo);
+        """, base=base, correo=correo, hash=contrasena_hash, rol=rol, nombre_completo=nombre_completo,
+            telefono=telefono, estado=estado, direccion=direccion, pais=pais)[0]
+
+        if id_usuario is not None:
+            conn.commit()
+            return id_usuario, nombre_usuario
+        conn.rollback()
+        if existia:
+            raise CorreoYaRegistrado(correo)
+        # Conflicto con un registro confirmado durante esta sentencia (mismo
+        # correo o mismo nombre): la próxima ya lo ve
+
+    raise RuntimeError(f"No se pudo asignar nombre de usuario a {correo}")
+
+
+# ---------------------------------------------------------
+# LISTADO DE ADMIN (gestionar_usuarios)
+# ---------------------------------------------------------
+# Recorre idx_usuarios_rol_fecha_id (migración 009) desde el cursor
+ORDEN_CLIENTES_ADMIN = OrdenKeyset([("fecha_registro", "fecha_registro", "TIMESTAMP"), ("id", "id", "INT")],
+                                   descendente=True)
+SELECT_CLIENTES_ADMIN = """
+    SELECT id, nombre_usuario, correo, nombre_completo, telefono, direccion, fecha_registro, estado
+    FROM usuarios
+"""
+
+
+def _fila_a_cliente_admin(r):
+    return {
+        "id": r[0],
+        "nombre_usuario": r[1],
+        "correo": r[2],
+        "nombre_completo": r[3] or r[1],
+        "telefono": r[4] or "No registrado",
+        "direccion": r[5] or "No registrada",
+        "fecha_registro": r[6],
+        "estado": r[7],
+    }
+
+
+def pagina_clientes_admin(conn, cursor=None, limite=ADMIN_PAGE_SIZE):
+    """Una página de clientes, registrados más recientemente primero."""
+    return paginar(conn, SELECT_CLIENTES_ADMIN, ["rol = :rol"], {"rol": "cliente"},
+                   ORDEN_CLIENTES_ADMIN, limite, cursor, fila_a_dict=_fila_a_cliente_admin)